@@ -109,13 +109,13 @@ methods and attributes::
     >>> item.line
         'if (da .eq. 0.0d0) return'
     >>> item.strline
-        'if (F2PY_EXPR_TUPLE_5) return'
+        'if (F2PY_EXPR_TUPLE_1) return'
     >>> item.strlinemap
-        {'F2PY_EXPR_TUPLE_5': 'da .eq. 0.0d0'}
+        {'F2PY_EXPR_TUPLE_1': 'da .eq. 0.0d0'}
     >>> item.span
         (12, 12)
     >>> item.get_line()
-        'if (F2PY_EXPR_TUPLE_5) return'
+        'if (F2PY_EXPR_TUPLE_1) return'
 
 To read a Fortran code from a string, use `FortranStringReader` class::
 
@@ -140,17 +140,20 @@ To read a Fortran code from a string, use `FortranStringReader` class::
 
 from __future__ import print_function
 
+import array
+import collections
+import locale
 import logging
+import mmap
 import os
 import re
 import sys
+import threading
 import traceback
 import six
 import fparser.common.sourceinfo
 from fparser.common.splitline import String, string_replace_map, splitquote
 
-logging.getLogger(__name__).setLevel(logging.DEBUG)
-
 __all__ = ['FortranFileReader',
            'FortranStringReader',
            'FortranReaderError',
@@ -158,14 +161,43 @@ __all__ = ['FortranFileReader',
            'SyntaxErrorLine',
            'Comment',
            'MultiLine',
-           'SyntaxErrorMultiLine']
+           'SyntaxErrorMultiLine',
+           'Diagnostic']
 
 _SPACEDIGITS = ' 0123456789'
 _CF2PY_RE = re.compile(r'(?P<indent>\s*)!f2py(?P<rest>.*)', re.I)
 _LABEL_RE = re.compile(r'\s*(?P<label>\d+)\s*(\b|(?=&)|\Z)', re.I)
 _CONSTRUCT_NAME_RE = re.compile(r'\s*(?P<name>\w+)\s*:\s*(\b|(?=&)|\Z)', re.I)
+# For fixed-format lines: the spaces and digits at the start of the
+# label field, statement lines with a label field of only spaces and
+# digits and something after column 6, and the characters that need
+# the general handling of such lines.
+_FIXED_LABEL_FIELD = re.compile(r'[ \d]{0,5}').match
+_IS_FIXED_STATEMENT = re.compile(r'[ \d]{5}.\s*\S').match
+_HAS_FIXED_SPECIAL = re.compile(r'[!\'":]').search
 _IS_INCLUDE_LINE = re.compile(r'\s*include\s*("[^"]+"'
                               + r'|\'[^\']+\')\s*\Z', re.I).match
+# Free-format lines that need none of the processing of
+# get_source_item: blank lines and statements without a label,
+# continuation, quote, statement separator or in-line comment...
+_IS_FREE_SIMPLE_LINE = re.compile(r'\s*(?:[^\d\s\'"&;!][^\'"&;!]*)?\Z').match
+# ...and comment lines that are not f2py directives.
+_IS_FREE_COMMENT_LINE = re.compile(r'\s*!(?!f2py)', re.I).match
+
+# The items read from INCLUDE files, shared by all readers so that a file
+# included many times is only read once (see FortranReaderBase.include).
+# Entries are keyed by the path of the file, the include directories and
+# whether comments are ignored, and are used while every INCLUDE line
+# read for them still finds the same file, unchanged (see
+# _include_stamp). The least recently used entry is dropped once there
+# are too many. Each item refers to the reader that read it (for its
+# messages) so an entry keeps the lines of the files it was read from
+# until it is dropped.
+_INCLUDE_CACHE = collections.OrderedDict()
+_INCLUDE_CACHE_SIZE = 256
+# Readers may be used in several threads at once so the table above is
+# only used while holding this lock.
+_INCLUDE_LOCK = threading.Lock()
 
 
 def _is_fix_cont(line):
@@ -209,6 +241,53 @@ _HOLLERITH_START_SEARCH = re.compile(r'(?P<pre>\A|,\s*)'
 _IS_CALL_STMT = re.compile(r'call\b', re.I).match
 
 
+def _find_include(filename, include_dirs):
+    '''
+    Find an include file, searching the include directories in order.
+
+    :param str filename: the name of the file in the INCLUDE line.
+    :param list include_dirs: the directories to look for the file in.
+
+    :returns: the path of the file or None if it is not found.
+    :rtype: str or NoneType
+
+    '''
+    path = filename
+    for incl_dir in include_dirs:
+        path = os.path.join(incl_dir, filename)
+        if os.path.exists(path):
+            break
+    if not os.path.isfile(path):
+        return None
+    return path
+
+
+def _include_stamp(filename, include_dirs):
+    '''
+    Find an include file (see :py:func:`_find_include`) and record what
+    was found, so that it can be checked later that the same INCLUDE
+    line still finds the same file, unchanged.
+
+    :param str filename: the name of the file in the INCLUDE line.
+    :param list include_dirs: the directories to look for the file in.
+
+    :returns: the name of the file, the include directories and the \
+              path, modification time and size of the file that is \
+              found (or None for each of these if it is not found).
+    :rtype: tuple
+
+    '''
+    stamp = (filename, tuple(include_dirs))
+    path = _find_include(filename, include_dirs)
+    if path is not None:
+        try:
+            stat = os.stat(path)
+            return stamp + (path, stat.st_mtime, stat.st_size)
+        except OSError:
+            pass
+    return stamp + (None, None, None)
+
+
 class FortranReaderError(Exception):
     '''
     Thrown when there is an error reading the Fortran source file.
@@ -254,6 +333,23 @@ class Line(object):
         self.is_f2py_directive = linenospan[0] in reader.f2py_comment_lines
         self.parse_cache = {}
 
+    def __getstate__(self):
+        '''
+        A pickled line is detached from its reader. Its text, span, label
+        and construct name are kept but the cached results of parsing it
+        are not.
+        '''
+        state = self.__dict__.copy()
+        state['reader'] = None
+        for name in ('parse_cache', 'strline', 'strlinemap'):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.strline = None
+        self.parse_cache = {}
+
     def has_map(self):
         '''
         Returns true when a substitution map has been registered.
@@ -406,6 +502,14 @@ class Comment(object):
         # we might want to check the contents in a consistent way.
         self.line = comment
 
+    def __getstate__(self):
+        '''
+        The reader is not pickled with this comment.
+        '''
+        state = self.__dict__.copy()
+        state['reader'] = None
+        return state
+
     def __repr__(self):
         return self.__class__.__name__+'(%r,%s)' \
                % (self.comment, self.span)
@@ -445,6 +549,14 @@ class MultiLine(object):
         self.span = linenospan
         self.reader = reader
 
+    def __getstate__(self):
+        '''
+        The reader is not pickled with this multi-line.
+        '''
+        state = self.__dict__.copy()
+        state['reader'] = None
+        return state
+
     def __repr__(self):
         string = '{cls}({prefix!r},{block},{suffix!r},{span})'
         return string.format(cls=self.__class__.__name__,
@@ -470,6 +582,48 @@ class SyntaxErrorMultiLine(MultiLine, FortranReaderError):
         FortranReaderError.__init__(self, message)
 
 
+class Diagnostic(object):
+    '''
+    A message about the source being read. The message is only shown
+    with the lines of source that it refers to when it is turned into
+    a string, which the logging module does when (and only when) a
+    handler emits it.
+
+    :param str kind: the kind of message, e.g. 'WARNING'.
+    :param str message: the text of the message.
+    :param linenospan: the numbers of the first and last lines that \
+                       the message refers to.
+    :type linenospan: (int, int)
+    :param reader: the reader of the source.
+    :type reader: :py:class:`fparser.common.readfortran.FortranReaderBase`
+    :param colspan: the columns of the last line that the message \
+                    refers to.
+    :type colspan: (int, int)
+
+    '''
+    def __init__(self, kind, message, linenospan, reader, colspan=(0, -1)):
+        self.kind = kind
+        self.message = message
+        self.span = linenospan
+        self.colspan = colspan
+        self.reader = reader
+        self.reader_id = reader.id
+        # Only the lines read so far are shown, however late this is
+        # rendered.
+        self.nlines = len(reader.source_lines)
+
+    def __repr__(self):
+        return '%s(%r, %r, %r, %r)' % (self.__class__.__name__, self.kind,
+                                       self.message, self.span,
+                                       self.reader_id)
+
+    def __str__(self):
+        return self.reader.format_message(self.kind, self.message,
+                                          self.span[0], self.span[1],
+                                          self.colspan[0], self.colspan[1],
+                                          nlines=self.nlines)
+
+
 ##############################################################################
 
 class FortranReaderBase(object):
@@ -507,17 +661,33 @@ class FortranReaderBase(object):
 
         self.filo_line = []  # used for un-consuming lines.
         self.fifo_item = []
+        # Items returned by next() that may still be put back or rewound
+        # to (see mark()), the index of the next one to return again and
+        # the number of marks that are still to be reset or committed.
+        self.item_log = []
+        self.item_index = 0
+        self.item_marks = 0
         self.source_lines = []  # source lines cache
+        # The number of the first line read that is not blank, if any.
+        self.first_content_line = None
 
         self.f2py_comment_lines = []  # line numbers of f2py directives
 
         self.reader = None
         self.include_dirs = ['.']
+        # The items being kept while an include file is read (see
+        # include()) and what every INCLUDE line that has been read
+        # found (see _include_stamp).
+        self.include_record = None
+        self.included_files = []
 
         self.source_only = None
 
         self.exit_on_error = True
         self.restore_cache = []
+        # Set to a list to also collect the messages that are logged
+        # (see log_message()).
+        self.diagnostics = None
 
         return
 
@@ -618,12 +788,9 @@ class FortranReaderBase(object):
         if ignore_comments is None:
             ignore_comments = self._ignore_comments
 
-        try:
-            line = self.filo_line.pop()
+        if self.filo_line:
             self.linecount += 1
-            return line
-        except IndexError:
-            pass
+            return self.filo_line.pop()
         if self.isclosed:
             return None
         try:
@@ -636,8 +803,10 @@ class FortranReaderBase(object):
         # expand tabs, replace special symbols, get rid of nl characters
         line = line.expandtabs().replace('\xa0', ' ').rstrip()
         self.source_lines.append(line)
+        if line and self.first_content_line is None:
+            self.first_content_line = len(self.source_lines)
 
-        if ignore_comments and (self.format.is_fixed or self.format.is_f77):
+        if ignore_comments and self._format.is_fixed:
             # Check for a fixed-format comment. If the current line *is*
             # a comment and we are ignoring them, then recursively call this
             # routine again to get the next source line.
@@ -684,9 +853,61 @@ class FortranReaderBase(object):
     def put_item(self, item):
         """ Insert item to FIFO item buffer.
         """
-        self.fifo_item.insert(0, item)
+        index = self.item_index
+        if index and self.item_log[index-1] is item:
+            # The usual case of putting back the last item returned.
+            self.item_index = index - 1
+        else:
+            self.item_log.insert(index, item)
         return
 
+    def has_pending_items(self):
+        '''
+        :returns: whether the reader holds items or lines that have been \
+                  put back (or rewound to) and will be returned before \
+                  any more of its source is read.
+        :rtype: bool
+
+        '''
+        return self.item_index < len(self.item_log) or \
+            bool(self.fifo_item or self.filo_line)
+
+    def mark(self):
+        '''Mark the current position of the reader so that it can be
+        rewound to it with :py:meth:`reset`, e.g. when an attempt at
+        matching a block of code fails. Every mark must be followed by
+        a call to either :py:meth:`reset` or :py:meth:`commit`, the
+        most recent mark first.
+
+        :returns: the mark.
+        :rtype: int
+
+        '''
+        self.item_marks += 1
+        return self.item_index
+
+    def reset(self, mark):
+        '''Rewind the reader to a mark, so that all of the items read since
+        the mark was made are returned again. This takes the same time
+        however many items have been read, including any from INCLUDE
+        files.
+
+        :param int mark: a mark returned by :py:meth:`mark`.
+
+        '''
+        self.item_marks -= 1
+        self.item_index = mark
+
+    def commit(self, mark):
+        '''Keep the items read since a mark was made, i.e. drop the mark
+        without rewinding to it.
+
+        :param int mark: a mark returned by :py:meth:`mark`.
+
+        '''
+        assert mark <= self.item_index, (mark, self.item_index)
+        self.item_marks -= 1
+
     # Iterator methods:
 
     def __iter__(self):
@@ -698,14 +919,45 @@ class FortranReaderBase(object):
         return self.next()
 
     def next(self, ignore_comments=None):
-        '''Return the next Fortran code item. Include statements are dealt
-        with here.
+        '''Return the next Fortran code item. Items that have been put back
+        or rewound to (see :py:meth:`mark`) are returned again first.
 
         :param bool ignore_comments: When True then act as if Fortran \
         code does not contain any comments or blank lines. if this \
         optional arguement is not provided then use the default \
         value.
 
+        :returns: the next line item.
+        :rtype: py:class:`fparser.common.readfortran.Line`
+
+        :raises StopIteration: if no more lines are found.
+
+        '''
+        if ignore_comments is None:
+            ignore_comments = self._ignore_comments
+        item_log = self.item_log
+        while self.item_index < len(item_log):
+            item = item_log[self.item_index]
+            self.item_index += 1
+            if not item.isempty(ignore_comments):
+                return item
+        item = self._next_item(ignore_comments)
+        if self.item_marks:
+            item_log.append(item)
+            self.item_index += 1
+        else:
+            # Nothing can be rewound to before this item.
+            self.item_log = [item]
+            self.item_index = 1
+        return item
+
+    def _next_item(self, ignore_comments):
+        '''Return the next Fortran code item that has not been read
+        before. Include statements are dealt with here.
+
+        :param bool ignore_comments: When True then act as if Fortran \
+        code does not contain any comments or blank lines.
+
         :returns: the next line item. This can be from a local fifo \
         buffer, from an include reader or from this reader.
         :rtype: py:class:`fparser.common.readfortran.Line`
@@ -714,8 +966,6 @@ class FortranReaderBase(object):
         :raises StopIteration: if a general error has occured.
 
         '''
-        if ignore_comments is None:
-            ignore_comments = self._ignore_comments
         try:
             if self.reader is not None:
                 # inside INCLUDE statement
@@ -730,25 +980,22 @@ class FortranReaderBase(object):
                     # There is nothing in the fifo buffer.
                     try:
                         # Return a line from the include.
-                        return self.reader.next(ignore_comments)
+                        return self.next_included(ignore_comments)
                     except StopIteration:
                         # There is nothing left in the include
                         # file. Setting reader to None indicates that
                         # we should now read from the main reader.
-                        self.reader = None
+                        self.end_include()
             item = self._next(ignore_comments)
             if isinstance(item, Line) and _IS_INCLUDE_LINE(item.line):
                 # catch INCLUDE statement and create a new FortranReader
                 # to enter to included file.
                 reader = item.reader
                 filename = item.line.strip()[7:].lstrip()[1:-1]
-                include_dirs = self.include_dirs[:]
-                path = filename
-                for incl_dir in include_dirs:
-                    path = os.path.join(incl_dir, filename)
-                    if os.path.exists(path):
-                        break
-                if not os.path.isfile(path):
+                stamp = _include_stamp(filename, self.include_dirs)
+                self.included_files.append(stamp)
+                path = stamp[2]
+                if path is None:
                     # The include file does not exist in the specified
                     # locations.
                     #
@@ -760,28 +1007,106 @@ class FortranReaderBase(object):
                     #
                     return item
                 reader.info('including file %r' % (path), item)
-                self.reader = FortranFileReader(
-                    path,
-                    include_dirs=include_dirs,
-                    ignore_comments=ignore_comments)
-                result = self.reader.next(ignore_comments=ignore_comments)
-                return result
+                self.include(stamp, ignore_comments)
+                return self.next_included(ignore_comments)
             return item
         except StopIteration:
             raise
         # TODO can we specify one or more specific exception types
         # rather than catching *every* exception.
         except Exception as err:
-            message = self.format_message('FATAL ERROR',
-                                          'while processing line',
-                                          self.linecount, self.linecount)
-            logging.getLogger(__name__).critical(message)
-            message = 'Traceback\n' + ''.join(traceback.format_stack())
-            logging.getLogger(__name__).debug(message)
-            logging.getLogger(__name__).debug(str(err))
-            logging.getLogger(__name__).critical('STOPPED READING')
+            self.log_message(logging.CRITICAL, 'FATAL ERROR',
+                             'while processing line',
+                             self.linecount, self.linecount)
+            logger = logging.getLogger(__name__)
+            if logger.isEnabledFor(logging.DEBUG):
+                message = 'Traceback\n' + ''.join(traceback.format_stack())
+                logger.debug(message)
+                logger.debug(str(err))
+            logger.critical('STOPPED READING')
             raise StopIteration
 
+    def include(self, stamp, ignore_comments):
+        '''Start reading the items of an include file. If the same file
+        has been read before (by any reader, with the same include
+        directories and treatment of comments) and every INCLUDE line
+        read for it still finds the same file, unchanged, then copies of
+        the items read then are returned rather than reading it again.
+        The items refer to the reader that read them, which is kept
+        (with the lines it read) for as long as they are.
+
+        :param tuple stamp: what the INCLUDE line found (see \
+        :py:func:`_include_stamp`).
+        :param bool ignore_comments: whether to ignore comments and \
+        blank lines in the file.
+
+        '''
+        path = stamp[2]
+        key = (path, tuple(self.include_dirs), ignore_comments)
+        with _INCLUDE_LOCK:
+            cached = _INCLUDE_CACHE.pop(key, None)
+            if cached is not None:
+                # Mark the entry as the most recently used one.
+                _INCLUDE_CACHE[key] = cached
+        if cached is not None:
+            stamps, items = cached
+            if stamps[0] == stamp and \
+               all(_include_stamp(*old[:2]) == old for old in stamps[1:]):
+                self.reader = IncludedItems(path, items)
+                self.included_files.extend(stamps[1:])
+                self.include_record = None
+                return
+            with _INCLUDE_LOCK:
+                # Another thread may have replaced (or dropped) it.
+                if _INCLUDE_CACHE.get(key) is cached:
+                    del _INCLUDE_CACHE[key]
+        self.include_record = (key, stamp, [])
+        self.reader = FortranFileReader(path,
+                                        include_dirs=self.include_dirs[:],
+                                        ignore_comments=ignore_comments)
+
+    def next_included(self, ignore_comments):
+        '''Return the next item of the include file being read. A copy of
+        it is kept so that the file need not be read again.
+
+        :param bool ignore_comments: whether to ignore comments and \
+        blank lines.
+
+        :returns: the next item of the include file.
+        :rtype: py:class:`fparser.common.readfortran.Line`
+
+        :raises StopIteration: if there are no more items in the file.
+
+        '''
+        item = self.reader.next(ignore_comments)
+        if self.include_record is not None:
+            if ignore_comments != self.include_record[0][2] or \
+               isinstance(item, FortranReaderError):
+                # The items are not those that a reader with the same
+                # settings will return.
+                self.include_record = None
+            else:
+                self.include_record[2].append(
+                    (type(item), item.__getstate__(), item.reader))
+        return item
+
+    def end_include(self):
+        '''Go back to reading from this reader at the end of an include
+        file and keep the items of the file if they were all read.
+
+        '''
+        if self.include_record is not None:
+            key, stamp, items = self.include_record
+            stamps = (stamp,) + tuple(self.reader.included_files)
+            with _INCLUDE_LOCK:
+                _INCLUDE_CACHE.pop(key, None)
+                _INCLUDE_CACHE[key] = stamps, tuple(items)
+                if len(_INCLUDE_CACHE) > _INCLUDE_CACHE_SIZE:
+                    _INCLUDE_CACHE.popitem(last=False)
+        self.included_files.extend(self.reader.included_files)
+        self.include_record = None
+        self.reader = None
+
     def _next(self, ignore_comments=None):
         """
         Return the next item from FIFO item buffer or construct
@@ -816,7 +1141,7 @@ class FortranReaderBase(object):
             # resolve `;` statement terminations
             if not self._format.is_pyf and isinstance(item, Line) \
                    and not item.is_f2py_directive \
-                   and ';' in item.get_line():
+                   and ';' in item.line and ';' in item.get_line():
                 # ;-separator not recognized in pyf-mode
                 items = []
                 for line in item.get_line().split(';'):
@@ -870,10 +1195,15 @@ class FortranReaderBase(object):
     # For handling messages:
 
     def format_message(self, kind, message, startlineno, endlineno,
-                       startcolno=0, endcolno=-1):
+                       startcolno=0, endcolno=-1, nlines=None):
         '''
         Prepares a string for logging.
+
+        :param int nlines: the number of lines of source that may be \
+                           shown, by default all that have been read.
         '''
+        if nlines is None:
+            nlines = len(self.source_lines)
         back_index = {'warning': 2,
                       'error': 3,
                       'info': 0}.get(kind.lower(), 3)
@@ -881,9 +1211,8 @@ class FortranReaderBase(object):
                                                   self._format.mode)]
         for i in range(max(1, startlineno - back_index), startlineno):
             r.append('%5d:%s' % (i, self.source_lines[i - 1]))
-        for i in range(startlineno, min(endlineno+back_index,
-                                        len(self.source_lines))+1):
-            if i == 0 and not self.source_lines:
+        for i in range(startlineno, min(endlineno+back_index, nlines)+1):
+            if i == 0 and not nlines:
                 break
             linenostr = '%5d:' % (i)
             if i == endlineno:
@@ -912,20 +1241,46 @@ class FortranReaderBase(object):
         return self.format_message('WARNING', message, startlineno,
                                    endlineno, startcolno, endcolno)
 
+    def log_message(self, level, kind, message, startlineno, endlineno,
+                    startcolno=0, endcolno=-1):
+        '''
+        Logs a message about the source as a Diagnostic, which is only
+        formatted (see format_message()) if it is emitted by a handler.
+        The message is also added to the diagnostics of this reader if
+        they are being collected.
+
+        :param int level: the logging level of the message.
+        :param str kind: the kind of message, e.g. 'WARNING'.
+        :param str message: the text of the message.
+        :param int startlineno: the number of the first line that the \
+                                message refers to.
+        :param int endlineno: the number of the last line that the \
+                              message refers to.
+        :param int startcolno: the first column of the last line that \
+                               the message refers to.
+        :param int endcolno: the column after the last one that the \
+                             message refers to, -1 for the end of the line.
+
+        :returns: the message.
+        :rtype: :py:class:`fparser.common.readfortran.Diagnostic`
+        '''
+        diagnostic = Diagnostic(kind, message, (startlineno, endlineno),
+                                self, (startcolno, endcolno))
+        if self.diagnostics is not None:
+            self.diagnostics.append(diagnostic)
+        logging.getLogger(__name__).log(level, diagnostic)
+        return diagnostic
+
     def info(self, message, item=None):
         '''
         Logs an information message.
         '''
         if item is None:
-            m = self.format_message('INFORMATION',
-                                    message,
-                                    len(self.source_lines)-2,
-                                    len(self.source_lines))
+            self.log_message(logging.INFO, 'INFORMATION', message,
+                             len(self.source_lines)-2, len(self.source_lines))
         else:
-            m = self.format_message('INFORMATION',
-                                    message,
-                                    item.span[0], item.span[1])
-        logging.getLogger(__name__).info(m)
+            self.log_message(logging.INFO, 'INFORMATION', message,
+                             item.span[0], item.span[1])
         return
 
     def error(self, message, item=None):
@@ -933,11 +1288,11 @@ class FortranReaderBase(object):
         Logs an error message.
         '''
         if item is None:
-            m = self.format_error_message(message, len(self.source_lines)-2,
-                                          len(self.source_lines))
+            self.log_message(logging.ERROR, 'ERROR', message,
+                             len(self.source_lines)-2, len(self.source_lines))
         else:
-            m = self.format_error_message(message, item.span[0], item.span[1])
-        logging.getLogger(__name__).error(m)
+            self.log_message(logging.ERROR, 'ERROR', message,
+                             item.span[0], item.span[1])
         if self.exit_on_error:
             sys.exit(1)
         return
@@ -947,14 +1302,12 @@ class FortranReaderBase(object):
         Logs a warning message.
         '''
         if item is None:
-            m = self.format_warning_message(message,
-                                            len(self.source_lines) - 2,
-                                            len(self.source_lines))
+            self.log_message(logging.WARNING, 'WARNING', message,
+                             len(self.source_lines) - 2,
+                             len(self.source_lines))
         else:
-            m = self.format_warning_message(message,
-                                            item.span[0],
-                                            item.span[1])
-        logging.getLogger(__name__).warning(m)
+            self.log_message(logging.WARNING, 'WARNING', message,
+                             item.span[0], item.span[1])
         return
 
     # Auxiliary methods for processing raw source lines:
@@ -1075,12 +1428,9 @@ class FortranReaderBase(object):
                 if prefix.count(quote) % 2:
                     message = 'multiline prefix contains odd number of' \
                               + ' {!r} characters'.format(quote)
-                    message = self.format_warning_message(message,
-                                                          startlineno,
-                                                          startlineno,
-                                                          0,
-                                                          len(prefix))
-                    logging.getLogger(__name__).warning(message)
+                    self.log_message(logging.WARNING, 'WARNING', message,
+                                     startlineno, startlineno,
+                                     0, len(prefix))
 
             suffix = None
             multilines = []
@@ -1111,11 +1461,9 @@ class FortranReaderBase(object):
             if qc is not None:
                 message = 'following character continuation: {!r},' \
                           + ' expected None.'
-                message = self.format_message('ASSERTION FAILURE(pyf)',
-                                              message.format(qc),
-                                              startlineno,
-                                              self.linecount)
-                logging.getLogger(__name__).warning(message)
+                self.log_message(logging.WARNING, 'ASSERTION FAILURE(pyf)',
+                                 message.format(qc),
+                                 startlineno, self.linecount)
             # XXX: should we do line.replace('\\'+mlstr[0],mlstr[0])
             #      for line in multilines?
             return self.multiline_item(prefix,
@@ -1127,6 +1475,39 @@ class FortranReaderBase(object):
     # The main method of interpreting raw source lines within
     # the following contexts: f77, fixed, free, pyf.
 
+    def f77_item(self, line, startlineno, label, name):
+        '''Construct the Line item of an F77 statement, reading any lines
+        that continue it. Fortran 77 is easy: only columns 7 to 72 of
+        each line are part of the statement.
+
+        Comment and blank lines before the next line that is not a
+        continuation are skipped for the purposes of dealing with the
+        continued line. The next line itself is put back to be read
+        again.
+
+        :param str line: the first line of the statement.
+        :param int startlineno: the number of the first line.
+        :param label: the label of the statement, if any.
+        :type label: int or NoneType
+        :param name: the construct name of the statement, if any.
+        :type name: str or NoneType
+
+        :returns: the item.
+        :rtype: :py:class:`fparser.common.readfortran.Line`
+
+        '''
+        lines = [line[6:72]]
+        get_single_line = self.get_single_line
+        while True:
+            line = get_single_line(ignore_empty=True, ignore_comments=True)
+            if not _is_fix_cont(line):
+                if line is not None:
+                    self.put_single_line(line)
+                break
+            lines.append(line[6:72])
+        return self.line_item(''.join(lines), startlineno,
+                              self.linecount, label, name)
+
     def get_source_item(self):
         """ Return next source item.
 
@@ -1141,6 +1522,40 @@ class FortranReaderBase(object):
         if line is None:
             return
         startlineno = self.linecount
+        if self._format.is_free and not self._format.is_strict:
+            # Most free-format lines are simple so deal with them
+            # without going through the general case below.
+            if _IS_FREE_SIMPLE_LINE(line) and (
+                    ':' not in line or not _CONSTRUCT_NAME_RE.match(line)):
+                line = line.strip()
+                if line:
+                    return self.line_item(line, startlineno, startlineno,
+                                          None, None)
+                return self.comment_item('', startlineno, startlineno)
+            match = _IS_FREE_COMMENT_LINE(line)
+            if match:
+                return self.comment_item(line[match.end()-1:],
+                                         startlineno, startlineno)
+        elif self._format.is_f77 and _IS_FIXED_STATEMENT(line) and \
+                startlineno not in self.f2py_comment_lines:
+            # Likewise most F77 lines are statements with nothing but
+            # an optional label before column 7.
+            label = line[:5].strip()
+            return self.f77_item(line, startlineno,
+                                 int(label) if label else None, None)
+        elif self._format.is_fix and _IS_FIXED_STATEMENT(line) and \
+                not _HAS_FIXED_SPECIAL(line) and \
+                startlineno not in self.f2py_comment_lines:
+            # The same goes for other fixed-format lines, as long as the
+            # statement is not continued and has no in-line comment,
+            # string or construct name.
+            label = line[:5].strip()
+            label = int(label) if label else None
+            next_line = self.get_next_line()
+            if not (_is_fix_cont(next_line) or
+                    _is_fix_comment(next_line, self._format.is_strict)):
+                return self.line_item(line[6:], startlineno, startlineno,
+                                      label, None)
         line = self.handle_cf2py_start(line)
         is_f2py_directive = startlineno in self.f2py_comment_lines
         isstrict = self._format.is_strict
@@ -1159,9 +1574,11 @@ class FortranReaderBase(object):
                 # comment line:
                 return self.comment_item(line, startlineno, startlineno)
 
-            for i in range(min(5, len(line))):
+            for i in range(_FIXED_LABEL_FIELD(line).end(),
+                           min(5, len(line))):
                 # check that fixed format line starts according to Fortran
-                # standard
+                # standard (the characters before the first that is not a
+                # space or digit need not be looked at again)
                 if line[i] not in _SPACEDIGITS:
                     message = 'non-space/digit char %r found in column %i'\
                               ' of fixed Fortran code' % (line[i], i + 1)
@@ -1170,10 +1587,8 @@ class FortranReaderBase(object):
                     if self._format.is_fix:
                         if i != 0:
                             message += ', switching to free format mode'
-                        message = self.format_warning_message(message,
-                                                              startlineno,
-                                                              self.linecount)
-                        logging.getLogger(__name__).warning(message)
+                        self.log_message(logging.WARNING, 'WARNING', message,
+                                         startlineno, self.linecount)
                         if i == 0:
                             # non standard comment line:
                             return self.comment_item(line,
@@ -1183,10 +1598,8 @@ class FortranReaderBase(object):
                                                                        False)
                         self.set_format(mode)
                     else:
-                        message = self.format_warning_message(message,
-                                                              startlineno,
-                                                              self.linecount)
-                        logging.getLogger(__name__).warning(message)
+                        self.log_message(logging.WARNING, 'WARNING', message,
+                                         startlineno, self.linecount)
                         if i == 0:
                             # non standard comment line:
                             return self.comment_item(line,
@@ -1224,21 +1637,7 @@ class FortranReaderBase(object):
                 # line is not a comment and the start of the line is valid
 
         if self._format.is_f77 and not is_f2py_directive:
-            # Fortran 77 is easy..
-            lines = [line[6:72]]
-            # get_next_line does not actually consume lines - they are put
-            # into the FILO buffer as well as being returned. This means
-            # that we can ignore comments for the purposes of dealing
-            # with the continued line and then handle them as though they
-            # follow on after the single line constructed from the multiple
-            # continued lines.
-            while _is_fix_cont(self.get_next_line(ignore_empty=True,
-                                                  ignore_comments=True)):
-                # handle fix format line continuations for F77 code
-                line = get_single_line()
-                lines.append(line[6:72])
-            return self.line_item(''.join(lines), startlineno,
-                                  self.linecount, label, name)
+            return self.f77_item(line, startlineno, label, name)
 
         handle_inline_comment = self.handle_inline_comment
 
@@ -1279,11 +1678,9 @@ class FortranReaderBase(object):
             if qc is not None:
                 message = 'following character continuation: ' \
                           + '{!r}, expected None.'
-                message = self.format_message('ASSERTION FAILURE(fix)',
-                                              message.format(qc),
-                                              startlineno,
-                                              self.linecount)
-                logging.getLogger(__name__).warning(message)
+                self.log_message(logging.WARNING, 'ASSERTION FAILURE(fix)',
+                                 message.format(qc),
+                                 startlineno, self.linecount)
             if len(lines) > 1:
                 for i in range(len(lines)):
                     line = lines[i]
@@ -1291,11 +1688,9 @@ class FortranReaderBase(object):
                         message = 'free format line continuation character ' \
                                   + "`&' detected in fix format code"
                         location = line.rfind('&') + 5
-                        message = self.format_warning_message(message,
-                                                              startlineno + i,
-                                                              startlineno + i,
-                                                              location)
-                        logging.getLogger(__name__).warning(message)
+                        self.log_message(logging.WARNING, 'WARNING',
+                                         message, startlineno + i,
+                                         startlineno + i, location)
             return self.line_item(''.join(lines),
                                   startlineno,
                                   endlineno,
@@ -1383,11 +1778,8 @@ class FortranReaderBase(object):
         if qc is not None:
             message = 'following character continuation: {!r}, ' \
                       + 'expected None.'
-            message = self.format_message('ASSERTION FAILURE(free)',
-                                          message.format(qc),
-                                          startlineno,
-                                          endlineno)
-            logging.getLogger(__name__).error(message)
+            self.log_message(logging.ERROR, 'ASSERTION FAILURE(free)',
+                             message.format(qc), startlineno, endlineno)
         line_content = ''.join(lines).strip()
         if line_content:
             return self.line_item(line_content,
@@ -1401,10 +1793,198 @@ class FortranReaderBase(object):
         if name is not None:
             self.error('No construct following construct-name.')
         if have_comment:
-            return next(self)
+            return self._next_item(self._ignore_comments)
         return self.comment_item('', startlineno, endlineno)
 
 
+class IncludedItems(object):
+    '''
+    Reads the items of an include file from the items kept when it was
+    last read (see :py:meth:`FortranReaderBase.include`). Each item is
+    a new copy, attached to the reader that originally read it.
+
+    :param str path: the path of the include file.
+    :param items: the class, state and reader of each item.
+    :type items: tuple of (type, dict, \
+                 :py:class:`fparser.common.readfortran.FortranReaderBase`)
+
+    '''
+    def __init__(self, path, items):
+        self.id = path
+        self.items = iter(items)
+        self.linecount = 0
+        self.reader = None
+        self.last_reader = None
+        self.included_files = []
+
+    def next(self, ignore_comments=None):
+        '''
+        :param bool ignore_comments: whether to skip comments and blank \
+        lines.
+
+        :returns: the next item.
+        :rtype: py:class:`fparser.common.readfortran.Line`
+
+        :raises StopIteration: if there are no more items.
+
+        '''
+        while True:
+            cls, state, reader = next(self.items)
+            item = cls.__new__(cls)
+            if hasattr(item, '__setstate__'):
+                item.__setstate__(state)
+            else:
+                item.__dict__.update(state)
+            item.reader = self.last_reader = reader
+            self.linecount = item.span[1]
+            if not item.isempty(ignore_comments):
+                return item
+
+    def format_message(self, kind, message, startlineno, endlineno,
+                       startcolno=0, endcolno=-1, nlines=None):
+        '''Prepares a string for logging, using the reader of the last
+        item returned.'''
+        if self.last_reader is None:
+            return 'While processing {0!r}..'.format(self.id)
+        return self.last_reader.format_message(kind, message, startlineno,
+                                               endlineno, startcolno,
+                                               endcolno, nlines)
+
+
+class MappedSource(object):
+    '''
+    A file read through a memory map of it. The offset of the start of
+    each line that is read is kept in a compact array and, through its
+    ``lines`` attribute, this provides the lines that have been read
+    without holding a copy of any of them. A reader uses it as its cache
+    of the lines it has read (``source_lines``).
+
+    The text is that given by reading the file in text mode: it is
+    decoded in Python 3 (but not in Python 2) and lines may end with
+    any of '\\r\\n', '\\r' and '\\n', which Python 3 turns into '\\n'.
+
+    :param file_object: the file to read, which must have a file \
+                        descriptor and be at its start.
+    :type file_object: file
+
+    :raises ValueError: if the file is empty.
+    :raises EnvironmentError: if the file can not be mapped.
+
+    '''
+    def __init__(self, file_object):
+        self.name = file_object.name
+        self.encoding = getattr(file_object, 'encoding', None) or \
+            locale.getpreferredencoding(False)
+        self.map = mmap.mmap(file_object.fileno(), 0,
+                             access=mmap.ACCESS_READ)
+        if len(self.map) < 2**32:
+            starts = array.array('I')
+        else:
+            starts = array.array('L')
+        self.lines = MappedLines(self, starts)
+        self.position = 0
+
+    # Matches the end of a line.
+    _line_end = re.compile(b'\r\n?|\n').search
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(self.__class__.__name__, self.name)
+
+    def line_end(self, start):
+        ''':param int start: the offset of the start of a line.
+        :returns: the offset of the start of the next line.
+        :rtype: int'''
+        match = self._line_end(self.map, start)
+        if match:
+            return match.end()
+        return len(self.map)
+
+    def decode(self, start, end):
+        ''':param int start: the offset of the first byte to decode.
+        :param int end: the offset after the last byte to decode.
+        :returns: the text between the two offsets.
+        :rtype: str'''
+        text = self.map[start:end]
+        if six.PY2:
+            # Files read in text mode give the bytes that they contain.
+            return text
+        return text.decode(self.encoding).replace(
+            '\r\n', '\n').replace('\r', '\n')
+
+    # Iterator methods, returning the lines of the file:
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = self.position
+        if start >= len(self.map):
+            raise StopIteration
+        self.position = self.line_end(start)
+        self.lines.starts.append(start)
+        return self.decode(start, self.position)
+
+    next = __next__
+
+    # File methods, used to read the code in one go:
+
+    def tell(self):
+        ''':returns: the position in the file.
+        :rtype: int'''
+        return self.position
+
+    def seek(self, position):
+        ''':param int position: the position in the file to move to.'''
+        self.position = position
+
+    def read(self):
+        ''':returns: the rest of the file.
+        :rtype: str'''
+        content = self.decode(self.position, len(self.map))
+        self.position = len(self.map)
+        return content
+
+
+class MappedLines(object):
+    '''
+    The lines that have been read from a :py:class:`MappedSource`, in the
+    form in which they are cached by
+    :py:meth:`FortranReaderBase.get_single_line`.
+
+    :param source: the source the lines are read from.
+    :type source: :py:class:`MappedSource`
+    :param starts: the offsets of the start of the lines.
+    :type starts: :py:class:`array.array`
+
+    '''
+    def __init__(self, source, starts):
+        self.source = source
+        self.starts = starts
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.starts)
+        if not 0 <= index < len(self.starts):
+            raise IndexError('source line index out of range')
+        start = self.starts[index]
+        if index + 1 < len(self.starts):
+            end = self.starts[index + 1]
+        else:
+            end = self.source.line_end(start)
+        line = self.source.decode(start, end)
+        return line.expandtabs().replace('\xa0', ' ').rstrip()
+
+    def append(self, line):
+        '''Lines are indexed as they are read so there is nothing to add.
+
+        :param str line: the line that has just been read.
+
+        '''
+
+
 class FortranFileReader(FortranReaderBase):
     '''
     Constructs a FortranFileReader object from a file.
@@ -1414,6 +1994,10 @@ class FortranFileReader(FortranReaderBase):
     :param list source_only: Fortran source files to search for modules
                              required by "use" statements.
     :param bool ignore_comments: Whether or not to ignore comments
+    :param bool memory_map: Whether to read a file, given by name, through \
+                            a memory map of it rather than keeping a copy \
+                            of each line that is read (see \
+                            :py:class:`MappedSource`).
 
     For example:
 
@@ -1423,7 +2007,7 @@ class FortranFileReader(FortranReaderBase):
 
     '''
     def __init__(self, file_candidate, include_dirs=None, source_only=None,
-                 ignore_comments=True):
+                 ignore_comments=True, memory_map=False):
         # The filename is used as a unique ID. This is then used to cache the
         # contents of the file. Obviously if the file changes content but not
         # filename, problems will ensue.
@@ -1442,9 +2026,23 @@ class FortranFileReader(FortranReaderBase):
             message = 'FortranFileReader is used with a filename'
             message += ' or file-like object.'
             raise ValueError(message)
-        mode = fparser.common.sourceinfo.get_source_info(file_candidate)
+        # The format is worked out from the file that is read from below
+        # (rather than by opening it again) so that the lines this
+        # reads are still in its buffer when they are read again.
+        mode = fparser.common.sourceinfo.get_source_info(self.file)
 
-        FortranReaderBase.__init__(self, self.file, mode, ignore_comments)
+        source = self.file
+        if memory_map and self._close_on_destruction:
+            try:
+                source = MappedSource(self.file)
+            except (ValueError, EnvironmentError):
+                # Empty files can not be mapped (and neither can some
+                # special files) but they can still be read.
+                pass
+
+        FortranReaderBase.__init__(self, source, mode, ignore_comments)
+        if source is not self.file:
+            self.source_lines = source.lines
 
         if include_dirs is None:
             self.include_dirs.insert(0, os.path.dirname(self.id))
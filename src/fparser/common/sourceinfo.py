@@ -68,6 +68,7 @@ fixed format. It also tries to differentiate between strict and "pyf" although
 I'm not sure what that is.
 '''
 
+import itertools
 import os
 import re
 import six
@@ -216,17 +217,27 @@ _HAS_PYF_HEADER = re.compile(r'-[*]-\s*pyf\s*-[*]-', re.I).search
 _FREE_FORMAT_START = re.compile(r'[^c*!]\s*[^\s\d\t]', re.I).match
 
 
-def get_source_info_str(source):
+def get_source_info_lines(lines):
     '''
-    Determines the format of Fortran source held in a string.
+    Determines the format of Fortran source from its lines. Lines are
+    only taken from the iterable until the format is known, so an open
+    file is only read as far as the first line that shows that it is
+    free format.
+
+    :param lines: the lines of Fortran source.
+    :type lines: iterable of str
+
+    :returns: the format of the source.
+    :rtype: :py:class:`fparser.common.sourceinfo.FortranFormat`
 
-    Returns a FortranFormat object.
     '''
-    lines = source.splitlines()
-    if not lines:
+    lines = iter(lines)
+    for line in lines:
+        break
+    else:
         return FortranFormat(False, False)
 
-    firstline = lines[0].lstrip()
+    firstline = line.lstrip()
     if _HAS_F_HEADER(firstline):
         return FortranFormat(False, True)
     if _HAS_FIX_HEADER(firstline):
@@ -237,17 +248,26 @@ def get_source_info_str(source):
         return FortranFormat(True, True)
 
     line_tally = 10000  # Check up to this number of non-comment lines
-    is_free = False
-    while line_tally > 0 and lines:
-        line = lines.pop(0).rstrip()
+    for line in itertools.chain([line], lines):
+        line = line.rstrip()
         if line and line[0] != '!':
             line_tally -= 1
             if line[0] != '\t' and _FREE_FORMAT_START(line[:5]) \
                or line[-1:] == '&':
-                is_free = True
+                return FortranFormat(True, False)
+            if not line_tally:
                 break
 
-    return FortranFormat(is_free, False)
+    return FortranFormat(False, False)
+
+
+def get_source_info_str(source):
+    '''
+    Determines the format of Fortran source held in a string.
+
+    Returns a FortranFormat object.
+    '''
+    return get_source_info_lines(source.splitlines())
 
 
 ##############################################################################
@@ -292,9 +312,13 @@ def get_source_info(file_candidate):
         # As such we need to take a note of the current state of the file
         # pointer so we can restore it when we've finished what we're doing.
         #
+        # Only the lines that are needed are read, using readline so
+        # that the file position can still be restored afterwards.
+        #
         pointer = file_candidate.tell()
         file_candidate.seek(0)
-        source_info = get_source_info_str(file_candidate.read())
+        source_info = get_source_info_lines(
+            iter(file_candidate.readline, file_candidate.read(0)))
         file_candidate.seek(pointer)
         return source_info
     else:
@@ -308,6 +332,6 @@ def get_source_info(file_candidate):
         # found in.
         #
         with open(file_candidate, 'r') as file_object:
-            return get_source_info_str(file_object.read())
+            return get_source_info_lines(file_object)
 
 ##############################################################################
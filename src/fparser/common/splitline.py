@@ -108,46 +108,72 @@ class string_replace_dict(dict):
         return line
 
 
-def string_replace_map(line, lower=False,
-                       _cache={'index': 0, 'pindex': 0}):
+# The results of string_replace_map, which is called many times on the
+# same text while a statement is being matched. The maps are shared
+# between callers so must not be changed.
+_STRING_REPLACE_CACHE = {}
+_STRING_REPLACE_CACHE_SIZE = 20000
+
+
+def string_replace_map(line, lower=False):
     """
     1) Replaces string constants with symbol `'_F2PY_STRING_CONSTANT_<index>_'`
     2) Replaces (expression) with symbol `(F2PY_EXPR_TUPLE_<index>)`
     Returns a new line and the replacement map.
+
+    The indices are numbered from 1 in each call, or from after the
+    highest index of the same kind already in the line, so the result
+    only depends on the line.
     """
-    items = []
+    result = _STRING_REPLACE_CACHE.get((line, lower))
+    if result is not None:
+        return result
+    index = pindex = 0
+    if 'F2PY_' in line:
+        for key in _f2py_findall(line):
+            if key[0] == '_':
+                index = max(index, int(key[22:-1]))
+            else:
+                pindex = max(pindex, int(key[16:]))
     string_map = string_replace_dict()
     rev_string_map = {}
-    for item in splitquote(line, lower=lower)[0]:
-        if isinstance(item, String) and not _is_simple_str(item[1:-1]):
-            key = rev_string_map.get(item)
-            if key is None:
-                _cache['index'] += 1
-                index = _cache['index']
-                key = "_F2PY_STRING_CONSTANT_%s_" % (index)
-                it = item[1:-1]
-                string_map[key] = it
-                rev_string_map[it] = key
-            items.append(item[0]+key+item[-1])
-        else:
-            items.append(item)
-    newline = ''.join(items)
-    items = []
+    if '"' in line or "'" in line:
+        items = []
+        for item in splitquote(line, lower=lower)[0]:
+            if isinstance(item, String) and not _is_simple_str(item[1:-1]):
+                key = rev_string_map.get(item)
+                if key is None:
+                    index += 1
+                    key = "_F2PY_STRING_CONSTANT_%s_" % (index)
+                    it = item[1:-1]
+                    string_map[key] = it
+                    rev_string_map[it] = key
+                items.append(item[0]+key+item[-1])
+            else:
+                items.append(item)
+        newline = ''.join(items)
+    elif lower:
+        newline = line.lower()
+    else:
+        newline = line
     expr_keys = []
-    for item in splitparen(newline):
-        if isinstance(item, ParenString) and not _is_name(item[1:-1].strip()):
-            key = rev_string_map.get(item)
-            if key is None:
-                _cache['pindex'] += 1
-                index = _cache['pindex']
-                key = 'F2PY_EXPR_TUPLE_%s' % (index)
-                it = item[1:-1].strip()
-                string_map[key] = it
-                rev_string_map[it] = key
-                expr_keys.append(key)
-            items.append(item[0]+key+item[-1])
-        else:
-            items.append(item)
+    if '(' in newline or '[' in newline:
+        items = []
+        for item in splitparen(newline):
+            if isinstance(item, ParenString) and \
+               not _is_name(item[1:-1].strip()):
+                key = rev_string_map.get(item)
+                if key is None:
+                    pindex += 1
+                    key = 'F2PY_EXPR_TUPLE_%s' % (pindex)
+                    it = item[1:-1].strip()
+                    string_map[key] = it
+                    rev_string_map[it] = key
+                    expr_keys.append(key)
+                items.append(item[0]+key+item[-1])
+            else:
+                items.append(item)
+        newline = ''.join(items)
     found_keys = set()
     for k in expr_keys:
         v = string_map[k]
@@ -159,81 +185,93 @@ def string_replace_map(line, lower=False,
             string_map[k] = v
     for k in found_keys:
         del string_map[k]
-    return ''.join(items), string_map
+    if len(_STRING_REPLACE_CACHE) >= _STRING_REPLACE_CACHE_SIZE:
+        _STRING_REPLACE_CACHE.clear()
+    result = _STRING_REPLACE_CACHE[(line, lower)] = newline, string_map
+    return result
+
+
+def _is_escaped(line, index):
+    """
+    :param str line: a line of text.
+    :param int index: the position of a character in the line.
+
+    :returns: whether the character is escaped, i.e. follows an odd \
+              number of backslashes.
+    :rtype: bool
+    """
+    start = index
+    while index and line[index - 1] == '\\':
+        index -= 1
+    return (start - index) % 2 == 1
+
+
+_QUOTE_SEARCH = {}
 
 
 def splitquote(line, stopchar=None, lower=False, quotechars='"\''):
     """
-    Fast LineSplitter
+    Fast LineSplitter.
+
+    Splits a line into string constants (as String instances) and the
+    text between them, which is lower cased if required. Quotes that
+    follow an odd number of backslashes do not start or end a string.
+
+    :param str line: the line to split.
+    :param stopchar: the quote that ends a string that was not ended \
+                     on the previous line, if any.
+    :type stopchar: str or NoneType
+    :param bool lower: whether to lower case the text between strings.
+    :param str quotechars: the characters that start a string.
+
+    :returns: the parts of the line and the quote that ends a string \
+              that is not ended on this line, if any.
+    :rtype: (list of str, str or NoneType)
     """
+    search = _QUOTE_SEARCH.get(quotechars)
+    if search is None:
+        search = _QUOTE_SEARCH[quotechars] = re.compile(
+            '[' + re.escape(quotechars) + ']').search
     items = []
+    length = len(line)
     i = 0
-    while 1:
-        try:
-            char = line[i]
-            i += 1
-        except IndexError:
-            break
-        l = []
-        l_append = l.append
-        nofslashes = 0
+    while i < length:
         if stopchar is None:
-            # search for string start
-            while 1:
-                if char in quotechars and not nofslashes % 2:
-                    stopchar = char
-                    i -= 1
-                    break
-                if char == '\\':
-                    nofslashes += 1
-                else:
-                    nofslashes = 0
-                l_append(char)
-                try:
-                    char = line[i]
-                    i += 1
-                except IndexError:
-                    break
-            if not l:
-                continue
-            item = ''.join(l)
-            if lower:
-                item = item.lower()
-            items.append(item)
-            continue
-        if char == stopchar:
-            # string starts with quotechar
-            l_append(char)
-            try:
-                char = line[i]
-                i += 1
-            except IndexError:
-                if l:
-                    item = String(''.join(l))
-                    items.append(item)
+            # Search for the start of a string.
+            match = search(line, i)
+            while match and _is_escaped(line, match.start()):
+                match = search(line, match.start() + 1)
+            start = match.start() if match else length
+            if start > i:
+                item = line[i:start]
+                if lower:
+                    item = item.lower()
+                items.append(item)
+            if not match:
                 break
-        # else continued string
-        while 1:
-            if char == stopchar and not nofslashes % 2:
-                l_append(char)
-                stopchar = None
-                break
-            if char == '\\':
-                nofslashes += 1
-            else:
-                nofslashes = 0
-            l_append(char)
-            try:
-                char = line[i]
+            stopchar = line[start]
+            i = start + 1
+        else:
+            # A string that was started on a previous line.
+            start = i
+            if line[i] == stopchar:
                 i += 1
-            except IndexError:
-                break
-        if l:
-            item = String(''.join(l))
-            items.append(item)
+        # Search for the end of the string.
+        end = line.find(stopchar, i)
+        while end != -1 and _is_escaped(line, end):
+            end = line.find(stopchar, end + 1)
+        if end == -1:
+            items.append(String(line[start:]))
+            break
+        items.append(String(line[start:end+1]))
+        stopchar = None
+        i = end + 1
     return items, stopchar
 
 
+_PAREN_SEARCH = {}
+
+
 def splitparen(line, paren_open="([", paren_close=")]"):
     """
     Splits a line into top-level parenthesis and not-parenthesised
@@ -250,24 +288,27 @@ def splitparen(line, paren_open="([", paren_close=")]"):
 
     assert len(paren_open) == len(paren_close)
 
+    search = _PAREN_SEARCH.get((paren_open, paren_close))
+    if search is None:
+        search = _PAREN_SEARCH[(paren_open, paren_close)] = re.compile(
+            '[' + re.escape(paren_open + paren_close) + '"\']').search
+
     items = []   # Result list
-    num_backslashes = 0   # Counts consecutive "\" characters
     # Empty if outside quotes, or set to the starting (and therefore
     # also the ending) quote character while reading text inside quotes.
     inside_quotes_char = ""
     start = 0    # Index of start of current part.
     stack = []   # Stack keeping track of required closing brackets
 
-    for idx, char in enumerate(line):
-        if char == "\\":
-            num_backslashes = (num_backslashes+1) % 2
-            continue
-
-        # We had an odd number of \, so the next character is neither
-        # a real quote or parenthesis character, and can just be added.
-        if num_backslashes == 1:
-            num_backslashes = 0
+    # Only the quote and bracket characters are looked at. Those that
+    # follow an odd number of backslashes are ignored.
+    match = search(line)
+    while match:
+        idx = match.start()
+        match = search(line, idx + 1)
+        if line[idx - 1:idx] == "\\" and _is_escaped(line, idx):
             continue
+        char = line[idx]
 
         # If we are reading a quote, keep on reading till closing
         # quote is reached
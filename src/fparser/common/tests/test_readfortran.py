@@ -42,6 +42,7 @@ Test battery associated with fparser.common.readfortran package.
 '''
 from __future__ import print_function
 
+import logging
 import os.path
 import tempfile
 import pytest
@@ -277,6 +278,51 @@ def test_base_fixed_nonlabel(log):
     assert result == expected
 
 
+def test_diagnostics(log, monkeypatch):
+    '''
+    Tests that the messages logged by a reader are Diagnostic objects
+    that are only formatted when they are emitted, and that they are
+    collected by the reader when asked to.
+    '''
+    from fparser.common.readfortran import Diagnostic
+    code = '      x = 1\nw     integer :: i\n      y = 2'
+    unit_under_test = fparser.common.readfortran.FortranStringReader(code)
+    unit_under_test.set_format(fparser.common.sourceinfo.FortranFormat(
+        False, True))
+    unit_under_test.diagnostics = []
+    assert [item.line for item in unit_under_test] == ['x = 1', 'y = 2']
+    diagnostic, = unit_under_test.diagnostics
+    assert isinstance(diagnostic, Diagnostic)
+    assert diagnostic.kind == 'WARNING'
+    assert diagnostic.message == "non-space/digit char 'w' found in " \
+        "column 1 of fixed Fortran code, interpreting line as comment line"
+    assert diagnostic.span == (2, 2)
+    assert diagnostic.reader_id == unit_under_test.id
+    # Only the lines that had been read are shown.
+    assert str(diagnostic) == unit_under_test.format_warning_message(
+        diagnostic.message, 2, 2).replace("\n    3:      y = 2", "")
+    assert log.messages['warning'] == [str(diagnostic)]
+
+    # Messages that are not emitted are not formatted.
+    def no_format(*args, **kwargs):
+        ''' Fails if a message is formatted. '''
+        raise AssertionError('message formatted')
+    log.reset()
+    monkeypatch.setattr(fparser.common.readfortran.FortranReaderBase,
+                        'format_message', no_format)
+    logger = logging.getLogger('fparser')
+    level = logger.level
+    logger.setLevel(logging.ERROR)
+    try:
+        unit_under_test = fparser.common.readfortran.FortranStringReader(code)
+        unit_under_test.set_format(fparser.common.sourceinfo.FortranFormat(
+            False, True))
+        assert [item.line for item in unit_under_test] == ['x = 1', 'y = 2']
+    finally:
+        logger.setLevel(level)
+    assert log.messages['warning'] == []
+
+
 def test_base_fixed_continuation(log):
     '''
     Tests that FortranReaderBase.get_source_item() logs the correct messages
@@ -504,6 +550,131 @@ def test_include6(tmpdir, ignore_comments):
                         expected, tmpdir, ignore_comments=ignore_comments)
 
 
+def test_include_cache(tmpdir, ignore_comments):
+    '''Test that the items of an include file are kept when it is first
+    read and are then returned again, as new items, when the file is
+    included again, until the file or a file it includes changes.
+
+    '''
+    from fparser.common.readfortran import IncludedItems
+    inner = tmpdir.join("inner.inc")
+    inner.write("  integer :: a ! comment\n")
+    outer = tmpdir.join("outer.inc")
+    outer.write("  include 'inner.inc'\n"
+                "  integer :: b\n")
+    code = ("program test\n"
+            "  include 'outer.inc'\n"
+            "end program test\n")
+
+    def read_items():
+        '''
+        :returns: the reader of the include file and the type, span, \
+                  content and reader name of each item.
+        :rtype: tuple
+        '''
+        reader = FortranStringReader(code, include_dirs=[str(tmpdir)],
+                                     ignore_comments=ignore_comments)
+        items = [reader.get_item(), reader.get_item()]
+        include_reader = reader.reader
+        items.extend(reader)
+        return include_reader, [
+            (type(item), item.span, str(item), item.reader.id)
+            for item in items]
+
+    include_reader, items = read_items()
+    assert isinstance(include_reader, FortranFileReader)
+    assert items[1][2:] == ("line #1'integer :: a'", str(inner))
+    include_reader, cached_items = read_items()
+    assert isinstance(include_reader, IncludedItems)
+    assert cached_items == items
+    # The items are copies.
+    reader = FortranStringReader(code, include_dirs=[str(tmpdir)])
+    reader.get_item()
+    item = reader.get_item()
+    item.clone("integer :: c")
+    _, cached_items = read_items()
+    assert cached_items == items
+    # Changing a file that is included by the include file means it is
+    # read again.
+    inner.write("  integer :: c\n")
+    include_reader, items = read_items()
+    assert isinstance(include_reader, FortranFileReader)
+    assert items[1][2] == "line #1'integer :: c'"
+
+
+def test_include_cache_search_path(tmpdir):
+    '''Test that the items kept for an include file are not used once a
+    file of the same name as it, or as a file it includes, is added to
+    an earlier include directory, or once a file that it includes but
+    that was not found is added.
+
+    '''
+    first = tmpdir.mkdir("first")
+    second = tmpdir.mkdir("second")
+    second.join("inner.inc").write("  integer :: a\n")
+    second.join("outer.inc").write("  include 'inner.inc'\n"
+                                   "  include 'missing.inc'\n")
+    code = ("program test\n"
+            "  include 'outer.inc'\n"
+            "end program test\n")
+
+    def read_lines():
+        ''':returns: the text of each item read.'''
+        reader = FortranStringReader(
+            code, include_dirs=[str(first), str(second)])
+        return [str(item) for item in reader]
+
+    lines = read_lines()
+    assert "line #1'integer :: a'" in lines
+    assert "line #2\"include 'missing.inc'\"" in lines
+    assert read_lines() == lines
+    # A file included by the include file.
+    first.join("inner.inc").write("  integer :: b\n")
+    lines = read_lines()
+    assert "line #1'integer :: b'" in lines
+    # A file that was not found.
+    first.join("missing.inc").write("  integer :: c\n")
+    lines = read_lines()
+    assert "line #1'integer :: c'" in lines
+    # The include file itself.
+    first.join("outer.inc").write("  integer :: d\n")
+    assert read_lines()[1] == "line #1'integer :: d'"
+
+
+def test_include_cache_lru(tmpdir, monkeypatch):
+    '''Test that the include file that has been used least recently is
+    the one whose items are dropped when too many are kept.
+
+    '''
+    import collections
+    from fparser.common import readfortran
+    monkeypatch.setattr(readfortran, "_INCLUDE_CACHE",
+                        collections.OrderedDict())
+    monkeypatch.setattr(readfortran, "_INCLUDE_CACHE_SIZE", 2)
+    for name in "abc":
+        tmpdir.join(name + ".inc").write("  integer :: {0}\n".format(name))
+
+    def include(name):
+        '''Reads a program that includes the named file.'''
+        reader = FortranStringReader(
+            "program test\n  include '{0}.inc'\nend program test\n"
+            "".format(name), include_dirs=[str(tmpdir)])
+        list(reader)
+
+    def cached():
+        ''':returns: the names of the files whose items are kept.'''
+        return [os.path.basename(key[0])[0]
+                for key in readfortran._INCLUDE_CACHE]
+
+    include("a")
+    include("b")
+    assert cached() == ["a", "b"]
+    include("a")
+    assert cached() == ["b", "a"]
+    include("c")
+    assert cached() == ["a", "c"]
+
+
 def test_get_item(ignore_comments):
     '''Check the get_item() function works as expected. Test with and
     without comments being ignored.
@@ -524,6 +695,31 @@ def test_get_item(ignore_comments):
     assert not reader.get_item()
 
 
+def test_pickle_item(ignore_comments):
+    '''Check that the items returned by the reader can be pickled and
+    that they are detached from the reader when they are.
+
+    '''
+    import pickle
+    reader = FortranStringReader(FORTRAN_CODE, ignore_comments=ignore_comments)
+    while True:
+        item = reader.get_item()
+        if not item:
+            break
+        if hasattr(item, "get_line"):
+            item.get_line()
+        new_item = pickle.loads(pickle.dumps(item))
+        assert type(new_item) is type(item)
+        assert new_item.reader is None
+        assert new_item.line == item.line
+        assert new_item.span == item.span
+        assert getattr(new_item, "label", None) == \
+            getattr(item, "label", None)
+        if hasattr(item, "parse_cache"):
+            assert new_item.parse_cache == {}
+            assert new_item.strline is None
+
+
 def test_put_item(ignore_comments):
     '''Check that when a line is consumed it can be pushed back so it can
     be consumed again. Test with and without comments being
@@ -540,6 +736,31 @@ def test_put_item(ignore_comments):
         assert fifo_line == orig_line
 
 
+def test_has_pending_items():
+    '''Check that has_pending_items reports items that have been put
+    back or rewound to, and lines that have been put back.
+
+    '''
+    reader = FortranStringReader(FORTRAN_CODE)
+    assert not reader.has_pending_items()
+    mark = reader.mark()
+    item = reader.get_item()
+    assert not reader.has_pending_items()
+    reader.reset(mark)
+    assert reader.has_pending_items()
+    assert reader.get_item() is item
+    assert not reader.has_pending_items()
+    reader.put_item(item)
+    assert reader.has_pending_items()
+    reader.get_item()
+    reader.put_single_line("end")
+    assert reader.has_pending_items()
+    # An item given to a reader that has not been read from.
+    reader = FortranStringReader(FORTRAN_CODE)
+    reader.put_item(item)
+    assert reader.has_pending_items()
+
+
 def test_put_item_include(ignore_comments):
     '''Check that when a line that has been included via an include
     statement is consumed it can be pushed back so it can be consumed
@@ -585,6 +806,179 @@ def test_multi_put_item(ignore_comments):
         assert filo_line == orig_lines.pop(-1)
     assert not orig_lines
 
+
+def test_mark_reset(ignore_comments):
+    '''Check that the items read after a mark are returned again, in
+    the same order, after the reader is reset to that mark, and that
+    committing a mark keeps the current position. Test with and
+    without ignoring comments.
+
+    '''
+    reader = FortranStringReader(FORTRAN_CODE, ignore_comments=ignore_comments)
+    first = reader.get_item()
+    mark = reader.mark()
+    orig_lines = []
+    while True:
+        orig_line = reader.get_item()
+        if not orig_line:
+            break
+        orig_lines.append(orig_line)
+    reader.reset(mark)
+    mark = reader.mark()
+    for orig_line in orig_lines:
+        assert reader.get_item() is orig_line
+    assert reader.get_item() is None
+    # Nested marks where the inner one is committed.
+    reader.reset(mark)
+    mark = reader.mark()
+    outer = reader.mark()
+    inner = reader.mark()
+    second = reader.get_item()
+    reader.commit(inner)
+    assert reader.get_item() is orig_lines[1]
+    reader.reset(outer)
+    assert reader.get_item() is second
+    reader.commit(mark)
+    assert reader.item_marks == 0
+    assert first.get_line() == "program test"
+
+
+def test_mark_reset_include(tmpdir, ignore_comments):
+    '''Check that a reader can be reset to a mark taken before the
+    lines of an include file were read and that those lines are then
+    returned again. Test with and without ignoring comments.
+
+    '''
+    include_file = tmpdir.join("prog.inc")
+    include_file.write("  print *, 'Hello'\n"
+                       "  ! inc comment\n"
+                       "  print *, 'World'\n")
+    reader = FortranStringReader(
+        "program test\n"
+        "  include 'prog.inc'\n"
+        "end program test\n", include_dirs=[str(tmpdir)],
+        ignore_comments=ignore_comments)
+    assert reader.get_item().get_line() == "program test"
+    mark = reader.mark()
+    orig_lines = []
+    while True:
+        orig_line = reader.get_item()
+        if not orig_line:
+            break
+        orig_lines.append(orig_line)
+    reader.reset(mark)
+    reread_lines = []
+    while True:
+        reread_line = reader.get_item()
+        if not reread_line:
+            break
+        reread_lines.append(reread_line)
+    reader.commit(mark)
+    assert reread_lines == orig_lines
+    lines = [str(line.line) for line in orig_lines]
+    assert lines[0] == "print *, 'Hello'"
+    assert lines[-2:] == ["print *, 'World'", "end program test"]
+
+
+def test_free_simple_lines(monkeypatch, ignore_comments):
+    '''Check that the free-format lines that are read without the
+    general processing in get_source_item (blank lines, comment
+    lines and statements without a label, construct name, quote,
+    continuation, semicolon or in-line comment) give the same items
+    as they do when they are processed in full. Test with and without
+    ignoring comments.
+
+    '''
+    from fparser.common import readfortran
+    code = ("program test\n"
+            "  10 continue\n"
+            "  outer: do i = 1, 2\n"
+            "  end do outer\n"
+            "  real :: x(1:2) = y(:)\n"
+            "\n"
+            "   ! a comment\n"
+            "  !f2py intent(in) x\n"
+            "  a = b ! inline comment\n"
+            "  x = 1; y = 2\n"
+            "  call f(a, &\n"
+            "         b)\n"
+            "\tc = 'abc'\n"
+            "end program test\n")
+
+    def read_items():
+        '''
+        :returns: the type, span, label, name and content of each item.
+        :rtype: list of tuple
+        '''
+        reader = FortranStringReader(code, ignore_comments=ignore_comments)
+        return [(type(item), item.span, getattr(item, "label", None),
+                 getattr(item, "name", None),
+                 getattr(item, "line", getattr(item, "comment", None)))
+                for item in reader]
+
+    items = read_items()
+    assert (readfortran.Line, (5, 5), None, None,
+            "real :: x(1:2) = y(:)") in items
+    if not ignore_comments:
+        assert (readfortran.Comment, (7, 7), None, None,
+                "! a comment") in items
+    monkeypatch.setattr(readfortran, "_IS_FREE_SIMPLE_LINE",
+                        lambda line: None)
+    monkeypatch.setattr(readfortran, "_IS_FREE_COMMENT_LINE",
+                        lambda line: None)
+    assert items == read_items()
+
+
+@pytest.mark.parametrize("mode", [(False, True), (False, False)])
+def test_fixed_simple_lines(monkeypatch, ignore_comments, mode):
+    '''Check that the fixed-format statements that are read without the
+    general processing in get_source_item (F77 statements and, in fix
+    mode, statements that are not continued and have no in-line
+    comment, string or construct name) give the same items as they do
+    when they are processed in full. Test in F77 and fix modes, with
+    and without ignoring comments.
+
+    '''
+    from fparser.common import readfortran
+    code = ("      program test\n"
+            "   10 continue\n"
+            "      x = 1 +\n"
+            "c a comment\n"
+            "\n"
+            "     &    2\n"
+            "     1  + 3\n"
+            "      outer: do i = 1, 2\n"
+            "      end do outer\n"
+            "      y = 2 ! inline comment\n"
+            "cf2py intent(in) x\n"
+            "      call f('a', \"b\")\n"
+            "  20  z = 3\n"
+            "\tc = 4\n"
+            "      s = 5" + 60 * " " + "SEQ00001\n"
+            "      end program test\n")
+
+    def read_items():
+        '''
+        :returns: the type, span, label, name and content of each item.
+        :rtype: list of tuple
+        '''
+        reader = FortranStringReader(code, ignore_comments=ignore_comments)
+        reader.set_format(fparser.common.sourceinfo.FortranFormat(*mode))
+        return [(type(item), item.span, getattr(item, "label", None),
+                 getattr(item, "name", None),
+                 getattr(item, "line", getattr(item, "comment", None)))
+                for item in reader]
+
+    items = read_items()
+    assert (readfortran.Line, (2, 2), 10, None, "continue") in items
+    assert (readfortran.Line, (3, 7), None, None,
+            "x = 1 +    2  + 3") in items
+    assert items[-1][1:] == ((16, 16), None, None, "end program test")
+    monkeypatch.setattr(readfortran, "_IS_FIXED_STATEMENT",
+                        lambda line: None)
+    assert items == read_items()
+
+
 # Issue 177: get_item(ignore_comments) - how does ignore_comments affect
 # processing?
 
@@ -658,6 +1052,66 @@ def test_file_reader():
         raise
 
 
+##############################################################################
+
+def test_memory_map_reader(tmpdir):
+    '''
+    Tests that a Fortran source file read through a memory map gives the
+    same items, lines and messages as it does when it is read normally,
+    without keeping a copy of the lines that have been read.
+    '''
+    import locale
+    from fparser.common.readfortran import MappedLines
+    # The file is written in the encoding that it is read with.
+    try:
+        nbsp = u"\xa0".encode(locale.getpreferredencoding(False))
+    except UnicodeError:
+        nbsp = b" "
+    source_file = tmpdir.join("prog.f90")
+    source_file.write_binary(b"program test\r\n"
+                             b"\tx = 1 ! comment\r\n"
+                             b"  call f(a, &\n" +
+                             nbsp + b"         b)\n"
+                             b"end program test")
+    reader = FortranFileReader(str(source_file), ignore_comments=False)
+    mapped_reader = FortranFileReader(str(source_file),
+                                      ignore_comments=False, memory_map=True)
+    assert isinstance(mapped_reader.source_lines, MappedLines)
+    assert mapped_reader.format == reader.format
+    mapped_items = list(mapped_reader)
+    items = list(reader)
+    assert [(type(item), item.span, str(item)) for item in mapped_items] == \
+        [(type(item), item.span, str(item)) for item in items]
+    assert len(mapped_reader.source_lines) == 5
+    assert list(mapped_reader.source_lines) == reader.source_lines
+    assert mapped_reader.source_lines[-1] == "end program test"
+    with pytest.raises(IndexError):
+        _ = mapped_reader.source_lines[5]
+    assert mapped_reader.format_error_message("error", 2, 4) == \
+        reader.format_error_message("error", 2, 4)
+    # The code can be read in one go, as it is for caching.
+    mapped_reader = FortranFileReader(str(source_file), memory_map=True)
+    with open(str(source_file), "r") as source:
+        assert mapped_reader.source.read() == source.read()
+    mapped_reader.source.seek(0)
+    assert mapped_reader.get_item().line == "program test"
+    # Lines may also end with just a carriage return.
+    source_file.write_binary(b"program test\r"
+                             b"  x = 1\r"
+                             b"end program test\r")
+    mapped_reader = FortranFileReader(str(source_file), memory_map=True)
+    assert [(item.span, item.line) for item in mapped_reader] == \
+        [((1, 1), "program test"), ((2, 2), "x = 1"),
+         ((3, 3), "end program test")]
+    assert list(mapped_reader.source_lines) == \
+        ["program test", "  x = 1", "end program test"]
+    # Empty files can not be mapped so are read normally.
+    source_file.write("")
+    reader = FortranFileReader(str(source_file), memory_map=True)
+    assert isinstance(reader.source_lines, list)
+    assert reader.get_item() is None
+
+
 ##############################################################################
 
 def test_bad_file_reader():
@@ -46,7 +46,8 @@ import tempfile
 import pytest
 
 from fparser.common.sourceinfo import FortranFormat, \
-                                      get_source_info_str, get_source_info
+                                      get_source_info_str, get_source_info, \
+                                      get_source_info_lines
 
 
 ##############################################################################
@@ -352,6 +353,52 @@ def test_get_source_info_file(extension, header, content):
             assert source_info == content[1]
 
 
+##############################################################################
+
+def test_get_source_info_lines(header, content):
+    #pylint: disable=redefined-outer-name
+    '''
+    Tests that source format is correctly identified from an iterable of
+    lines and that no more lines are taken from it than are needed.
+    '''
+    lines = []
+    if header[0] is not None:
+        lines.append(header[0] + '\n')
+    if content[0] is not None:
+        lines.extend(content[0].splitlines(True))
+
+    source_lines = iter(lines)
+    source_info = get_source_info_lines(source_lines)
+    if header[0]:
+        assert source_info == header[1]
+        assert list(source_lines) == lines[1:]
+    else:  # No header
+        assert source_info == content[1]
+
+
+def test_get_source_info_file_position():
+    '''
+    Tests that get_source_info leaves a file object at the position it was
+    at and that only the lines needed are read from it.
+    '''
+    with tempfile.TemporaryFile(mode='w+') as source_file:
+        source_file.write('program test\n' * 5)
+        source_file.seek(13)
+        source_info = get_source_info(source_file)
+        assert source_info == FortranFormat(True, False)
+        assert source_file.tell() == 13
+        assert source_file.readline() == 'program test\n'
+
+    def unreadable():
+        '''
+        :returns: lines of free format source followed by an error.
+        '''
+        yield 'program test\n'
+        raise AssertionError('line read after format was identified')
+
+    assert get_source_info_lines(unreadable()) == FortranFormat(True, False)
+
+
 ##############################################################################
 
 def test_get_source_info_wrong():
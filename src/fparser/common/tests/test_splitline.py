@@ -132,9 +132,39 @@ def test_splitquote():
     assert split_list == ['a', '\'b']
     assert stopchar == '\''
 
+    # Strings continued from a previous line.
+    split_list, stopchar = splitquote('bc\\\'d\' E', stopchar='\'',
+                                      lower=True)
+    assert split_list == ['bc\\\'d\'', ' e']
+    assert stopchar is None
+    split_list, stopchar = splitquote('\'a', stopchar='\'')
+    assert split_list == ['\'a']
+    assert stopchar == '\''
+
 
 def test_string_replace_map():
     '''Tests string_replace_map function.'''
     result, string_map = string_replace_map('a()')
     assert result == 'a()'
     assert string_map == {}
+    result, string_map = string_replace_map("A = f('x y', (B+1))",
+                                            lower=True)
+    assert result == "a = f(F2PY_EXPR_TUPLE_1)"
+    assert string_map(result) == "a = f('x y', (b+1))"
+    # The same text gives the same result.
+    assert string_replace_map("A = f('x y', (B+1))", lower=True) == \
+        (result, string_map)
+    assert string_replace_map("A = f('x y', (B+1))")[0] != result
+    # Placeholders are numbered from 1 in each call, after any that are
+    # already in the line.
+    result, string_map = string_replace_map("'a b' // 'c d' // (e)")
+    assert result == "'_F2PY_STRING_CONSTANT_1_' // " \
+        "'_F2PY_STRING_CONSTANT_2_' // (e)"
+    assert string_map == {'_F2PY_STRING_CONSTANT_1_': 'a b',
+                          '_F2PY_STRING_CONSTANT_2_': 'c d'}
+    result, string_map = string_replace_map(
+        "F2PY_EXPR_TUPLE_3 + (a+b) // '_F2PY_STRING_CONSTANT_9_' // 'c d'")
+    assert result == "F2PY_EXPR_TUPLE_3 + (F2PY_EXPR_TUPLE_4) // " \
+        "'_F2PY_STRING_CONSTANT_9_' // '_F2PY_STRING_CONSTANT_10_'"
+    assert string_map == {'F2PY_EXPR_TUPLE_4': 'a+b',
+                          '_F2PY_STRING_CONSTANT_10_': 'c d'}
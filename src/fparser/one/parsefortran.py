@@ -117,7 +117,7 @@ class FortranParser(object):
         '''
         Pushes the given item to the reader.
         '''
-        self.reader.fifo_item.insert(0, item)
+        self.reader.put_item(item)
         return
 
     def parse(self):
@@ -96,11 +96,13 @@ def runner(_, options, args):
             print (program)
         except FortranSyntaxError as msg:
             print ("Syntax error: {0}".format(str(msg)))
+            # The items the parser gave back to the reader (if any)
+            pending = reader.item_log[reader.item_index:] + reader.fifo_item
             try:
-                # protect the access to fifo_item[-1] in case the fifo
-                # buffer is empty
-                print('parsing %r failed at %s' % (filename, reader.fifo_item[-1]))
-                print('started at %s' % (reader.fifo_item[0]))
+                # protect the access to pending[-1] in case there are
+                # no such items
+                print('parsing %r failed at %s' % (filename, pending[-1]))
+                print('started at %s' % (pending[0]))
             except IndexError:
                 pass
             raise SystemExit(1)
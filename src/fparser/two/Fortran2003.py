@@ -81,7 +81,7 @@ from fparser.two.utils import Base, BlockBase, StringBase, WORDClsBase, \
     BinaryOpBase, Type_Declaration_StmtBase, CALLBase, CallBase, \
     KeywordValueBase, SeparatorBase, SequenceBase, UnaryOpBase
 from fparser.two.utils import NoMatchError, FortranSyntaxError, \
-    InternalError, show_result
+    InternalError, show_result, generate_classes
 
 #
 # SECTION  1
@@ -3715,11 +3715,14 @@ class Equivalence_Set(Base):  # R555
         if not line:
             return
         tmp = Equivalence_Object_List(line)
-        obj = tmp.items[0]
-        tmp.items = tmp.items[1:]
-        if not tmp.items:
+        if len(tmp.items) < 2:
             return
-        return obj, tmp
+        # Build a new list object rather than modifying tmp as tmp may
+        # be shared with other parts of the parse tree (see
+        # fparser.two.utils.MatchCache).
+        obj_list = object.__new__(Equivalence_Object_List)
+        obj_list.init(tmp.separator, tmp.items[1:])
+        return tmp.items[0], obj_list
     match = staticmethod(match)
 
     def tostr(self):
@@ -4576,6 +4579,312 @@ class Level_5_Expr(BinaryOpBase):  # R717
 # R721: <equiv-op> = .EQV. | .NEQV.
 
 
+# Binding power and node class of each intrinsic binary operator, as
+# used by _match_expr. The powers follow rules R704-R721: '**' binds
+# tightest and groups from the right, the relational operators do not
+# group at all and everything else groups from the left.
+_EXPR_OPERATORS = {'**': (9, Mult_Operand),
+                   '*': (8, Add_Operand), '/': (8, Add_Operand),
+                   '+': (7, Level_2_Expr), '-': (7, Level_2_Expr),
+                   '//': (6, Level_3_Expr),
+                   '.EQV.': (1, Level_5_Expr),
+                   '.NEQV.': (1, Level_5_Expr),
+                   '.OR.': (2, Equiv_Operand),
+                   '.AND.': (3, Or_Operand)}
+_EXPR_OPERATORS.update(dict.fromkeys(
+    ('.EQ.', '.NE.', '.LT.', '.LE.', '.GT.', '.GE.',
+     '==', '/=', '<', '<=', '>', '>='), (5, Level_4_Expr)))
+# Binding powers of the two prefix operators.
+_EXPR_NOT_POWER = 4
+_EXPR_SIGN_POWER = 7
+_EXPR_DOT_OP = re.compile(r'[.]\s*([A-Z]+)\s*[.]', re.I)
+_EXPR_LOGICAL = re.compile(r'[.]\s*(?:TRUE|FALSE)\s*[.](?:_\w+)?', re.I)
+_EXPR_REAL = re.compile(
+    r'(?:\d+[.]\d*|[.]\d+)(?:[ED][+-]?\d+)?(?:_\w+)?'
+    r'|\d+[ED][+-]?\d+(?:_\w+)?', re.I)
+_EXPR_SYMBOL_OP = re.compile(r'[*]{2}|/=|/\s*/|==|<=|>=|[*/+<>-]')
+_EXPR_NAME = re.compile(r'\w*\Z')
+
+
+def _skip_quote(string, index):
+    '''
+    :param str string: Fortran source.
+    :param int index: position of the quote opening a character constant.
+
+    :returns: the position just after the closing quote or -1 if the \
+        constant is not terminated.
+    :rtype: int
+
+    '''
+    quote = string[index]
+    while True:
+        index = string.find(quote, index + 1)
+        if index == -1:
+            return -1
+        if string[index+1:index+2] != quote:
+            return index + 1
+        # A doubled quote stands for the quote character itself.
+        index += 1
+
+
+def _skip_brackets(string, index):
+    '''
+    :param str string: Fortran source.
+    :param int index: position of an opening '(' or '['.
+
+    :returns: the position just after the matching closing bracket or \
+        -1 if the brackets are unbalanced.
+    :rtype: int
+
+    '''
+    closing = []
+    while index < len(string):
+        char = string[index]
+        if char in '\'"':
+            index = _skip_quote(string, index)
+            if index == -1:
+                return -1
+            continue
+        if char == '(':
+            closing.append(')')
+        elif char == '[':
+            closing.append(']')
+        elif char in ')]':
+            if char != closing.pop():
+                return -1
+            if not closing:
+                return index + 1
+        index += 1
+    return -1
+
+
+def _expr_tokens(string):
+    '''
+    Split an expression into operands and intrinsic operators for
+    :py:func:`_match_expr`. Bracketed parts and character constants
+    end up whole inside operands.
+
+    :param str string: the expression.
+
+    :returns: the expression as the rules below would pass it on (the \
+        white space just inside brackets is stripped unless they hold \
+        a name, see :py:func:`string_replace_map`) and a list of \
+        (kind, value, start, end) tokens indexing into it, or None if \
+        the expression contains anything other than intrinsic operators.
+    :rtype: (str, list) or NoneType
+
+    '''
+    parts = []
+    copied = 0
+    # Offset between positions in string and in the returned expression.
+    shift = 0
+    tokens = []
+    index = 0
+    want_operand = True
+    while True:
+        while index < len(string) and string[index].isspace():
+            index += 1
+        if index == len(string):
+            break
+        char = string[index]
+        start = index + shift
+        if not want_operand:
+            if char == '.':
+                match = _EXPR_DOT_OP.match(string, index)
+                if not match:
+                    return None
+                op = '.{0}.'.format(match.group(1).upper())
+            else:
+                match = _EXPR_SYMBOL_OP.match(string, index)
+                if not match:
+                    return None
+                op = match.group().replace(' ', '')
+            if op not in _EXPR_OPERATORS:
+                return None
+            index = match.end()
+            tokens.append(('binary', op, start, index + shift))
+            want_operand = True
+            continue
+        if char in '+-':
+            index += 1
+            tokens.append(('sign', char, start, index + shift))
+            continue
+        if char == '.':
+            match = _EXPR_DOT_OP.match(string, index)
+            if match and match.group(1).upper() == 'NOT':
+                index = match.end()
+                tokens.append(('not', match.group().upper(), start,
+                               index + shift))
+                continue
+            match = _EXPR_LOGICAL.match(string, index) or \
+                _EXPR_REAL.match(string, index)
+            if not match:
+                return None
+            index = match.end()
+        elif char.isdigit() and _EXPR_REAL.match(string, index):
+            index = _EXPR_REAL.match(string, index).end()
+        else:
+            operand_start = index
+            while index < len(string):
+                char = string[index]
+                if char.isalnum() or char in '_%':
+                    index += 1
+                elif char in '\'"':
+                    index = _skip_quote(string, index)
+                    if index == -1:
+                        return None
+                elif char in '([':
+                    end = _skip_brackets(string, index)
+                    if end == -1:
+                        return None
+                    inner = string[index+1:end-1]
+                    if not _EXPR_NAME.match(inner.strip()) and \
+                       inner != inner.strip():
+                        parts.append(string[copied:index+1])
+                        parts.append(inner.strip())
+                        copied = end - 1
+                        shift -= len(inner) - len(inner.strip())
+                    index = end
+                elif char.isspace():
+                    # Keep going over e.g. 'a (i)' or 'a % b'.
+                    end = index + 1
+                    while end < len(string) and string[end].isspace():
+                        end += 1
+                    if end == len(string) or not (
+                            string[end].isalnum() or string[end] in '_%(['):
+                        break
+                    index = end
+                else:
+                    break
+            if index == operand_start:
+                return None
+            tokens.append(('operand', None, start, index + shift))
+            want_operand = False
+            continue
+        # A literal constant must be followed by an operator.
+        if index < len(string) and (string[index].isalnum() or
+                                    string[index] in '_.\'"(['):
+            return None
+        tokens.append(('operand', None, start, index + shift))
+        want_operand = False
+    if want_operand:
+        return None
+    parts.append(string[copied:])
+    return ''.join(parts), tokens
+
+
+def _expr_node(cls, string, *items):
+    '''
+    :returns: a node of class cls for string made up of items, just as \
+        :py:meth:`Base.__new__` creates one from the result of cls.match.
+    :rtype: :py:class:`fparser.two.utils.Base`
+
+    '''
+    obj = object.__new__(cls)
+    obj.string = string
+    obj.item = None
+    obj.init(*items)
+    return obj
+
+
+def _parse_expr(expr, tokens, index, power):
+    '''
+    Parse tokens from index on into a node holding all operators with
+    a binding power of at least power.
+
+    :param str expr: the expression the tokens index into.
+    :param list tokens: the tokens returned by :py:func:`_expr_tokens`.
+    :param int index: index of the first token to parse.
+    :param int power: the lowest binding power to take in.
+
+    :returns: the node, its extent in expr and the index of the first \
+        token not parsed.
+    :rtype: (:py:class:`fparser.two.utils.Base`, int, int, int)
+
+    :raises NoMatchError: if the tokens can not be parsed.
+
+    '''
+    kind, value, start, end = tokens[index]
+    if kind == 'operand':
+        node = Primary(expr[start:end])
+        index += 1
+    elif kind == 'not' and power <= _EXPR_NOT_POWER:
+        rhs, _, end, index = _parse_expr(
+            expr, tokens, index + 1, _EXPR_NOT_POWER + 1)
+        node = _expr_node(And_Operand, expr[start:end], value, rhs)
+    elif kind == 'sign' and power <= _EXPR_SIGN_POWER:
+        rhs, _, end, index = _parse_expr(
+            expr, tokens, index + 1, _EXPR_SIGN_POWER + 1)
+        node = _expr_node(Level_2_Unary_Expr, expr[start:end], value, rhs)
+    else:
+        # e.g. a .not. or sign after another operator. The rules below
+        # only accept some of these so leave them to decide.
+        raise NoMatchError(expr)
+    previous = None
+    while index < len(tokens):
+        op = tokens[index][1]
+        op_power, cls = _EXPR_OPERATORS[op]
+        if op_power < power:
+            break
+        if op_power == previous == 5:
+            # Relational operators do not group.
+            raise NoMatchError(expr)
+        rhs, _, end, index = _parse_expr(
+            expr, tokens, index + 1,
+            op_power if op == '**' else op_power + 1)
+        node = _expr_node(cls, expr[start:end], node, op, rhs)
+        previous = op_power
+    return node, start, end, index
+
+
+def _match_expr(string):
+    '''
+    Match an expression made up of intrinsic operators in a single
+    pass by precedence climbing, rather than by trying the
+    :py:class:`Level_5_Expr` ... :py:class:`Mult_Operand` rules one by
+    one. Those split the string at each precedence level in turn so
+    their cost grows with the square of the number of operators and
+    their recursion depth with the number of operators.
+
+    :param str string: the expression.
+
+    :returns: the same tree as the rules would give or None if \
+        string is not certain to be matched in the same way by them \
+        (e.g. because it contains defined operators or is a single \
+        primary).
+    :rtype: :py:class:`fparser.two.utils.Base` or NoneType
+
+    '''
+    if not isinstance(string, str) or string != string.strip() or \
+       not string or '\\' in string:
+        # The rules treat surrounding white space and (in splitquote)
+        # backslashes in their own ways.
+        return None
+    result = _expr_tokens(string)
+    if result is None or len(result[1]) == 1:
+        return None
+    expr, tokens = result
+    binary = any(token[0] == 'binary' for token in tokens)
+    if not binary:
+        expr = string
+    try:
+        node, _, _, _ = _parse_expr(expr, tokens, 0, 0)
+    except NoMatchError:
+        return None
+    if binary:
+        # The operands of binary operators are passed on as rewritten
+        # by string_replace_map but those of unary operators are not,
+        # so restore the strings of the nodes above the first binary one.
+        node.string = string
+        top = node
+        index = 0
+        while isinstance(top, (And_Operand, Level_2_Unary_Expr)):
+            top = top.items[1]
+            top.string = string[tokens[index][3]:].lstrip()
+            index += 1
+    return node
+
+
 class Expr(BinaryOpBase):  # R722
     """
     <expr> = [ <expr> <defined-binary-op> ] <level-5-expr>
@@ -4585,6 +4894,9 @@ class Expr(BinaryOpBase):  # R722
     use_names = ['Expr']
 
     def match(string):
+        result = _match_expr(string)
+        if result is not None:
+            return result
         return BinaryOpBase.match(
             Expr, pattern.defined_binary_op.named(), Level_5_Expr,
             string, exclude_op_pattern=pattern.non_defined_binary_op)
@@ -9728,43 +10040,6 @@ class Stmt_Function_Stmt(StmtBase):  # R1238
 #
 
 
-ClassType = type(Base)
-_names = dir()
-for clsname in _names:
-    my_cls = eval(clsname)
-    if not (isinstance(my_cls, ClassType) and issubclass(my_cls, Base) and
-            not my_cls.__name__.endswith('Base')):
-        continue
-
-    names = getattr(my_cls, 'subclass_names', []) + \
-        getattr(my_cls, 'use_names', [])
-    for n in names:
-        if n in _names:
-            continue
-        if n.endswith('_List'):
-            _names.append(n)
-            n = n[:-5]
-            # Generate 'list' class
-            exec('''\
-class %s_List(SequenceBase):
-    subclass_names = [\'%s\']
-    use_names = []
-    def match(string): return SequenceBase.match(r\',\', %s, string)
-    match = staticmethod(match)
-''' % (n, n, n))
-        elif n.endswith('_Name'):
-            _names.append(n)
-            n = n[:-5]
-            exec('''\
-class %s_Name(Base):
-    subclass_names = [\'Name\']
-''' % (n))
-        elif n.startswith('Scalar_'):
-            _names.append(n)
-            n = n[7:]
-            exec('''\
-class Scalar_%s(Base):
-    subclass_names = [\'%s\']
-''' % (n, n))
+generate_classes(globals())
 
 # EOF
@@ -77,6 +77,7 @@ from fparser.two.Fortran2003 import Program_Unit as Program_Unit_2003
 from fparser.two.Fortran2003 import EndStmtBase, BlockBase, SequenceBase, \
     Base, Specification_Part, Module_Subprogram_Part, Implicit_Part, \
     Implicit_Part_Stmt, Declaration_Construct, Use_Stmt, Import_Stmt
+from fparser.two.utils import generate_classes
 
 
 class Program_Unit(Program_Unit_2003):  # R202
@@ -397,41 +398,4 @@ class Parent_Identifier(Base):  # R1118 (C1113)
 #
 
 
-ClassType = type(Base)
-_names = dir()
-for clsname in _names:
-    cls = eval(clsname)
-    if not (isinstance(cls, ClassType) and issubclass(cls, Base) and
-            not cls.__name__.endswith('Base')):
-        continue
-
-    names = getattr(cls, 'subclass_names', []) + getattr(cls, 'use_names', [])
-    for n in names:
-        if n in _names:
-            continue
-        if n.endswith('_List'):
-            _names.append(n)
-            n = n[:-5]
-            # Generate 'list' class
-            exec('''\
-class %s_List(SequenceBase):
-    subclass_names = [\'%s\']
-    use_names = []
-    def match(string): return SequenceBase.match(r\',\', %s, string)
-    match = staticmethod(match)
-''' % (n, n, n))
-        elif n.endswith('_Name'):
-            _names.append(n)
-            n = n[:-5]
-            exec('''\
-class %s_Name(Base):
-    subclass_names = [\'Name\']
-''' % (n))
-# Currently there are no examples using scalar_* as a class name.
-#         elif n.startswith('Scalar_'):
-#             _names.append(n)
-#             n = n[7:]
-#             exec('''\
-# class Scalar_%s(Base):
-#     subclass_names = [\'%s\']
-# ''' % (n, n))
+generate_classes(globals())
@@ -65,10 +65,150 @@
 
 '''This file provides utilities to create a Fortran parser suitable
 for a particular standard.'''
-# pylint: disable=eval-used
 
+import contextlib
+import difflib
+import hashlib
 import inspect
+import json
+import os
+import pickle
+import re
 import sys
+import tempfile
+import threading
+from fparser.two.utils import MatchCache, DispatchIndex, LeafTable, \
+    PARSE_STATE, Base, BlockBase, FortranSyntaxError, get_cache_dir, walk
+
+# The version of the format of the tables that are kept on disk by
+# ParserFactory. Increase this whenever the format changes.
+GRAMMAR_TABLE_VERSION = 1
+
+# The tables (choices for each class and dispatch index) that have
+# already been created in this process, keyed by standard.
+_GRAMMAR_TABLES = {}
+
+# Matches code that contains an include line (either a Fortran include
+# or a preprocessor one).
+_INCLUDE_LINE = re.compile(r"^\s*#?\s*include\b", re.I | re.M).search
+
+# The types that may begin a type declaration or a function prefix.
+_TYPE_KEYWORDS = ('INTEGER', 'REAL', 'DOUBLE', 'COMPLEX', 'CHARACTER',
+                  'LOGICAL', 'BYTE', 'TYPE', 'CLASS')
+# The prefixes that may come before FUNCTION or SUBROUTINE.
+_PROCEDURE_PREFIXES = ('ELEMENTAL', 'IMPURE', 'MODULE', 'PURE',
+                       'RECURSIVE') + _TYPE_KEYWORDS
+
+# Match the statements that begin and end program units and
+# subprograms, and interface blocks (within which MODULE PROCEDURE does
+# not begin a subprogram). These are used to find where the program
+# units in some code begin and end without parsing it.
+_UNIT_START = re.compile(
+    r"^(?:(?:program|block\s*data)\b\s*\w*\s*$|submodule\s*\("
+    r"|module\s*procedure\s+\w+\s*$"
+    r"|module\s+(?!(?:procedure|subroutine|function)\b)\w+\s*$"
+    r"|(?:(?:{0}|non_recursive)\s+"
+    r"|(?:{1})\s*(?:precision|complex)?\s*"
+    r"(?:\*\s*(?:\d+|\(\s*\*\s*\))\s*)?"
+    r"(?:\((?:[^()]|\([^()]*\))*\)\s*)?)*"
+    r"(?:subroutine|function)\b\s*\w)".format(
+        "|".join(sorted(set(_PROCEDURE_PREFIXES) - set(_TYPE_KEYWORDS))),
+        "|".join(_TYPE_KEYWORDS)), re.I).match
+_UNIT_END = re.compile(
+    r"^end\s*(?:(?:program|module|submodule|subroutine|function|procedure"
+    r"|block\s*data)\b\s*\w*)?\s*$", re.I).match
+_INTERFACE_START = re.compile(r"^(?:abstract\s*)?interface\b", re.I).match
+_INTERFACE_END = re.compile(r"^end\s*interface\b", re.I).match
+
+# The keywords that a statement matched by each of these classes must
+# begin with. This is used to build the dispatch index that avoids
+# trying classes that can not match a statement (see
+# :py:class:`fparser.two.utils.DispatchIndex`). Classes that match a
+# construct are included when the first statement of the construct
+# must begin with a keyword. A class must only be added here if it can
+# never match a statement beginning with anything else. Classes
+# derived from EndStmtBase are added automatically.
+LEADING_KEYWORDS = {
+    # A comment is never a statement so never matches one
+    'Comment': (),
+    # Action statements
+    'Allocate_Stmt': ('ALLOCATE',),
+    'Arithmetic_If_Stmt': ('IF',),
+    'Backspace_Stmt': ('BACKSPACE',),
+    'Call_Stmt': ('CALL',),
+    'Close_Stmt': ('CLOSE',),
+    'Computed_Goto_Stmt': ('GOTO',),
+    'Continue_Stmt': ('CONTINUE',),
+    'Cycle_Stmt': ('CYCLE',),
+    'Deallocate_Stmt': ('DEALLOCATE',),
+    'Endfile_Stmt': ('ENDFILE',),
+    'Exit_Stmt': ('EXIT',),
+    'Flush_Stmt': ('FLUSH',),
+    'Forall_Stmt': ('FORALL',),
+    'Goto_Stmt': ('GOTO',),
+    'If_Stmt': ('IF',),
+    'Inquire_Stmt': ('INQUIRE',),
+    'Nullify_Stmt': ('NULLIFY',),
+    'Open_Stmt': ('OPEN',),
+    'Print_Stmt': ('PRINT',),
+    'Read_Stmt': ('READ',),
+    'Return_Stmt': ('RETURN',),
+    'Rewind_Stmt': ('REWIND',),
+    'Stop_Stmt': ('STOP',),
+    'Wait_Stmt': ('WAIT',),
+    'Where_Stmt': ('WHERE',),
+    'Write_Stmt': ('WRITE',),
+    # Executable constructs
+    'Associate_Construct': ('ASSOCIATE',),
+    'Case_Construct': ('SELECT',),
+    'Do_Construct': ('DO',),
+    'Forall_Construct': ('FORALL',),
+    'If_Construct': ('IF',),
+    'Select_Type_Construct': ('SELECT',),
+    'Where_Construct': ('WHERE',),
+    # Other statements in the execution part
+    'Data_Stmt': ('DATA',),
+    'Entry_Stmt': ('ENTRY',),
+    'Format_Stmt': ('FORMAT',),
+    # Specification statements
+    'Access_Stmt': ('PUBLIC', 'PRIVATE'),
+    'Allocatable_Stmt': ('ALLOCATABLE',),
+    'Asynchronous_Stmt': ('ASYNCHRONOUS',),
+    'Bind_Stmt': ('BIND',),
+    'Common_Stmt': ('COMMON',),
+    'Cray_Pointer_Stmt': ('POINTER',),
+    'Dimension_Stmt': ('DIMENSION',),
+    'Equivalence_Stmt': ('EQUIVALENCE',),
+    'External_Stmt': ('EXTERNAL',),
+    'Implicit_Stmt': ('IMPLICIT',),
+    'Import_Stmt': ('IMPORT',),
+    'Intent_Stmt': ('INTENT',),
+    'Intrinsic_Stmt': ('INTRINSIC',),
+    'Namelist_Stmt': ('NAMELIST',),
+    'Optional_Stmt': ('OPTIONAL',),
+    'Parameter_Stmt': ('PARAMETER',),
+    'Pointer_Stmt': ('POINTER',),
+    'Procedure_Declaration_Stmt': ('PROCEDURE',),
+    'Protected_Stmt': ('PROTECTED',),
+    'Save_Stmt': ('SAVE',),
+    'Target_Stmt': ('TARGET',),
+    'Type_Declaration_Stmt': _TYPE_KEYWORDS,
+    'Use_Stmt': ('USE',),
+    'Value_Stmt': ('VALUE',),
+    'Volatile_Stmt': ('VOLATILE',),
+    # Declaration constructs
+    'Derived_Type_Def': ('TYPE',),
+    'Enum_Def': ('ENUM',),
+    'Interface_Block': ('INTERFACE', 'ABSTRACT'),
+    # Program units and subprograms
+    'Block_Data': ('BLOCK',),
+    'Contains_Stmt': ('CONTAINS',),
+    'Function_Subprogram': ('FUNCTION',) + _PROCEDURE_PREFIXES,
+    'Main_Program': ('PROGRAM',),
+    'Module': ('MODULE',),
+    'Submodule': ('SUBMODULE',),
+    'Subroutine_Subprogram': ('SUBROUTINE',) + _PROCEDURE_PREFIXES,
+}
 
 
 def get_module_classes(input_module):
@@ -81,28 +221,793 @@ def get_module_classes(input_module):
     '''
     module_cls_members = []
     module_name = input_module.__name__
-    # first find all classes in the module. This includes imported
-    # classes.
-    all_cls_members = inspect.getmembers(sys.modules[module_name],
-                                         inspect.isclass)
-    # next only keep classes that are specified in the module.
-    for cls_member in all_cls_members:
-        if cls_member[1].__module__ == module_name:
+    # find all classes in the module, in the same order as
+    # inspect.getmembers, but only keep those that are specified in
+    # the module (rather than imported).
+    for cls_member in sorted(vars(input_module).items()):
+        if inspect.isclass(cls_member[1]) and \
+           cls_member[1].__module__ == module_name:
             module_cls_members.append(cls_member)
     return module_cls_members
 
 
+def _attach_reader(tree, reader):
+    '''Gives the items of a tree loaded from a TreeCache, which have no
+    reader (see :py:meth:`fparser.common.readfortran.Line.__getstate__`),
+    the reader of the code that the tree was created from and reads the
+    lines of that code, so that messages about the items can be given
+    as for a tree that has just been parsed.
+
+    :param tree: the parse tree.
+    :type tree: :py:class:`fparser.two.Fortran2003.Program`
+    :param reader: the reader of the code.
+    :type reader: :py:class:`fparser.common.readfortran.FortranReaderBase`
+
+    '''
+    while reader.get_single_line() is not None:
+        pass
+    # Only statements (and comments) have items. They are all within
+    # blocks so there is no need to walk the nodes below them.
+    for node in walk([tree],
+                     prune=lambda node: not isinstance(node, BlockBase)):
+        item = getattr(node, "item", None)
+        if item is not None:
+            item.reader = reader
+
+
+def _grammar_table_path(std):
+    '''
+    :param str std: the Fortran standard.
+
+    :returns: the path of the file in which the tables for the standard \
+              are kept or None if they should not be kept on disk. \
+              They are only kept in the directory given by the \
+              FPARSER_CACHE_DIR environment variable, if it is set, as \
+              creating them takes little longer than loading them.
+    :rtype: str or NoneType
+
+    '''
+    cache_dir = os.environ.get("FPARSER_CACHE_DIR")
+    if not cache_dir:
+        return None
+    return os.path.join(cache_dir, "grammar_{0}.json".format(std))
+
+
+def _grammar_table_signature(std):
+    '''The tables for a standard are only valid for the version of
+    fparser that created them. As fparser has no version number
+    available at run time the table is instead tied to the size and
+    modification time of each of the files that define the classes
+    and tables.
+
+    :param str std: the Fortran standard.
+
+    :returns: a signature identifying the source of the tables.
+    :rtype: list
+
+    '''
+    from fparser.two import Fortran2003, utils
+    modules = [Fortran2003, utils, sys.modules[__name__]]
+    if std == "f2008":
+        from fparser.two import Fortran2008
+        modules.append(Fortran2008)
+    return [GRAMMAR_TABLE_VERSION, std] + _module_signature(modules)
+
+
+def _module_signature(modules):
+    '''
+    :param modules: the modules to identify.
+    :type modules: list of module
+
+    :returns: the name, size and modification time of the file of \
+              each module.
+    :rtype: list of list
+
+    '''
+    signature = []
+    for module in modules:
+        stat = os.stat(module.__file__)
+        signature.append([os.path.basename(module.__file__),
+                          stat.st_size, stat.st_mtime])
+    return signature
+
+
+def _write_file(path, data, mode="w"):
+    '''Write a file atomically (by writing a temporary file and then
+    renaming it) so that concurrent processes never see a partly written
+    file. Failing to write the file is not an error as the files written
+    by fparser are only used to speed up later processes.
+
+    :param str path: the path of the file.
+    :param data: the contents of the file.
+    :type data: str or bytes
+    :param str mode: the mode in which to open the file.
+
+    :returns: whether the file was written.
+    :rtype: bool
+
+    '''
+    tmp_path = None
+    try:
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        handle, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(handle, mode) as output_file:
+            output_file.write(data)
+        # os.replace is not available in Python 2
+        getattr(os, "replace", os.rename)(tmp_path, path)
+    except (IOError, OSError):
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+    return True
+
+
+def _unit_extents(tree, line_count=None):
+    '''Find the lines of code from which each of the top-level nodes
+    (program units and the comments between them) of a parse tree were
+    created. The lines between two nodes are included in the extent of
+    the later node so that the extents cover all of the code.
+
+    :param tree: a parse tree.
+    :type tree: :py:class:`fparser.two.Fortran2003.Program` or NoneType
+    :param int line_count: the number of lines in the code.
+
+    :returns: the first and last line (counting from 1) of each \
+        top-level node, an empty list if the tree is empty, or None \
+        if the tree does not consist of independent program units \
+        with known lines.
+    :rtype: list of (int, int) or NoneType
+
+    '''
+    from fparser.two.Fortran2003 import Main_Program0
+    if tree is None:
+        return []
+    extents = []
+    first = 1
+    for node in tree.content:
+        if node is None:
+            # The tree of empty code.
+            continue
+        if isinstance(node, Main_Program0):
+            # A main program without a program statement is only
+            # recognised when matching the whole of the code.
+            return None
+        spans = [child.item.span for child in walk([node])
+                 if getattr(child, "item", None) is not None]
+        if not spans:
+            return None
+        last = max(span[1] for span in spans)
+        if last < first:
+            return None
+        extents.append((first, last))
+        first = last + 1
+    if extents and line_count is not None:
+        extents[-1] = (extents[-1][0], max(line_count, extents[-1][1]))
+    return extents
+
+
+def _shift_spans(node, offset):
+    '''Add an offset to the line numbers of all of the lines from which
+    a node and its descendants were created.
+
+    :param node: the node.
+    :type node: :py:class:`fparser.two.utils.Base`
+    :param int offset: the number of lines to add.
+
+    '''
+    if not offset:
+        return
+    items = dict((id(child.item), child.item) for child in walk([node])
+                 if getattr(child, "item", None) is not None)
+    for item in items.values():
+        item.span = (item.span[0] + offset, item.span[1] + offset)
+
+
+def _map_line(opcodes, index):
+    '''Find where a line that is not changed (or the end of the code)
+    is in the new code.
+
+    :param opcodes: the changes to the code as returned by \
+        :py:meth:`difflib.SequenceMatcher.get_opcodes`.
+    :type opcodes: list of (str, int, int, int, int)
+    :param int index: the index of the line in the old code.
+
+    :returns: the index of the line in the new code.
+    :rtype: int
+
+    '''
+    for _, start, end, new_start, _ in opcodes:
+        if start == index or start < index < end:
+            return new_start + index - start
+    return opcodes[-1][4]
+
+
+def _unit_ends(code, source_format):
+    '''Find the last line of each of the program units in some code
+    by looking at the statements that begin and end program units and
+    subprograms rather than parsing the code.
+
+    :param str code: the Fortran code.
+    :param source_format: the format of the code.
+    :type source_format: :py:class:`fparser.common.sourceinfo.FortranFormat`
+
+    :returns: the last line (counting from 1) of each program unit, \
+        or None if the program units can not be found.
+    :rtype: list of int or NoneType
+
+    '''
+    from fparser.common.readfortran import FortranStringReader, \
+        FortranReaderError, Line
+    reader = FortranStringReader(code)
+    reader.set_format(source_format)
+    ends = []
+    depth = 0
+    interface_depth = 0
+    try:
+        for item in reader:
+            if not isinstance(item, Line):
+                return None
+            line = item.line
+            if _UNIT_END(line):
+                depth -= 1
+                if depth < 0:
+                    return None
+                if not depth:
+                    ends.append(item.span[1])
+            elif _INTERFACE_END(line):
+                interface_depth -= 1
+            elif _INTERFACE_START(line):
+                interface_depth += 1
+            elif _UNIT_START(line) and not (
+                    interface_depth and line[:6].lower() == "module"):
+                depth += 1
+            elif not depth:
+                # A statement outside of any program unit.
+                return None
+    except FortranReaderError:
+        return None
+    if depth:
+        return None
+    return ends
+
+
+class TreeCache(object):
+    '''A cache of parse trees kept on disk so that a file which has not
+    changed since it was last parsed is loaded rather than parsed
+    again. A tree is found using a hash of the contents of the file,
+    the Fortran standard, the options of the reader and the source
+    files of fparser itself, so a tree is never used with a different
+    file or version of fparser.
+
+    Each tree is kept in its own (pickled) file, which is written
+    atomically so that many processes may share the same cache. When
+    the files in the cache take up more than `max_size` bytes the least
+    recently used of them are removed.
+
+    Code that uses include files is never cached as the tree then also
+    depends on the contents of those files.
+
+    :param str directory: the directory in which to keep the trees. \
+        The default is the "trees" directory in fparser's cache \
+        directory (see :py:func:`fparser.two.utils.get_cache_dir`). \
+        If there is no such directory then nothing is cached.
+    :param int max_size: the maximum size in bytes of the cache.
+
+    .. warning:: loading a pickle can run arbitrary code so the \
+        directory must only be writable by trusted users.
+
+    '''
+    # The version of the format of the cache. Increase this whenever
+    # the format changes.
+    VERSION = 1
+    # The extension of the files holding the trees.
+    EXTENSION = ".pickle"
+
+    def __init__(self, directory=None, max_size=256*1024*1024):
+        if directory is None:
+            cache_dir = get_cache_dir()
+            if cache_dir:
+                directory = os.path.join(cache_dir, "trees")
+        self._directory = directory
+        self._max_size = max_size
+        # The size of the files in the directory, which is only found
+        # when a tree is first saved (see _add_size).
+        self._size = None
+        # The signature of fparser's source files for each standard.
+        self._signatures = {}
+
+    @property
+    def directory(self):
+        '''
+        :returns: the directory in which the trees are kept, or None \
+                  if they are not kept.
+        :rtype: str or NoneType
+        '''
+        return self._directory
+
+    def key(self, std, reader):
+        '''Find the key of the tree that would be created when parsing
+        the code provided by a reader. The contents of the reader are
+        read but it is left as it was.
+
+        :param str std: the Fortran standard.
+        :param reader: the source of the Fortran code.
+        :type reader: :py:class:`fparser.common.readfortran.FortranReaderBase`
+
+        :returns: the key of the tree or None if the tree can not be \
+                  cached.
+        :rtype: str or NoneType
+
+        '''
+        if self._directory is None or reader.linecount or \
+           reader.has_pending_items():
+            # The reader has already been used so does not provide
+            # all of its contents.
+            return None
+        source = reader.source
+        try:
+            position = source.tell()
+            content = source.read()
+            source.seek(position)
+        except (AttributeError, IOError, OSError, ValueError):
+            return None
+        if _INCLUDE_LINE(content):
+            return None
+        signature = self._signatures.get(std)
+        if signature is None:
+            from fparser.common import readfortran, sourceinfo, splitline
+            from fparser.two import Fortran2003, Fortran2008, utils
+            signature = json.dumps(
+                [self.VERSION, std] + _module_signature(
+                    [Fortran2003, Fortran2008, utils, sys.modules[__name__],
+                     readfortran, sourceinfo, splitline]))
+            self._signatures[std] = signature
+        if not isinstance(content, bytes):
+            content = content.encode("utf-8")
+        hasher = hashlib.sha256(signature.encode("utf-8"))
+        hasher.update(str(reader.format).encode("utf-8"))
+        hasher.update(b"1" if reader._ignore_comments else b"0")
+        hasher.update(content)
+        return hasher.hexdigest()
+
+    def load(self, key):
+        '''
+        :param str key: the key of a tree, as returned by `key`.
+
+        :returns: the tree with the supplied key or None if it is not \
+                  in the cache.
+        :rtype: :py:class:`fparser.two.Fortran2003.Program` or NoneType
+
+        '''
+        path = os.path.join(self._directory, key + self.EXTENSION)
+        try:
+            with open(path, "rb") as tree_file:
+                tree = pickle.load(tree_file)
+        except (IOError, OSError):
+            # The tree is not in the cache.
+            return None
+        except Exception:  # pylint: disable=broad-except
+            # The file is corrupt or was created by an incompatible
+            # version of fparser (unpickling such a file may raise
+            # almost anything, e.g. KeyError in Python 2) so remove it.
+            _remove_file(path)
+            return None
+        try:
+            # Mark the tree as recently used.
+            os.utime(path, None)
+        except OSError:
+            pass
+        return tree
+
+    def save(self, key, tree):
+        '''Add a tree to the cache, removing the least recently used
+        trees if the cache becomes too large.
+
+        :param str key: the key of the tree, as returned by `key`.
+        :param tree: the tree to keep.
+        :type tree: :py:class:`fparser.two.Fortran2003.Program`
+
+        '''
+        try:
+            data = pickle.dumps(tree, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, RuntimeError, TypeError):
+            # The tree is too deep or contains something that can not
+            # be pickled.
+            return
+        path = os.path.join(self._directory, key + self.EXTENSION)
+        if _write_file(path, data, "wb"):
+            self._add_size(len(data))
+
+    def _add_size(self, size):
+        '''Record that a file of the supplied size has been added to the
+        cache and remove the least recently used files if the cache has
+        become too large. The size of the cache is only found from the
+        directory when the cache is first used and when it seems to be
+        too large, as other processes may also be adding and removing
+        files.
+
+        :param int size: the size of the new file in bytes.
+
+        '''
+        if self._size is not None:
+            self._size += size
+            if self._size <= self._max_size:
+                return
+        files = []
+        try:
+            names = os.listdir(self._directory)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith(self.EXTENSION):
+                path = os.path.join(self._directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # Removed by another process.
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        self._size = sum(file_size for _, file_size, _ in files)
+        if self._size <= self._max_size:
+            return
+        # Remove more than is needed so that this is not needed again
+        # for a while.
+        files.sort()
+        for _, file_size, path in files:
+            if self._size <= self._max_size * 3 // 4:
+                break
+            _remove_file(path)
+            self._size -= file_size
+
+
+def _remove_file(path):
+    '''Remove a file if it exists.
+
+    :param str path: the path of the file.
+
+    '''
+    try:
+        os.remove(path)
+    except OSError:
+        # Already removed by another process.
+        pass
+
+
+class Parser(object):
+    '''A parser for a particular Fortran standard, as returned by
+    :py:meth:`ParserFactory.create`. Calling the parser with a Fortran
+    reader returns the parse tree of the code provided by that reader.
+
+    A parser holds its own tables of the connections between the
+    classes of its standard and does not modify them, so parsers for
+    different standards may be used at the same time, and a parser may
+    be called concurrently from multiple threads.
+
+    :param str std: the Fortran standard supported by this parser.
+    :param program_cls: the class that matches a complete program.
+    :type program_cls: :py:class:`fparser.two.Fortran2003.Program`
+    :param dict subclasses: a mapping from the name of each class to \
+        a tuple of the classes that it may be matched by. This must \
+        not be modified once the parser has been created.
+    :param int match_cache_size: the maximum number of entries in the \
+        packrat cache of match results used while parsing. If this is \
+        0 then no cache is used.
+    :param dispatch_index: the index used to skip classes that can \
+        not match a statement, or None to try every class.
+    :type dispatch_index: :py:class:`fparser.two.utils.DispatchIndex` \
+        or NoneType
+    :param tree_cache: the on-disk cache of parse trees to use, or \
+        None to always parse the code.
+    :type tree_cache: :py:class:`fparser.two.parser.TreeCache` or NoneType
+    :param bool share_leaves: whether identical leaves of a parse tree \
+        (names, literal constants, ...) share a single node (see \
+        :py:class:`fparser.two.utils.LeafTable`).
+
+    '''
+    def __init__(self, std, program_cls, subclasses, match_cache_size=0,
+                 dispatch_index=None, tree_cache=None, share_leaves=False):
+        self._std = std
+        self._program_cls = program_cls
+        self._subclasses = subclasses
+        self._dispatch_index = dispatch_index
+        self._match_cache_size = match_cache_size
+        self._tree_cache = tree_cache
+        self._share_leaves = share_leaves
+        # Each thread using this parser has its own match cache.
+        self._local = threading.local()
+
+    def __call__(self, reader):
+        '''Parse the Fortran code provided by the reader.
+
+        :param reader: the source of the Fortran code.
+        :type reader: :py:class:`fparser.common.readfortran.FortranReaderBase`
+
+        If the parser has a TreeCache, and the tree of the code is found
+        in it, then the code is not parsed. The items of the tree (the
+        `item` of each statement) then refer to this reader, as they
+        would if the code had been parsed, and the lines of the code
+        are read so that the reader can give messages about them.
+
+        :returns: the parse tree of the code.
+        :rtype: :py:class:`fparser.two.Fortran2003.Program`
+
+        :raises FortranSyntaxError: if the code is not valid Fortran.
+
+        '''
+        key = None
+        if self._tree_cache is not None:
+            key = self._tree_cache.key(self._std, reader)
+            if key is not None:
+                tree = self._tree_cache.load(key)
+                if tree is not None:
+                    # The code has been parsed before so the reader
+                    # is only used for its lines.
+                    _attach_reader(tree, reader)
+                    return tree
+        tree = self._parse(reader)
+        if key is not None and tree is not None:
+            self._tree_cache.save(key, tree)
+        return tree
+
+    def _parse(self, reader):
+        '''Parse the Fortran code provided by the reader.
+
+        :param reader: the source of the Fortran code.
+        :type reader: :py:class:`fparser.common.readfortran.FortranReaderBase`
+
+        :returns: the parse tree of the code.
+        :rtype: :py:class:`fparser.two.Fortran2003.Program`
+
+        '''
+        match_cache = self.match_cache
+        if match_cache is not None:
+            # Cached nodes are shared between the places they are
+            # matched so only share them within a single parse tree.
+            match_cache.clear()
+        # Leaves are only shared within a single parse tree.
+        leaves = LeafTable() if self._share_leaves else None
+        with self._state(match_cache, leaves):
+            return self._program_cls(reader)
+
+    def activate(self):
+        '''Use the tables of this parser when the classes of its standard
+        are used directly (rather than through the parser) within the
+        current thread, e.g.
+
+        >>> with parser.activate():
+        ...     ast = Fortran2008.Submodule(reader)
+
+        Outside of such a context the classes use the tables in
+        :py:attr:`fparser.two.utils.Base.subclasses`, which are those of
+        the first parser to be created.
+
+        :returns: a context manager.
+
+        '''
+        return self._state(None, None)
+
+    @contextlib.contextmanager
+    def _state(self, match_cache, leaves):
+        '''A context in which the current thread parses with the tables
+        of this parser (see :py:data:`fparser.two.utils.PARSE_STATE`).
+        The previous state is restored on leaving it.
+
+        :param match_cache: the packrat cache to use, if any.
+        :type match_cache: :py:class:`fparser.two.utils.MatchCache` or \
+            NoneType
+        :param leaves: the table of shared leaves to use, if any.
+        :type leaves: :py:class:`fparser.two.utils.LeafTable` or NoneType
+
+        '''
+        previous_state = (PARSE_STATE.subclasses,
+                          PARSE_STATE.match_cache,
+                          PARSE_STATE.dispatch_index,
+                          PARSE_STATE.leaves)
+        PARSE_STATE.subclasses = self._subclasses
+        PARSE_STATE.match_cache = match_cache
+        PARSE_STATE.dispatch_index = self._dispatch_index
+        PARSE_STATE.leaves = leaves
+        try:
+            yield self
+        finally:
+            (PARSE_STATE.subclasses,
+             PARSE_STATE.match_cache,
+             PARSE_STATE.dispatch_index,
+             PARSE_STATE.leaves) = previous_state
+
+    def reparse(self, tree, old_source, new_source, **reader_args):
+        '''Update the parse tree of some Fortran code after the code has
+        been changed. Only the program units (and comments between
+        them) that contain a change are parsed again. The others are
+        kept, with the line numbers of their statements updated to
+        those in the new code. If the changes can not be confined to
+        some of the program units the whole of the new code is parsed.
+
+        :param tree: the parse tree of the old code, as returned by \
+            this parser. This is modified and may be returned.
+        :type tree: :py:class:`fparser.two.Fortran2003.Program` or \
+            NoneType
+        :param str old_source: the code from which the tree was created.
+        :param str new_source: the new code.
+        :param reader_args: keyword arguments (`include_dirs`, \
+            `source_only` and `ignore_comments`) for the \
+            :py:class:`fparser.common.readfortran.FortranStringReader` \
+            used to read the code. These must be the same as those of \
+            the reader used to create the tree.
+
+        :returns: the parse tree of the new code.
+        :rtype: :py:class:`fparser.two.Fortran2003.Program` or NoneType
+
+        :raises FortranSyntaxError: if the new code is not valid Fortran.
+
+        '''
+        from fparser.common.readfortran import FortranStringReader
+        from fparser.common.sourceinfo import get_source_info_str
+        old_lines = old_source.split("\n")
+        new_lines = new_source.split("\n")
+        if old_lines == new_lines:
+            return tree
+        extents = None
+        if not _INCLUDE_LINE(old_source) and not _INCLUDE_LINE(new_source):
+            extents = _unit_extents(tree, len(old_lines))
+        if not extents:
+            return self(FortranStringReader(new_source, **reader_args))
+        opcodes = difflib.SequenceMatcher(
+            None, old_lines, new_lines, autojunk=False).get_opcodes()
+        # Find which of the top-level nodes contain a change.
+        changed = [False]*len(extents)
+        for tag, start, end, _, _ in opcodes:
+            if tag == "equal":
+                continue
+            if start == end:
+                # Lines inserted before a line belong to the node
+                # containing that line (or the last node at the end).
+                start = min(start, len(old_lines) - 1)
+                end = start + 1
+            for index, (first, last) in enumerate(extents):
+                if first <= end and last > start:
+                    changed[index] = True
+        source_format = get_source_info_str(new_source)
+        content = []
+        index = 0
+        while index < len(extents):
+            first = extents[index][0]
+            if not changed[index]:
+                node = tree.content[index]
+                _shift_spans(node, _map_line(opcodes, first - 1) - first + 1)
+                content.append(node)
+                index += 1
+                continue
+            # Parse the new code that replaces this run of changed nodes.
+            while index < len(extents) and changed[index]:
+                last = extents[index][1]
+                index += 1
+            new_first = _map_line(opcodes, first - 1)
+            if last < len(old_lines):
+                new_last = _map_line(opcodes, last)
+            else:
+                new_last = len(new_lines)
+            if new_first == new_last:
+                # The nodes have been removed.
+                continue
+            code = "\n".join(new_lines[new_first:new_last])
+            if new_last < len(new_lines):
+                code += "\n"
+            reader = FortranStringReader(code, **reader_args)
+            reader.set_format(source_format)
+            try:
+                part = self._parse(reader)
+                # If this part of the code is not just program units
+                # then its tree depends on the rest of the code.
+                valid = _unit_extents(part) is not None
+            except FortranSyntaxError:
+                # Parse all of the code so that the error refers to the
+                # correct line.
+                valid = False
+            if not valid:
+                return self(FortranStringReader(new_source, **reader_args))
+            if part is not None:
+                for node in part.content:
+                    if node is not None:
+                        _shift_spans(node, new_first)
+                        content.append(node)
+        if not content:
+            return self(FortranStringReader(new_source, **reader_args))
+        tree.content = content
+        return tree
+
+    def __repr__(self):
+        return "{0}(std='{1}')".format(self.__class__.__name__, self._std)
+
+    @property
+    def std(self):
+        '''
+        :returns: the Fortran standard supported by this parser.
+        :rtype: str
+        '''
+        return self._std
+
+    @property
+    def match_cache(self):
+        '''
+        :returns: the packrat cache used by this parser in the current \
+                  thread or None if it does not use one.
+        :rtype: :py:class:`fparser.two.utils.MatchCache` or NoneType
+        '''
+        if not self._match_cache_size:
+            return None
+        match_cache = getattr(self._local, "match_cache", None)
+        if match_cache is None:
+            match_cache = MatchCache(self._match_cache_size)
+            self._local.match_cache = match_cache
+        return match_cache
+
+    @property
+    def dispatch_index(self):
+        '''
+        :returns: the index used by this parser to skip classes that can \
+                  not match a statement or None if it does not use one.
+        :rtype: :py:class:`fparser.two.utils.DispatchIndex` or NoneType
+        '''
+        return self._dispatch_index
+
+    @property
+    def tree_cache(self):
+        '''
+        :returns: the on-disk cache of parse trees used by this parser \
+                  or None if it does not use one.
+        :rtype: :py:class:`fparser.two.parser.TreeCache` or NoneType
+        '''
+        return self._tree_cache
+
+    @property
+    def share_leaves(self):
+        '''
+        :returns: whether identical leaves of the parse trees created \
+                  by this parser share a single node.
+        :rtype: bool
+        '''
+        return self._share_leaves
+
+    @property
+    def subclasses(self):
+        '''
+        :returns: the choices for each rule, as a mapping from the name \
+                  of a class to a tuple of the classes to try when \
+                  matching it.
+        :rtype: dict
+        '''
+        return self._subclasses
+
+
 class ParserFactory(object):
     '''Creates a parser suitable for the specified Fortran standard.'''
 
-    def create(self, std=None):
-        '''Creates a class hierarchy suitable for the specified Fortran
-        standard.
+    def create(self, std=None, match_cache_size=0, tree_cache=None,
+               share_leaves=False):
+        '''Creates a parser suitable for the specified Fortran standard.
 
         :param str std: the Fortran standard. Choices are 'f2003' or \
                         'f2008'. 'f2003' is the default.
-        :return: a Program class (not object) for use with the Fortran reader
-        :rtype: :py:class:`fparser.two.Fortran2003.Program`
+        :param int match_cache_size: the maximum number of match results \
+            to keep in the parser's packrat cache. The cache avoids \
+            re-matching the same sub-string with the same rule when the \
+            parser backtracks. The default, 0, disables the cache.
+        :param tree_cache: an on-disk cache of parse trees from which \
+            the trees of code that has been parsed before are loaded \
+            rather than parsed again. The default, None, disables this.
+        :type tree_cache: :py:class:`fparser.two.parser.TreeCache` or \
+            NoneType
+        :param bool share_leaves: whether identical leaves of a parse \
+            tree, such as names and literal constants, share a single \
+            node. This makes large trees smaller but a shared leaf \
+            must be replaced rather than changed (see \
+            :py:class:`fparser.two.utils.LeafTable`). The default, \
+            False, gives every leaf its own node.
+        :return: a parser for use with the Fortran reader
+        :rtype: :py:class:`fparser.two.parser.Parser`
         :raises ValueError: if the supplied value for the std parameter \
                             is invalid
 
@@ -112,161 +1017,518 @@ class ParserFactory(object):
         >>> f2003_parser = ParserFactory().create()
         >>> f2003_parser = ParserFactory().create(std='f2003')
         >>> f2008_parser = ParserFactory().create(std='f2008')
+        >>> cached_parser = ParserFactory().create(match_cache_size=10000)
+        >>> disk_parser = ParserFactory().create(tree_cache=TreeCache())
+        >>> compact_parser = ParserFactory().create(share_leaves=True)
         >>> # Assuming that a reader has already been created ...
         >>> ast = f2008_parser(reader)
         >>> print ast
 
+        '''
+        if not std:
+            # default to f2003.
+            std = "f2003"
+        if std not in ("f2003", "f2008"):
+            raise ValueError("'{0}' is an invalid standard".format(std))
+        from fparser.two import Fortran2003
+        # The tables for a standard never change so they are only
+        # created once. They may also be kept on disk (see
+        # _save_tables) so that they do not need to be created again
+        # by later processes.
+        tables = _GRAMMAR_TABLES.get(std)
+        if tables is None:
+            cls_members = self._get_classes(std)
+            tables = self._load_tables(std, cls_members)
+            if tables is None:
+                # call _setup to create the connections between the
+                # classes.
+                subclasses = self._setup(cls_members)
+                dispatch_index = self._create_dispatch_index(cls_members,
+                                                             subclasses)
+                tables = (subclasses, dispatch_index)
+                self._save_tables(std, tables)
+            _GRAMMAR_TABLES[std] = tables
+        subclasses, dispatch_index = tables
+        # The classes use the tables of the first parser to be created
+        # when they are used directly, outside of Parser.activate. Later
+        # parsers do not replace them so that they do not change under
+        # any code that uses them.
+        if not Fortran2003.Base.subclasses:
+            Fortran2003.Base.subclasses = subclasses
+        # return a parser that starts from the top level class when
+        # parsing Fortran code. Fortran2008 does not extend the top
+        # level class so we always use the Fortran2003 one.
+        return Parser(std, Fortran2003.Program, subclasses,
+                      match_cache_size, dispatch_index, tree_cache,
+                      share_leaves)
+
+    @staticmethod
+    def _get_classes(std):
+        '''Find the classes that make up the specified Fortran standard.
+
+        :param str std: the Fortran standard, 'f2003' or 'f2008'.
+
+        :returns: a list of tuples each containing a class name and a \
+                  class.
+        :rtype: list
+
         '''
         # find all relevant classes in our Fortran2003 file as we
         # always need these.
         from fparser.two import Fortran2003
         f2003_cls_members = get_module_classes(Fortran2003)
-        if not std:
-            # default to f2003.
-            std = "f2003"
         if std == "f2003":
-            # we already have our required list of classes so call _setup
-            # to setup our class hierarchy.
-            self._setup(f2003_cls_members)
-            # the class hierarchy has been set up so return the top
-            # level class that we start from when parsing Fortran code.
-            return Fortran2003.Program
-        elif std == "f2008":
-            # we need to find all relevent classes in our Fortran2003
-            # and Fortran2008 files and then ensure that where classes
-            # have the same name we return the Fortran2008 class
-            # i.e. where Fortran2008 extends Fortran2003 we return
-            # Fortran2008.
-            # First find all Fortran2008 classes.
-            from fparser.two import Fortran2008
-            f2008_cls_members = get_module_classes(Fortran2008)
-            # next add in Fortran2003 classes if they do not already
-            # exist as a Fortran2008 class.
-            f2008_class_names = [i[0] for i in f2008_cls_members]
-            for local_cls in f2003_cls_members:
-                if local_cls[0] not in f2008_class_names:
-                    f2008_cls_members.append(local_cls)
-            # we now have our required list of classes so call _setup
-            # to setup our class hierarchy.
-            self._setup(f2008_cls_members)
-            # the class hierarchy has been set up so return the top
-            # level class that we start from when parsing Fortran
-            # code. Fortran2008 does not extend the top level class so
-            # we return the Fortran2003 one.
-            return Fortran2003.Program
-        else:
-            raise ValueError("'{0}' is an invalid standard".format(std))
+            return f2003_cls_members
+        # we need to find all relevent classes in our Fortran2003
+        # and Fortran2008 files and then ensure that where classes
+        # have the same name we return the Fortran2008 class
+        # i.e. where Fortran2008 extends Fortran2003 we return
+        # Fortran2008.
+        # First find all Fortran2008 classes.
+        from fparser.two import Fortran2008
+        f2008_cls_members = get_module_classes(Fortran2008)
+        # next add in Fortran2003 classes if they do not already
+        # exist as a Fortran2008 class.
+        f2008_class_names = set([i[0] for i in f2008_cls_members])
+        for local_cls in f2003_cls_members:
+            if local_cls[0] not in f2008_class_names:
+                f2008_cls_members.append(local_cls)
+        return f2008_cls_members
 
-    def _setup(self, input_classes):
-        '''Perform some Python magic to create the connections between classes
-        and populate the baseclass with this information. This has
-        been lifted from the original implementation and no attempt
-        has been made to tidy up the code, other than making it
-        conformant to the coding rules.
+    @staticmethod
+    def _load_tables(std, input_classes):
+        '''Load the tables for the specified standard that were kept on
+        disk by a previous call of _save_tables.
 
+        :param str std: the Fortran standard.
         :param list input_classes: a list of tuples each containing a \
         class name and a class.
 
+        :returns: the choices for each class (as returned by _setup) \
+                  and the dispatch index, or None if there are no \
+                  valid tables on disk.
+        :rtype: (dict, :py:class:`fparser.two.utils.DispatchIndex`) or \
+                NoneType
+
         '''
+        path = _grammar_table_path(std)
+        if path is None:
+            return None
+        try:
+            with open(path, "r") as table_file:
+                table = json.load(table_file)
+            if table["signature"] != _grammar_table_signature(std):
+                return None
+            classes = dict((cls.__name__, cls) for _, cls in input_classes)
+            subclasses = {}
+            for name, subclass_names in table["subclasses"].items():
+                subclasses[str(name)] = tuple(
+                    [classes[subclass_name]
+                     for subclass_name in subclass_names])
+            keys = {}
+            for name, cls_keys in table["keys"].items():
+                keys[classes[name]] = frozenset(
+                    [str(key) for key in cls_keys])
+        except (IOError, OSError, ValueError, KeyError, TypeError,
+                AttributeError):
+            # The tables are missing, out of date or corrupt.
+            return None
+        return subclasses, DispatchIndex(keys)
 
-        __autodoc__ = []
-        base_classes = {}
+    @staticmethod
+    def _save_tables(std, tables):
+        '''Keep the tables for the specified standard on disk so that
+        later processes can use them (see _load_tables). The file is
+        written atomically so that concurrent processes never see a
+        partly written file. Failing to write the file is not an error
+        as it is only used to speed up later processes.
+
+        :param str std: the Fortran standard.
+        :param tables: the choices for each class (as returned by \
+                       _setup) and the dispatch index.
+        :type tables: (dict, :py:class:`fparser.two.utils.DispatchIndex`)
+
+        '''
+        path = _grammar_table_path(std)
+        if path is None:
+            return
+        subclasses, dispatch_index = tables
+        table = {
+            "signature": _grammar_table_signature(std),
+            "subclasses": dict(
+                (name, [cls.__name__ for cls in classes])
+                for name, classes in subclasses.items()),
+            "keys": dict(
+                (cls.__name__, sorted(keys))
+                for cls, keys in dispatch_index.items())}
+        _write_file(path, json.dumps(table))
+
+    @staticmethod
+    def _create_dispatch_index(input_classes, subclasses):
+        '''Create the index that maps the start of a statement to the
+        classes that might match it. Classes named in LEADING_KEYWORDS,
+        and those derived from EndStmtBase, are indexed by the first
+        two characters of their keywords. A class that only offers a
+        choice of other classes (i.e. it has no match method of its
+        own) is indexed if all of those choices are.
+
+        :param list input_classes: a list of tuples each containing a \
+        class name and a class.
+        :param dict subclasses: the choices for each class, as returned \
+        by _setup.
 
+        :returns: the dispatch index.
+        :rtype: :py:class:`fparser.two.utils.DispatchIndex`
+
+        '''
+        from fparser.two.utils import Base, EndStmtBase
+        keys = {}
+        choices = []
+        for name, cls in input_classes:
+            if not issubclass(cls, Base):
+                continue
+            if name in LEADING_KEYWORDS:
+                keys[cls] = frozenset(
+                    [keyword[:2] for keyword in LEADING_KEYWORDS[name]])
+            elif issubclass(cls, EndStmtBase):
+                keys[cls] = frozenset(['EN'])
+            elif 'match' not in cls.__dict__ and \
+                    subclasses.get(cls.__name__):
+                choices.append(cls)
+        # The subclass lists have already been flattened so each
+        # choice is between classes that have their own match method.
+        for cls in choices:
+            union = set()
+            for subcls in subclasses[cls.__name__]:
+                if subcls not in keys:
+                    break
+                union.update(keys[subcls])
+            else:
+                keys[cls] = frozenset(union)
+        return DispatchIndex(keys)
+
+    def _setup(self, input_classes):
+        '''Perform some Python magic to create the connections between
+        classes. The `subclass_names` of each class are flattened so
+        that each class maps to the classes with a match method that
+        it may be matched by. The classes themselves are not modified.
+
+        :param list input_classes: a list of tuples each containing a \
+        class name and a class.
+
+        :returns: a mapping from the name of each class to a tuple of \
+                  the classes that it may be matched by.
+        :rtype: dict
+
+        '''
         import logging
-        import fparser.two.Fortran2003
-        class_type = type(fparser.two.Fortran2003.Base)
-
-        # Reset subclasses dictionary in case this function has been
-        # called before. If this is not done then multiple calls to
-        # the ParserFactory create method may not work correctly.
-        fparser.two.Fortran2003.Base.subclasses = {}
-
-        for clsinfo in input_classes:
-            clsname = "{0}.{1}".format(clsinfo[1].__module__, clsinfo[0])
-            cls = eval(clsname)
-            # ?? classtype is set to Base so why have issubclass?
-            if isinstance(cls, class_type) and \
-               issubclass(cls, fparser.two.Fortran2003.Base) \
-               and not cls.__name__.endswith('Base'):
+        from fparser.two.utils import Base as base_cls
+
+        base_classes = {}
+        for clsname, cls in input_classes:
+            if issubclass(cls, base_cls) and \
+               not cls.__name__.endswith('Base'):
                 base_classes[cls.__name__] = cls
-                if len(__autodoc__) < 10:
-                    __autodoc__.append(cls.__name__)
 
         #
         # OPTIMIZE subclass_names tree.
         #
+        flattened = {}
 
-        if 1:  # Optimize subclass tree:
-
-            def _rpl_list(clsname):
-                if clsname not in base_classes:
-                    error_string = 'Not implemented: {0}'.format(clsname)
-                    logging.getLogger(__name__).debug(error_string)
-                    return []
-                # remove this code when all classes are implemented.
-                cls = base_classes[clsname]
-                if 'match' in cls.__dict__:
-                    return [clsname]
-                bits = []
-                for names in getattr(cls, 'subclass_names', []):
-                    list1 = _rpl_list(names)
-                    for names1 in list1:
-                        if names1 not in bits:
-                            bits.append(names1)
-                return bits
-
-            for cls in list(base_classes.values()):
-                if not hasattr(cls, 'subclass_names'):
-                    continue
-                opt_subclass_names = []
-                for names in cls.subclass_names:
-                    for names1 in _rpl_list(names):
-                        if names1 not in opt_subclass_names:
-                            opt_subclass_names.append(names1)
-                if not opt_subclass_names == cls.subclass_names:
-                    cls.subclass_names[:] = opt_subclass_names
-
-        # Initialize Base.subclasses dictionary:
+        def _rpl_list(clsname):
+            if clsname in flattened:
+                return flattened[clsname]
+            if clsname not in base_classes:
+                error_string = 'Not implemented: {0}'.format(clsname)
+                logging.getLogger(__name__).debug(error_string)
+                return []
+            # remove this code when all classes are implemented.
+            cls = base_classes[clsname]
+            if 'match' in cls.__dict__:
+                return [clsname]
+            bits = []
+            for names in getattr(cls, 'subclass_names', []):
+                list1 = _rpl_list(names)
+                for names1 in list1:
+                    if names1 not in bits:
+                        bits.append(names1)
+            flattened[clsname] = bits
+            return bits
+
+        subclasses = {}
         for clsname, cls in list(base_classes.items()):
             subclass_names = getattr(cls, 'subclass_names', None)
             if subclass_names is None:
                 message = '%s class is missing subclass_names list' % (clsname)
                 logging.getLogger(__name__).debug(message)
                 continue
-            try:
-                bits = fparser.two.Fortran2003.Base.subclasses[clsname]
-            except KeyError:
-                fparser.two.Fortran2003.Base.subclasses[clsname] = bits = []
-            for name in subclass_names:
+            opt_subclass_names = []
+            for names in subclass_names:
+                for names1 in _rpl_list(names):
+                    if names1 not in opt_subclass_names:
+                        opt_subclass_names.append(names1)
+            bits = []
+            for name in opt_subclass_names:
                 if name in base_classes:
                     bits.append(base_classes[name])
                 else:
                     message = '{0} not implemented needed by {1}'. \
                               format(name, clsname)
                     logging.getLogger(__name__).debug(message)
+            subclasses[clsname] = tuple(bits)
+
+        for cls in list(base_classes.values()):
+            subclass_names = getattr(cls, 'subclass_names', [])
+            use_names = getattr(cls, 'use_names', [])
+            for name in use_names + subclass_names:
+                if name not in base_classes:
+                    message = ('%s not defined used '
+                               'by %s' % (name, cls.__name__))
+                    logging.getLogger(__name__).debug(message)
+
+        return subclasses
+
+
+# The parser used by each process of the pool created by parse_files.
+_WORKER_PARSER = None
+
+
+def _init_worker(std, match_cache_size, tree_cache):
+    '''Creates the parser used by a process of the pool created by
+    :py:func:`parse_files` so that it is only created once per process.
+
+    :param str std: the Fortran standard to parse.
+    :param int match_cache_size: the size of the parser's packrat cache.
+    :param tree_cache: the parser's on-disk cache of parse trees.
+    :type tree_cache: :py:class:`fparser.two.parser.TreeCache` or NoneType
+
+    '''
+    global _WORKER_PARSER
+    _WORKER_PARSER = ParserFactory().create(
+        std=std, match_cache_size=match_cache_size, tree_cache=tree_cache)
+
+
+def _parse_file(args):
+    '''Parses a single file in a process of the pool created by
+    :py:func:`parse_files`.
+
+    :param args: the name of the file and the keyword arguments for \
+        its reader.
+    :type args: (str, dict)
+
+    :returns: the name of the file and either its parse tree or the \
+        error that stopped it from being parsed.
+    :rtype: (str, :py:class:`fparser.two.Fortran2003.Program` or \
+        :py:class:`Exception`)
 
-        if 1:
-            for cls in list(base_classes.values()):
-                # subclasses = fparser.two.Fortran2003.Base.subclasses.get(
-                #     cls.__name__, [])
-                # subclasses_names = [c.__name__ for c in subclasses]
-                subclass_names = getattr(cls, 'subclass_names', [])
-                use_names = getattr(cls, 'use_names', [])
-                # for name in subclasses_names:
-                #     break
-                #     if name not in subclass_names:
-                #         message = ('%s needs to be added to %s '
-                #                    'subclasses_name list'
-                #                    % (name, cls.__name__))
-                #         logging.getLogger(__name__).debug(message)
-                # for name in subclass_names:
-                #     break
-                #     if name not in subclasses_names:
-                #         message = '%s needs to be added to %s '
-                #         'subclass_name list' % (name, cls.__name__)
-                #         logging.getLogger(__name__).debug(message)
-                for name in use_names + subclass_names:
-                    if name not in base_classes:
-                        message = ('%s not defined used '
-                                   'by %s' % (name, cls.__name__))
-                        logging.getLogger(__name__).debug(message)
+    '''
+    from fparser.common.readfortran import FortranFileReader
+    filename, reader_args = args
+    try:
+        reader = FortranFileReader(filename, **reader_args)
+        return filename, _WORKER_PARSER(reader)
+    except Exception as error:  # pylint: disable=broad-except
+        # Whatever goes wrong with one file (e.g. it can not be decoded
+        # or its expressions are too deeply nested) must not stop the
+        # others from being parsed. The error is sent back to the main
+        # process so it must be picklable.
+        try:
+            pickle.dumps(error)
+        except Exception:  # pylint: disable=broad-except
+            error = RuntimeError("{0}: {1}".format(type(error).__name__,
+                                                   error))
+        return filename, error
+
+
+def parse_files(filenames, std=None, processes=None, match_cache_size=0,
+                tree_cache=None, **reader_args):
+    '''Parses a number of Fortran files using a pool of processes, each
+    of which creates a single parser that it uses for all of the files
+    that it is given. The parse tree of each file is sent back to this
+    process once the file has been parsed, so the files are generated
+    in the order in which they are parsed rather than the order in
+    which they are given.
+
+    :param filenames: the names of the files to parse.
+    :type filenames: list of str
+    :param str std: the Fortran standard. Choices are 'f2003' or \
+        'f2008'. 'f2003' is the default.
+    :param int processes: the number of processes to use. The default, \
+        None, uses one process for each CPU.
+    :param int match_cache_size: the size of the packrat cache of each \
+        parser (see :py:meth:`ParserFactory.create`).
+    :param tree_cache: the on-disk cache of parse trees used by each \
+        parser (see :py:meth:`ParserFactory.create`).
+    :type tree_cache: :py:class:`fparser.two.parser.TreeCache` or NoneType
+    :param reader_args: keyword arguments (`include_dirs`, \
+        `source_only` and `ignore_comments`) for the \
+        :py:class:`fparser.common.readfortran.FortranFileReader` \
+        of each file.
+
+    :returns: a generator giving the name of each file together with \
+        either its parse tree or the exception (such as a \
+        :py:class:`fparser.two.utils.FortranSyntaxError`, which \
+        gives the location of the error) raised when parsing it. The \
+        parse tree no longer refers to the reader used to create it.
+    :rtype: generator of (str, \
+        :py:class:`fparser.two.Fortran2003.Program` or \
+        :py:class:`Exception`)
+
+    :raises ValueError: if the supplied value for the std parameter \
+                        is invalid.
+
+    For example:
+
+    >>> from fparser.two.parser import parse_files
+    >>> for filename, result in parse_files(["a.f90", "b.f90"],
+    ...                                     std="f2008", processes=2):
+    ...     print(filename, result)
+
+    '''
+    # Check the standard (and create its tables) now, rather than when
+    # the first file is asked for, so that any error is raised here.
+    ParserFactory().create(std=std)
+    tasks = [(filename, reader_args) for filename in filenames]
+    return _parse_files(tasks, (std, match_cache_size, tree_cache),
+                        processes)
+
+
+def _parse_files(tasks, worker_args, processes):
+    '''Parses files in a pool of processes for :py:func:`parse_files`.
+    The pool is only started when the first file is asked for.
+
+    :param tasks: the name of each file and the arguments of its reader.
+    :type tasks: list of (str, dict)
+    :param tuple worker_args: the arguments of \
+        :py:func:`_init_worker` for each process.
+    :param int processes: the number of processes to use, or None for \
+        one process for each CPU.
+
+    :returns: a generator giving the name of each file together with \
+        either its parse tree or the exception raised when parsing it.
+    :rtype: generator of (str, \
+        :py:class:`fparser.two.Fortran2003.Program` or \
+        :py:class:`Exception`)
+
+    '''
+    import multiprocessing
+    pool = multiprocessing.Pool(processes, _init_worker, worker_args)
+    try:
+        for result in pool.imap_unordered(_parse_file, tasks):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _parse_code(args):
+    '''Parses some code in a process of the pool created by
+    :py:func:`parse_in_parallel`.
+
+    :param args: the code, its format and whether to ignore comments.
+    :type args: (str, :py:class:`fparser.common.sourceinfo.FortranFormat`, \
+        bool)
+
+    :returns: the parse tree of the code or the error raised when \
+        parsing it.
+    :rtype: :py:class:`fparser.two.Fortran2003.Program` or \
+        :py:class:`fparser.two.utils.FparserException`
+
+    '''
+    from fparser.common.readfortran import FortranStringReader
+    from fparser.two.utils import FparserException
+    code, source_format, ignore_comments = args
+    reader = FortranStringReader(code, ignore_comments=ignore_comments)
+    reader.set_format(source_format)
+    try:
+        return _WORKER_PARSER(reader)
+    except FparserException as error:
+        return error
+
+
+def parse_in_parallel(reader, std=None, processes=None, match_cache_size=0):
+    '''Parses the code provided by a reader by splitting it into its
+    program units and parsing them in a pool of processes. The program
+    units are found by looking for the statements that begin and end
+    them, which is much faster than parsing the code. The tree that is
+    returned is the same as that returned by parsing all of the code
+    with a single parser. The code is parsed by a single parser (in this
+    process) if it can not be split into program units that can be
+    parsed separately, it includes other files or it contains an error.
+    This is only faster than using a single parser for large amounts
+    of code.
+
+    :param reader: the source of the Fortran code.
+    :type reader: :py:class:`fparser.common.readfortran.FortranReaderBase`
+    :param str std: the Fortran standard. Choices are 'f2003' or \
+        'f2008'. 'f2003' is the default.
+    :param int processes: the number of processes to use. The default, \
+        None, uses one process for each CPU.
+    :param int match_cache_size: the size of the packrat cache of each \
+        parser (see :py:meth:`ParserFactory.create`).
+
+    :returns: the parse tree of the code.
+    :rtype: :py:class:`fparser.two.Fortran2003.Program`
+
+    :raises FortranSyntaxError: if the code is not valid Fortran.
+    :raises ValueError: if the supplied value for the std parameter \
+                        is invalid.
+
+    '''
+    import multiprocessing
+    parser = ParserFactory().create(std=std,
+                                    match_cache_size=match_cache_size)
+    source = reader.source
+    try:
+        position = source.tell()
+        code = source.read()
+        source.seek(position)
+    except (AttributeError, IOError, OSError, ValueError):
+        return parser(reader)
+    ends = None
+    if not (reader.linecount or reader.has_pending_items() or
+            _INCLUDE_LINE(code)):
+        ends = _unit_ends(code, reader.format)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if not ends or len(ends) < 2 or processes < 2:
+        return parser(reader)
+    # Divide the units between several parts for each process so that
+    # the processes are kept busy. The lines between two units are
+    # parsed with the later unit.
+    lines = code.split("\n")
+    ends[-1] = len(lines)
+    part_lines = max(1, len(lines) // (processes * 4))
+    parts = []
+    first = 0
+    for last in ends:
+        if last - first >= part_lines or last == ends[-1]:
+            parts.append((first, last))
+            first = last
+    tasks = []
+    for first, last in parts:
+        part_code = "\n".join(lines[first:last])
+        if last < len(lines):
+            part_code += "\n"
+        tasks.append((part_code, reader.format, reader._ignore_comments))
+    pool = multiprocessing.Pool(min(processes, len(tasks)), _init_worker,
+                                (std, match_cache_size, None))
+    try:
+        trees = pool.map(_parse_code, tasks)
+    finally:
+        pool.terminate()
+        pool.join()
+    content = []
+    for (first, _), tree in zip(parts, trees):
+        if not isinstance(tree, Base) or _unit_extents(tree) is None:
+            # Parse all of the code so that the tree and any error are
+            # the same as if the code had not been split.
+            return parser(reader)
+        for node in tree.content:
+            if node is not None:
+                _shift_spans(node, first)
+                content.append(node)
+    tree = trees[0]
+    tree.string = reader
+    tree.content = content
+    return tree
@@ -43,8 +43,10 @@ from fparser.two.Fortran2003 import Defined_Unary_Op, Defined_Binary_Op
 
 @pytest.fixture
 def f2003_create():
-    '''Create a fortran 2003 parser class hierarchy'''
-    _ = ParserFactory().create(std="f2003")
+    '''Create a fortran 2003 parser class hierarchy and use it for the
+    classes of the standard for the duration of the test.'''
+    with ParserFactory().create(std="f2003").activate():
+        yield
 
 
 @pytest.fixture(scope="module", params=[Defined_Unary_Op, Defined_Binary_Op])
@@ -0,0 +1,100 @@
+# Copyright (c) 2026 Science and Technology Facilities Council
+
+# All rights reserved.
+
+# Modifications made as part of the fparser project are distributed
+# under the following license:
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''Test Fortran 2003 rule R722 : This file tests the matching of
+expressions, in particular the single pass used for expressions made up
+of intrinsic operators.
+
+'''
+
+import pytest
+from fparser.two import Fortran2003
+from fparser.two.Fortran2003 import Expr
+
+
+@pytest.mark.parametrize("string, expected", [
+    ("a+b", "Level_2_Expr(Name('a'), '+', Name('b'))"),
+    ("a - b*c", "Level_2_Expr(Name('a'), '-', Add_Operand(Name('b'), '*', "
+     "Name('c')))"),
+    ("-a + b", "Level_2_Expr(Level_2_Unary_Expr('-', Name('a')), '+', "
+     "Name('b'))"),
+    ("a**b**c", "Mult_Operand(Name('a'), '**', Mult_Operand(Name('b'), "
+     "'**', Name('c')))"),
+    ("a / / 'x y'", "Level_3_Expr(Name('a'), '//', "
+     "Char_Literal_Constant(\"'x y'\", None))"),
+    ("a .eq. b .and. .not. c", "Or_Operand(Level_4_Expr(Name('a'), "
+     "'.EQ.', Name('b')), '.AND.', And_Operand('.NOT.', Name('c')))"),
+    ("x .or. y .neqv. z", "Level_5_Expr(Equiv_Operand(Name('x'), '.OR.', "
+     "Name('y')), '.NEQV.', Name('z'))"),
+    ("1.0e-5 + x", "Level_2_Expr(Real_Literal_Constant('1.0E-5', None), "
+     "'+', Name('x'))"),
+    ("( a*b ) + f(i)", "Level_2_Expr(Parenthesis('(', Add_Operand("
+     "Name('a'), '*', Name('b')), ')'), '+', Part_Ref(Name('f'), "
+     "Name('i')))")])
+def test_expr(f2003_create, monkeypatch, string, expected):
+    '''Check that expressions of intrinsic operators are matched in a
+    single pass and that this gives the same tree as matching them one
+    precedence level at a time.
+
+    '''
+    assert repr(Fortran2003._match_expr(string)) == expected
+    assert repr(Expr(string)) == expected
+    assert Expr(string).string == string
+    monkeypatch.setattr(Fortran2003, "_match_expr", lambda string: None)
+    assert repr(Expr(string)) == expected
+
+
+@pytest.mark.parametrize("string", [
+    "a", "a .myop. b", ".myop. a + b", "a < b < c", "a + -b",
+    "a * -b", ".not. .not. a", " a + b", "a.b.c", "1.eq.2", "a = b",
+    "(a + b"])
+def test_expr_fallback(f2003_create, string):
+    '''Check that expressions the single pass is not certain about are
+    left to the rules for each precedence level.
+
+    '''
+    assert Fortran2003._match_expr(string) is None
+
+
+def test_expr_long(f2003_create):
+    '''Check that a long sum is matched without running into the
+    recursion limit and that it can be written out again.
+
+    '''
+    string = " + ".join("c{0} * a(i + {0})".format(idx)
+                        for idx in range(2000))
+    ast = Expr(string)
+    assert isinstance(ast, Fortran2003.Level_2_Expr)
+    assert str(ast) == string
+    assert repr(ast).startswith("Level_2_Expr(Level_2_Expr(")
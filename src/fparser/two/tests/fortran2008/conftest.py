@@ -42,5 +42,7 @@ from fparser.two.parser import ParserFactory
 
 @pytest.fixture
 def f2008_create():
-    '''Create a fortran 2008 parser class hierarchy'''
-    _ = ParserFactory().create(std="f2008")
+    '''Create a fortran 2008 parser class hierarchy and use it for the
+    classes of the standard for the duration of the test.'''
+    with ParserFactory().create(std="f2008").activate():
+        yield
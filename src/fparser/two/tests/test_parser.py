@@ -77,3 +77,681 @@ def test_parserfactory_std():
     with pytest.raises(ValueError) as excinfo:
         parser = ParserFactory().create(std="invalid")
         assert "is an invalid standard" in str(excinfo.value)
+
+
+def test_parser_object():
+    '''Test that the ParserFactory create method returns a Parser object
+    which is used to parse code and that it supports the std argument.
+
+    '''
+    from fparser.two.parser import Parser
+    parser = ParserFactory().create(std="f2008")
+    assert isinstance(parser, Parser)
+    assert parser.std == "f2008"
+    assert repr(parser) == "Parser(std='f2008')"
+    assert parser.match_cache is None
+    assert "Program_Unit" in parser.subclasses
+
+
+def test_parser_match_cache():
+    '''Test that the match_cache_size argument gives the parser a packrat
+    cache and that this produces the same parse tree as a parser
+    without one.
+
+    '''
+    fstring = (
+        "program test\n"
+        "  a = b(i) * c(i) + b(i) * c(i)\n"
+        "  a = b(i) * c(i) + b(i) * c(i)\n"
+        "end program test\n")
+    parser = ParserFactory().create()
+    expected = parser(FortranStringReader(fstring))
+    parser = ParserFactory().create(match_cache_size=1000)
+    cache = parser.match_cache
+    assert cache.maxsize == 1000
+    ast = parser(FortranStringReader(fstring))
+    assert repr(ast) == repr(expected)
+    assert cache.hits > 0
+    misses = cache.misses
+    # A second parse gives the same result but does not share nodes
+    # with the first.
+    ast2 = parser(FortranStringReader(fstring))
+    assert repr(ast2) == repr(expected)
+    assert cache.misses == 2 * misses
+
+
+def test_parser_share_leaves():
+    '''Test that the share_leaves argument makes identical leaves of a
+    parse tree share a node and that this produces the same parse tree
+    as a parser that does not share them.
+
+    '''
+    from fparser.two import Fortran2003
+    from fparser.two.utils import walk, PARSE_STATE, LeafTable
+    fstring = (
+        "program test\n"
+        "  a = b(i) * 2\n"
+        "  a = b(i) * 2\n"
+        "end program test\n")
+    expected = ParserFactory().create()(FortranStringReader(fstring))
+    parser = ParserFactory().create(share_leaves=True)
+    assert parser.share_leaves
+    ast = parser(FortranStringReader(fstring))
+    assert repr(ast) == repr(expected)
+    assert str(ast) == str(expected)
+    assert PARSE_STATE.leaves is None
+    first, second = walk([ast], Fortran2003.Assignment_Stmt)
+    # The statements are not shared but their leaves are.
+    assert first is not second
+    assert first.item.span == (2, 2)
+    assert second.item.span == (3, 3)
+    assert first.items[0] is second.items[0]
+    assert first.items[2].items[2] is second.items[2].items[2]
+    assert first == second
+    # Leaves are not shared between parse trees.
+    ast2 = parser(FortranStringReader(fstring))
+    assert next(walk([ast2], Fortran2003.Name)) is not \
+        next(walk([ast], Fortran2003.Name))
+    # A shared leaf is copied before it is changed.
+    table = LeafTable()
+    name = table.share(Fortran2003.Name("a"))
+    assert table.share(Fortran2003.Name("a")) is name
+    assert table.share(Fortran2003.Name("b")) is not name
+    assert len(table) == 2
+    copied = table.unshare(name)
+    assert copied is not name
+    assert copied == name
+    assert table.unshare(copied) is copied
+    # Nodes with children are not shared.
+    part = Fortran2003.Part_Ref("b(i)")
+    assert table.share(part) is part
+    assert len(table) == 2
+
+
+def test_parsers_coexist():
+    '''Test that parsers for different standards can be used after each
+    other has been created and that creating a parser does not modify
+    the subclass_names of the classes.
+
+    '''
+    from fparser.two import Fortran2003
+    names = Fortran2003.Execution_Part_Construct_C201.subclass_names[:]
+    fstring = (
+        "submodule (x) y\n"
+        "end\n")
+    parser_f2008 = ParserFactory().create(std="f2008")
+    parser_f2003 = ParserFactory().create(std="f2003")
+    assert Fortran2003.Execution_Part_Construct_C201.subclass_names == names
+    assert parser_f2003.subclasses is not parser_f2008.subclasses
+    assert isinstance(parser_f2003.subclasses["Program_Unit"], tuple)
+    ast = parser_f2008(FortranStringReader(fstring))
+    assert "SUBMODULE (x) y\nEND SUBMODULE y" in str(ast)
+    with pytest.raises(FortranSyntaxError) as excinfo:
+        _ = parser_f2003(FortranStringReader(fstring))
+    assert "at line 1\n>>>submodule (x) y\n" in str(excinfo.value)
+
+
+def test_create_keeps_base_subclasses():
+    '''Test that creating parsers for different standards does not
+    change the tables that the classes use outside of a parser, and that
+    a parser's tables are used within Parser.activate.
+
+    '''
+    from fparser.two import Fortran2008
+    from fparser.two.utils import Base, NoMatchError
+    ParserFactory().create(std="f2003")
+    subclasses = Base.subclasses
+    contents = dict(subclasses)
+    parser = ParserFactory().create(std="f2008")
+    assert Base.subclasses is subclasses
+    assert Base.subclasses == contents
+    fstring = (
+        "submodule (x) y\n"
+        "end\n")
+    with parser.activate():
+        ast = Fortran2008.Submodule(FortranStringReader(fstring))
+        assert "SUBMODULE (x) y\nEND SUBMODULE y" in str(ast)
+    with ParserFactory().create(std="f2003").activate():
+        with pytest.raises(NoMatchError):
+            Fortran2008.Submodule(FortranStringReader(fstring))
+    assert Base.subclasses is subclasses
+
+
+def test_parsers_threads():
+    '''Test that parsers for different standards can be used concurrently
+    from multiple threads.
+
+    '''
+    import threading
+    fstring = (
+        "module test\n"
+        "contains\n"
+        "  subroutine sub(a, b)\n"
+        "    real :: a(10), b(10)\n"
+        "    integer :: i\n"
+        "    do i = 1, 10\n"
+        "      if (a(i) > 0.0) then\n"
+        "        b(i) = a(i) * 2.0 + b(i)\n"
+        "      end if\n"
+        "    end do\n"
+        "  end subroutine sub\n"
+        "end module test\n")
+    parsers = [ParserFactory().create(std="f2003"),
+               ParserFactory().create(std="f2008", match_cache_size=100)]
+    expected = str(parsers[0](FortranStringReader(fstring)))
+    results = []
+
+    def parse(parser):
+        ''' Parse the code a number of times with the parser. '''
+        for _ in range(5):
+            results.append(str(parser(FortranStringReader(fstring))))
+
+    threads = [threading.Thread(target=parse, args=(parsers[index % 2],))
+               for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [expected] * 20
+
+
+def test_grammar_tables_kept(tmpdir, monkeypatch):
+    '''Test that the tables for a standard are only created once per
+    process and that they are kept on disk and re-used by later
+    processes.
+
+    '''
+    import os
+    from fparser.two import parser as parser_module
+    monkeypatch.setenv("FPARSER_CACHE_DIR", str(tmpdir))
+    monkeypatch.setattr(parser_module, "_GRAMMAR_TABLES", {})
+    parser = ParserFactory().create(std="f2008")
+    assert ParserFactory().create(std="f2008").subclasses is \
+        parser.subclasses
+    path = os.path.join(str(tmpdir), "grammar_f2008.json")
+    assert os.path.isfile(path)
+    assert not tmpdir.listdir(lambda path: path.ext == ".tmp")
+
+    # Pretend to be a new process, which should load the same tables.
+    monkeypatch.setattr(parser_module, "_GRAMMAR_TABLES", {})
+    monkeypatch.setattr(ParserFactory, "_setup", None)
+    loaded_parser = ParserFactory().create(std="f2008")
+    assert loaded_parser.subclasses is not parser.subclasses
+    assert loaded_parser.subclasses == parser.subclasses
+    assert dict(loaded_parser.dispatch_index.items()) == \
+        dict(parser.dispatch_index.items())
+    fstring = (
+        "submodule (x) y\n"
+        "end\n")
+    ast = loaded_parser(FortranStringReader(fstring))
+    assert "SUBMODULE (x) y\nEND SUBMODULE y" in str(ast)
+
+
+@pytest.mark.parametrize("content", ["", "{", "[]", '{"signature": 1}'])
+def test_grammar_tables_invalid(tmpdir, monkeypatch, content):
+    '''Test that invalid tables on disk are replaced.'''
+    import json
+    from fparser.two import parser as parser_module
+    monkeypatch.setenv("FPARSER_CACHE_DIR", str(tmpdir))
+    monkeypatch.setattr(parser_module, "_GRAMMAR_TABLES", {})
+    tmpdir.join("grammar_f2003.json").write(content)
+    parser = ParserFactory().create(std="f2003")
+    assert parser.subclasses["Program_Unit"]
+    table = json.loads(tmpdir.join("grammar_f2003.json").read())
+    assert table["signature"][:2] == [parser_module.GRAMMAR_TABLE_VERSION,
+                                      "f2003"]
+
+
+def test_grammar_tables_not_kept(tmpdir, monkeypatch):
+    '''Test that the tables are not kept on disk when FPARSER_CACHE_DIR is
+    not set, is set to an empty string or when they can not be written.
+
+    '''
+    from fparser.two import parser as parser_module
+    monkeypatch.delenv("FPARSER_CACHE_DIR", raising=False)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmpdir))
+    monkeypatch.setenv("HOME", str(tmpdir))
+    monkeypatch.setattr(parser_module, "_GRAMMAR_TABLES", {})
+    parser = ParserFactory().create(std="f2003")
+    assert parser.subclasses["Program_Unit"]
+    assert not tmpdir.listdir()
+    monkeypatch.setenv("FPARSER_CACHE_DIR", "")
+    monkeypatch.setattr(parser_module, "_GRAMMAR_TABLES", {})
+    parser = ParserFactory().create(std="f2003")
+    assert parser.subclasses["Program_Unit"]
+    # A file in place of the directory means the tables can't be written.
+    tmpdir.join("file").write("")
+    monkeypatch.setenv("FPARSER_CACHE_DIR", str(tmpdir.join("file")))
+    monkeypatch.setattr(parser_module, "_GRAMMAR_TABLES", {})
+    parser = ParserFactory().create(std="f2003")
+    assert parser.subclasses["Program_Unit"]
+    assert tmpdir.listdir() == [tmpdir.join("file")]
+
+
+def test_pickle_parse_tree(tmpdir):
+    '''Test that a parse tree created from a file can be pickled and
+    that the reader is not pickled with it.
+
+    '''
+    import pickle
+    from fparser.common.readfortran import FortranFileReader
+    fortran_file = tmpdir.join("prog.f90")
+    fortran_file.write(
+        "program test\n"
+        "  ! A comment\n"
+        "  integer :: a\n"
+        "10 a = 1\n"
+        "end program test\n")
+    parser = ParserFactory().create(std="f2003")
+    ast = parser(FortranFileReader(str(fortran_file), ignore_comments=False))
+    new_ast = pickle.loads(pickle.dumps(ast))
+    assert new_ast == ast
+    assert repr(new_ast) == repr(ast)
+    assert str(new_ast) == str(ast)
+    program = new_ast.content[0]
+    assert program.string is None
+    stmt = program.content[2].content[0]
+    assert stmt.item.label == 10
+    assert stmt.item.span == (4, 4)
+    assert stmt.item.reader is None
+    assert stmt.item.line == "a = 1"
+    assert stmt.item.parse_cache == {}
+    # The state of the nodes of a parse tree does not include the reader.
+    assert program.__getstate__()["string"] is None
+    assert ast.content[0].__getstate__()["item"] is None
+    assert stmt.__getstate__()["string"] == "a = 1"
+
+
+def test_parse_files(tmpdir):
+    '''Test that parse_files parses each of the files it is given in
+    a pool of processes and returns either the parse tree of each file
+    or the error raised when parsing it.
+
+    '''
+    from fparser.two.parser import parse_files
+    names = []
+    for index in range(4):
+        fortran_file = tmpdir.join("prog{0}.f90".format(index))
+        fortran_file.write(
+            "program prog{0}\n"
+            "! comment\n"
+            "end program prog{0}\n".format(index))
+        names.append(str(fortran_file))
+    invalid_file = tmpdir.join("invalid.f90")
+    invalid_file.write(
+        "program invalid\n"
+        "  a b\n"
+        "end program invalid\n")
+    names.append(str(invalid_file))
+    names.append(str(tmpdir.join("missing.f90")))
+    # Errors that are not raised by fparser itself only affect the
+    # file that they are raised for.
+    deep_file = tmpdir.join("deep.f90")
+    deep_file.write(
+        "program deep\n"
+        "  a = " + "(" * 400 + "1" + ")" * 400 + "\n"
+        "end program deep\n")
+    names.append(str(deep_file))
+    undecodable_file = tmpdir.join("undecodable.f90")
+    undecodable_file.write_binary(
+        b"program undecodable\n"
+        b"  a = '\xff\xfe'\n"
+        b"end program undecodable\n")
+    names.append(str(undecodable_file))
+    results = dict(parse_files(names, std="f2008", processes=2,
+                               ignore_comments=False))
+    assert sorted(results) == sorted(names)
+    for index in range(4):
+        result = results[names[index]]
+        assert str(result) == (
+            "PROGRAM prog{0}\n"
+            "  ! comment\n"
+            "END PROGRAM prog{0}".format(index))
+    error = results[str(invalid_file)]
+    assert isinstance(error, FortranSyntaxError)
+    assert "at line 2\n>>>  a b" in str(error)
+    assert isinstance(results[str(tmpdir.join("missing.f90"))], IOError)
+    assert isinstance(results[str(deep_file)], RuntimeError)
+
+
+def test_parse_files_invalid_std():
+    '''Test that parse_files raises an exception if the standard is
+    invalid when it is called, before any file is asked for.
+
+    '''
+    from fparser.two.parser import parse_files
+    with pytest.raises(ValueError) as excinfo:
+        parse_files([], std="invalid")
+    assert "'invalid' is an invalid standard" in str(excinfo.value)
+
+
+def test_tree_cache(tmpdir, monkeypatch):
+    '''Test that a parser with a TreeCache loads the tree of code that
+    it has already parsed rather than parsing it again, and that the
+    items of the loaded tree refer to the reader.
+
+    '''
+    from fparser.common.readfortran import FortranFileReader
+    from fparser.two.parser import TreeCache
+    from fparser.two.Fortran2003 import Assignment_Stmt
+    from fparser.two.utils import walk
+    fortran_file = tmpdir.join("prog.f90")
+    fortran_file.write(
+        "program test\n"
+        "  ! A comment\n"
+        "  integer :: a\n"
+        "10 a = 1\n"
+        "end program test\n")
+    cache = TreeCache(str(tmpdir.join("trees")))
+    parser = ParserFactory().create(std="f2003", tree_cache=cache)
+    assert parser.tree_cache is cache
+    reader = FortranFileReader(str(fortran_file), ignore_comments=False)
+    ast = parser(reader)
+    assert len(tmpdir.join("trees").listdir()) == 1
+    reader = FortranFileReader(str(fortran_file), ignore_comments=False)
+
+    def no_parse(reader):
+        raise AssertionError("the code was parsed")
+    monkeypatch.setattr(parser, "_parse", no_parse)
+    new_ast = parser(reader)
+    monkeypatch.undo()
+    assert new_ast is not ast
+    assert new_ast == ast
+    assert repr(new_ast) == repr(ast)
+    # Messages about the items of the loaded tree can be given.
+    item = list(walk([new_ast], Assignment_Stmt))[0].item
+    assert item.reader is reader
+    message = item.reader.format_message("ERROR", "bad", *item.span)
+    assert "    4:10 a = 1 <== bad" in message
+    item.reader.warning("bad", item)
+    # Different options for the reader and different standards give
+    # different trees.
+    reader = FortranFileReader(str(fortran_file))
+    assert "! A comment" not in str(parser(reader))
+    parser = ParserFactory().create(std="f2008", tree_cache=cache)
+    reader = FortranStringReader(fortran_file.read(), ignore_comments=False)
+    assert parser(reader) == ast
+    assert len(tmpdir.join("trees").listdir()) == 3
+    # Changing the code changes the tree.
+    fortran_file.write(
+        "program test\n"
+        "  a = 2\n"
+        "end program test\n")
+    reader = FortranFileReader(str(fortran_file))
+    assert "a = 2" in str(parser(reader))
+
+
+def test_tree_cache_not_used(tmpdir, monkeypatch):
+    '''Test that a TreeCache does not keep trees that depend on more than
+    the code read by the reader, that have failed to parse or when
+    there is no directory for the cache.
+
+    '''
+    from fparser.two.parser import TreeCache
+    cache = TreeCache(str(tmpdir))
+    parser = ParserFactory().create(tree_cache=cache)
+    code = ("program test\n"
+            "  include 'my_include.h'\n"
+            "end program test\n")
+    assert cache.key("f2003", FortranStringReader(code)) is None
+    assert "INCLUDE 'my_include.h'" in str(parser(FortranStringReader(code)))
+    reader = FortranStringReader("program test\nend program test\n")
+    reader.put_item(reader.get_item())
+    assert cache.key("f2003", reader) is None
+    # Items given to a reader before it is read from are also seen.
+    item = reader.get_item()
+    reader = FortranStringReader("program test\nend program test\n")
+    reader.put_item(item)
+    assert cache.key("f2003", reader) is None
+    with pytest.raises(FortranSyntaxError):
+        parser(FortranStringReader("program test\n  a b\nend\n"))
+    assert not tmpdir.listdir()
+    monkeypatch.setenv("FPARSER_CACHE_DIR", "")
+    cache = TreeCache()
+    assert cache.directory is None
+    assert cache.key("f2003", FortranStringReader("end\n")) is None
+
+
+def test_tree_cache_corrupt(tmpdir):
+    '''Test that a TreeCache replaces files that it can not load.'''
+    from fparser.two.parser import TreeCache
+    cache = TreeCache(str(tmpdir))
+    parser = ParserFactory().create(tree_cache=cache)
+    code = "program test\nend program test\n"
+    key = cache.key("f2003", FortranStringReader(code))
+    tmpdir.join(key + ".pickle").write("not a pickle")
+    assert cache.load(key) is None
+    assert not tmpdir.listdir()
+    assert str(parser(FortranStringReader(code))) == \
+        "PROGRAM test\nEND PROGRAM test"
+    assert cache.load(key) == parser(FortranStringReader(code))
+
+
+def test_tree_cache_size(tmpdir):
+    '''Test that a TreeCache removes the least recently used trees when
+    it becomes too large.
+
+    '''
+    import os
+    from fparser.two.parser import TreeCache
+    cache = TreeCache(str(tmpdir))
+    parser = ParserFactory().create(tree_cache=cache)
+    keys = []
+    for index in range(4):
+        code = "program test{0}\nend program test{0}\n".format(index)
+        parser(FortranStringReader(code))
+        keys.append(cache.key("f2003", FortranStringReader(code)))
+        path = str(tmpdir.join(keys[-1] + ".pickle"))
+        os.utime(path, (index, index))
+    size = os.path.getsize(path)
+    # Using the first tree makes it the most recently used.
+    assert cache.load(keys[0])
+    cache = TreeCache(str(tmpdir), max_size=4*size)
+    parser = ParserFactory().create(tree_cache=cache)
+    parser(FortranStringReader("program test4\nend program test4\n"))
+    # The cache is reduced to three quarters of its maximum size.
+    names = sorted(path.basename for path in tmpdir.listdir())
+    assert names == sorted(key + ".pickle" for key in keys[0:1] + keys[3:] +
+                           [cache.key("f2003", FortranStringReader(
+                               "program test4\nend program test4\n"))])
+
+
+REPARSE_CODE = (
+    "! Leading comment\n"
+    "subroutine first(a)\n"
+    "  real :: a\n"
+    "  a = 1.0\n"
+    "end subroutine first\n"
+    "\n"
+    "module my_mod\n"
+    "contains\n"
+    "  subroutine second()\n"
+    "  end subroutine second\n"
+    "end module my_mod\n"
+    "! Trailing comment\n"
+    "program my_prog\n"
+    "  call first(1.0)\n"
+    "end program my_prog\n")
+
+
+def _spans(tree):
+    '''
+    :param tree: a parse tree.
+    :type tree: :py:class:`fparser.two.Fortran2003.Program`
+
+    :returns: the class of and lines of code matched by each node \
+              of the tree that was matched with a line of code.
+    :rtype: list of (str, (int, int))
+
+    '''
+    from fparser.two.utils import walk_ast
+    return [(type(node).__name__, node.item.span)
+            for node in walk_ast([tree])
+            if getattr(node, "item", None) is not None]
+
+
+@pytest.mark.parametrize("ignore_comments", [True, False])
+@pytest.mark.parametrize("old_code, new_code, kept", [
+    # A change inside a program unit
+    ("  a = 1.0\n", "  a = 2.0\n", [1, 2]),
+    # Lines added to a program unit
+    ("  a = 1.0\n", "  a = 1.0\n  a = 2.0\n\n  a = 3.0\n", [1, 2]),
+    # Lines removed from a program unit
+    ("contains\n  subroutine second()\n  end subroutine second\n", "",
+     [0, 2]),
+    # A new program unit between two others
+    ("\nmodule my_mod\n", "\nsubroutine new()\nend\nmodule my_mod\n",
+     [0, 2]),
+    # A new program unit at the end
+    ("end program my_prog\n", "end program my_prog\nsubroutine new\nend\n",
+     [0, 1]),
+    # A program unit removed
+    ("module my_mod\ncontains\n  subroutine second()\n  end subroutine "
+     "second\nend module my_mod\n", "", [0, 2]),
+    # No change
+    ("", "", [0, 1, 2])])
+def test_reparse(old_code, new_code, kept, ignore_comments):
+    '''Test that the reparse method of a parser returns the same tree as
+    parsing the new code but keeps the program units that have not
+    changed (given by their indices in `kept`), with their lines
+    updated.
+
+    '''
+    from fparser.two.Fortran2003 import Comment
+    parser = ParserFactory().create(std="f2008")
+    new_source = REPARSE_CODE.replace(old_code, new_code, 1)
+    tree = parser(FortranStringReader(REPARSE_CODE,
+                                      ignore_comments=ignore_comments))
+    units = [node for node in tree.content if not isinstance(node, Comment)]
+    new_tree = parser.reparse(tree, REPARSE_CODE, new_source,
+                              ignore_comments=ignore_comments)
+    assert new_tree is tree
+    expected = parser(FortranStringReader(new_source,
+                                          ignore_comments=ignore_comments))
+    assert repr(new_tree) == repr(expected)
+    assert _spans(new_tree) == _spans(expected)
+    kept_units = [unit for unit in units
+                  if any(unit is node for node in new_tree.content)]
+    assert kept_units == [units[index] for index in kept]
+
+
+def test_reparse_whole():
+    '''Test that the reparse method of a parser parses all of the new code
+    when the changes can not be confined to some of the program units.
+
+    '''
+    parser = ParserFactory().create(std="f2008")
+    tree = parser(FortranStringReader(REPARSE_CODE))
+    # Code with no program statement can only be recognised by parsing
+    # all of the code.
+    new_source = REPARSE_CODE.replace("program my_prog\n", "")
+    new_tree = parser.reparse(tree, REPARSE_CODE, new_source)
+    assert new_tree is not tree
+    assert repr(new_tree) == repr(parser(FortranStringReader(new_source)))
+    # Errors refer to the correct line.
+    new_source = REPARSE_CODE.replace("  call first(1.0)", "  a b")
+    with pytest.raises(FortranSyntaxError) as excinfo:
+        parser.reparse(tree, REPARSE_CODE, new_source)
+    assert "at line 14\n>>>  a b" in str(excinfo.value)
+    # Removing all of the code gives the tree of empty code.
+    assert repr(parser.reparse(tree, REPARSE_CODE, "")) == "Program(None)"
+    assert str(parser.reparse(None, "", REPARSE_CODE)) == str(tree)
+
+
+def test_unit_ends():
+    '''Test that _unit_ends finds the last line of each program unit
+    without being confused by contained subprograms, interface blocks,
+    strings or continuation lines.
+
+    '''
+    from fparser.common.sourceinfo import FortranFormat
+    from fparser.two.parser import _unit_ends
+    code = (
+        "! Comment\n"
+        "module my_mod\n"
+        "  interface my_interface\n"
+        "    module procedure my_sub\n"
+        "    subroutine external_sub()\n"
+        "    end subroutine\n"
+        "  end interface\n"
+        "contains\n"
+        "  recursive subroutine my_sub()\n"
+        "    print *, 'end subroutine'\n"
+        "  end subroutine my_sub\n"
+        "end module\n"
+        "character(len=*) function &\n"
+        "    my_func(a); character(len=*) a\n"
+        "  my_func = a\n"
+        "  end function &\n"
+        "    my_func\n"
+        "\n"
+        "program my_prog\n"
+        "  integer :: subroutine_count\n"
+        "end\n")
+    free = FortranFormat(True, False)
+    assert _unit_ends(code, free) == [12, 17, 21]
+    fixed_code = (
+        "      subroutine one\n"
+        "c     end\n"
+        "      end\n"
+        "      real*8 function\n"
+        "     & two()\n"
+        "      two = 1\n"
+        "      end\n")
+    assert _unit_ends(fixed_code, FortranFormat(False, False)) == [3, 7]
+    # Statements outside of a program unit or an unbalanced program
+    # unit mean that the program units can not be found.
+    assert _unit_ends("a = 1\nend\n", free) is None
+    assert _unit_ends("subroutine a\n", free) is None
+    assert _unit_ends("end\nend\n", free) is None
+
+
+@pytest.mark.parametrize("ignore_comments", [True, False])
+def test_parse_in_parallel(ignore_comments):
+    '''Test that parse_in_parallel returns the same tree as parsing all of
+    the code with a single parser.
+
+    '''
+    from fparser.two.parser import parse_in_parallel
+    parser = ParserFactory().create(std="f2008")
+    code = REPARSE_CODE * 3
+    expected = parser(FortranStringReader(code,
+                                          ignore_comments=ignore_comments))
+    reader = FortranStringReader(code, ignore_comments=ignore_comments)
+    tree = parse_in_parallel(reader, std="f2008", processes=2)
+    assert tree.string is reader
+    assert repr(tree) == repr(expected)
+    assert _spans(tree) == _spans(expected)
+
+
+def test_parse_in_parallel_serial():
+    '''Test that parse_in_parallel parses all of the code with a single
+    parser when it can not be split into program units or contains an
+    error.
+
+    '''
+    from fparser.two.parser import parse_in_parallel
+    parser = ParserFactory().create(std="f2008")
+    # A main program without a program statement.
+    code = REPARSE_CODE.replace("program my_prog\n", "")
+    tree = parse_in_parallel(FortranStringReader(code), processes=2)
+    assert repr(tree) == repr(parser(FortranStringReader(code)))
+    code = "subroutine a\nend\n" + REPARSE_CODE.replace(
+        "  call first(1.0)", "  a b")
+    with pytest.raises(FortranSyntaxError) as excinfo:
+        parse_in_parallel(FortranStringReader(code), processes=2)
+    assert "at line 16\n>>>  a b" in str(excinfo.value)
+    # A single process.
+    tree = parse_in_parallel(FortranStringReader(REPARSE_CODE), processes=1)
+    assert repr(tree) == repr(parser(FortranStringReader(REPARSE_CODE)))
+    # A reader that has been given items before it is read from.
+    readers = []
+    for _ in range(2):
+        reader = FortranStringReader(REPARSE_CODE)
+        items = list(FortranStringReader("subroutine given\nend\n"))
+        for item in reversed(items):
+            reader.put_item(item)
+        readers.append(reader)
+    tree = parse_in_parallel(readers[0], processes=2)
+    assert repr(tree) == repr(parser(readers[1]))
+    assert "SUBROUTINE given" in str(tree)
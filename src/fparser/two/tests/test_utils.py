@@ -68,6 +68,8 @@ def test_blockbase_match_names(f2003_create):
         ast = Derived_Type_Def(reader)
     assert "at line 2\n>>>end type cde\nExpecting name 'abc'" \
         in str(excinfo.value)
+    # The reader is not left marked by the failed match.
+    assert reader.item_marks == 0
 
     # first name required if second name supplied
     # switch to using select case as it can trip the exception
@@ -76,6 +78,7 @@ def test_blockbase_match_names(f2003_create):
         ast = Case_Construct(reader)
     assert ("at line 2\n>>>end select label\nName 'label' has no "
             "corresponding starting name") in str(excinfo.value)
+    assert reader.item_marks == 0
 
 
 def test_blockbase_match_name_classes(f2003_create):
@@ -135,3 +138,345 @@ def test_get_child(f2003_create):
     assert not hasattr(io_nodes[0], "content")
     io_unit = get_child(io_nodes[0], Fortran2003.Io_Unit)
     assert isinstance(io_unit, Fortran2003.Io_Unit)
+
+
+def test_walk(f2003_create):
+    ''' Test the walk() utility and the TypeIndex class. '''
+    from fparser.two import Fortran2003
+    from fparser.two.utils import walk, walk_ast, TypeIndex, StmtBase
+    reader = get_reader("program hello\n"
+                        "write(*,*) 'hello'\n"
+                        "call a(b(1))\n"
+                        "write(*,*) 'goodbye'\n"
+                        "end program hello\n")
+    main = Fortran2003.Program(reader)
+    nodes = walk_ast(main.content)
+    assert list(walk(main.content)) == nodes
+    writes = list(walk(main.content, Fortran2003.Write_Stmt))
+    assert len(writes) == 2
+    assert "goodbye" in str(writes[1])
+    # Subclasses are included.
+    stmts = list(walk(main.content, StmtBase))
+    assert [type(stmt) for stmt in stmts] == [
+        Fortran2003.Program_Stmt, Fortran2003.Write_Stmt,
+        Fortran2003.Call_Stmt, Fortran2003.Write_Stmt,
+        Fortran2003.End_Program_Stmt]
+    # The nodes below a pruned node are not walked.
+    pruned = list(walk(main.content, prune=lambda node: isinstance(
+        node, Fortran2003.Call_Stmt)))
+    assert stmts[2] in pruned
+    assert not [node for node in pruned if isinstance(
+        node, Fortran2003.Part_Ref)]
+    assert len(pruned) < len(nodes)
+
+    index = TypeIndex(main.content)
+    assert len(index) == len(nodes)
+    assert index.find(Fortran2003.Write_Stmt) == writes
+    assert index.find(StmtBase) == stmts
+    assert index.find((Fortran2003.Call_Stmt, Fortran2003.Program_Stmt)) \
+        == [stmts[0], stmts[2]]
+    assert index.find(Fortran2003.Io_Unit) == walk_ast(
+        main.content, [Fortran2003.Io_Unit])
+    assert index.find(Fortran2003.If_Stmt) == []
+
+
+def test_walk_deep_tree():
+    ''' Test that walk() and walk_ast() are not limited by the recursion
+    limit. '''
+    import sys
+    from fparser.two.utils import walk, walk_ast
+
+    class Node(object):
+        ''' A node with a single child. '''
+        def __init__(self, child):
+            self.items = (child, )
+    tree = "leaf"
+    for _ in range(2 * sys.getrecursionlimit()):
+        tree = Node(tree)
+    assert list(walk([tree], str)) == ["leaf"]
+    assert len(walk_ast([tree])) == 2 * sys.getrecursionlimit() + 1
+
+
+# test get_cache_dir
+
+
+def test_get_cache_dir(monkeypatch):
+    '''Test that get_cache_dir uses the FPARSER_CACHE_DIR environment
+    variable if it is set and the user's cache directory otherwise.
+
+    '''
+    import os
+    from fparser.two.utils import get_cache_dir
+    monkeypatch.setenv("FPARSER_CACHE_DIR", "/tmp/my_cache")
+    assert get_cache_dir() == "/tmp/my_cache"
+    monkeypatch.setenv("FPARSER_CACHE_DIR", "")
+    assert get_cache_dir() is None
+    monkeypatch.delenv("FPARSER_CACHE_DIR")
+    monkeypatch.setenv("XDG_CACHE_HOME", "/tmp/cache_home")
+    assert get_cache_dir() == os.path.join("/tmp/cache_home", "fparser")
+    monkeypatch.delenv("XDG_CACHE_HOME")
+    assert get_cache_dir() == os.path.join(
+        os.path.expanduser("~"), ".cache", "fparser")
+
+
+# test generate_classes
+
+
+def test_generate_classes():
+    '''Test that generate_classes creates the '*_List', '*_Name' and
+    'Scalar_*' classes named by the classes in a namespace, including
+    those named by the generated classes themselves.
+
+    '''
+    from fparser.two.utils import generate_classes, Base, SequenceBase
+
+    class Test_Stmt(Base):
+        ''' A class naming classes to generate. '''
+        subclass_names = ['Scalar_Test', 'Test_Name_List']
+        use_names = ['Test_Stmt', 'Other']
+
+    namespace = {'__name__': 'my_module', 'Test_Stmt': Test_Stmt}
+    generate_classes(namespace)
+    assert sorted(namespace) == ['Scalar_Test', 'Test_Name',
+                                 'Test_Name_List', 'Test_Stmt',
+                                 '__name__']
+    list_cls = namespace['Test_Name_List']
+    assert issubclass(list_cls, SequenceBase)
+    assert list_cls.__module__ == 'my_module'
+    assert list_cls.subclass_names == ['Test_Name']
+    assert 'match' in list_cls.__dict__
+    assert namespace['Test_Name'].subclass_names == ['Name']
+    assert namespace['Scalar_Test'].subclass_names == ['Test']
+
+
+def test_pickle_exceptions():
+    '''Test that fparser's exceptions can be pickled, despite their
+    constructors not taking the message that they store.
+
+    '''
+    import pickle
+    from fparser.two.utils import InternalError
+    for error in [FortranSyntaxError("", "error"),
+                  InternalError("problem")]:
+        new_error = pickle.loads(pickle.dumps(error))
+        assert type(new_error) is type(error)
+        assert str(new_error) == str(error)
+
+
+def test_no_match_error_message(f2003_create):
+    '''Test that the message of a NoMatchError raised by Base.__new__
+    gives the class and string that did not match or, for a reader,
+    the line that did not match, and that it survives pickling.
+
+    '''
+    import pickle
+    from fparser.two import Fortran2003
+    from fparser.two.utils import NoMatchError
+    with pytest.raises(NoMatchError) as excinfo:
+        Fortran2003.Name("1a")
+    assert str(excinfo.value) == "Name: '1a'"
+    assert excinfo.value.args == ("Name: '1a'",)
+    assert isinstance(excinfo.value.args[0], str)
+    assert "Name: '1a'" in repr(excinfo.value)
+    # The message is only put together when it is asked for.
+    try:
+        Fortran2003.Name("2a")
+    except NoMatchError as error:
+        assert BaseException.args.__get__(error) == (None,)
+        assert error.args == ("Name: '2a'",)
+
+    # No error is raised while only blank lines have been read.
+    reader = get_reader("\n\n  \n")
+    assert Fortran2003.Executable_Construct(reader) is None
+    assert reader.first_content_line is None
+    reader = get_reader("\n\n  x =\n")
+    with pytest.raises(NoMatchError) as excinfo:
+        Fortran2003.Executable_Construct(reader)
+    assert reader.first_content_line == 3
+    assert str(excinfo.value) == "at line 3\n>>>  x =\n"
+    new_error = pickle.loads(pickle.dumps(excinfo.value))
+    assert type(new_error) is NoMatchError
+    assert new_error.args == ("at line 3\n>>>  x =\n",)
+
+
+def test_span_index(f2003_create):
+    ''' Test that the SpanIndex class gives each node a parent and span
+    and finds the nodes created from, or containing, a line. '''
+    from fparser.two import Fortran2003
+    from fparser.two.utils import SpanIndex, walk, Base
+    reader = get_reader("module m\n"
+                        "contains\n"
+                        "  subroutine s(a)\n"
+                        "    integer :: a\n"
+                        "    a = a + &\n"
+                        "        1\n"
+                        "    if (a > 1) then\n"
+                        "      a = 2; a = 3\n"
+                        "    end if\n"
+                        "  end subroutine s\n"
+                        "end module m\n")
+    tree = Fortran2003.Program(reader)
+    index = SpanIndex(tree)
+    assert tree.parent is None
+    assert tree.span == (1, 11)
+    for node in walk([tree], Base):
+        if node is not tree:
+            siblings = getattr(node.parent, "content", None)
+            if siblings is None:
+                siblings = node.parent.items
+            assert [child for child in siblings if child is node]
+    sub = tree.content[0].content[1].content[1]
+    assert isinstance(sub, Fortran2003.Subroutine_Subprogram)
+    assert sub.span == (3, 10)
+    assign = index.node_at(6)
+    assert isinstance(assign, Fortran2003.Assignment_Stmt)
+    assert assign.span == (5, 6)
+    # The parts of a statement have the span of the statement.
+    assert [node.span for node in walk([assign], Base)] == [(5, 6)] * 5
+    assert str(index.node_at(8)) == "a = 2"
+    assert index.node_at(0) is None
+    assert index.node_at(12) is None
+    assert index.enclosing(8, Fortran2003.Subroutine_Subprogram) is sub
+    assert isinstance(index.enclosing(8, Fortran2003.If_Construct),
+                      Fortran2003.If_Construct)
+    assert index.enclosing(1, Fortran2003.Subroutine_Subprogram) is None
+    assert index.enclosing(11) is tree.content[0].content[-1]
+    assert index.enclosing(12) is None
+    assert len(index) == 11
+
+
+def test_span_index_column(f2003_create):
+    ''' Test that a column tells apart the statements on a line. '''
+    from fparser.two import Fortran2003
+    from fparser.two.utils import SpanIndex, _statement_columns
+    assert _statement_columns("  a = 1; b = 'x;y' ! c;d") == ([2, 9], 19)
+    assert _statement_columns("a = 1;;") == ([0], None)
+    reader = get_reader("subroutine s(a, b)\n"
+                        "  a = 1; b = 'x;y' ! c;d\n"
+                        "  if (a > 1) b = 'z'\n"
+                        "end subroutine s\n", ignore_comments=False)
+    tree = Fortran2003.Program(reader)
+    index = SpanIndex(tree)
+    assert str(index.node_at(2)) == "a = 1"
+    assert str(index.node_at(2, 0)) == "a = 1"
+    assert str(index.node_at(2, 7)) == "a = 1"
+    assert str(index.node_at(2, 9)) == "b = 'x;y'"
+    assert str(index.node_at(2, 15)) == "b = 'x;y'"
+    assert str(index.node_at(2, 20)) == "! c;d"
+    assert str(index.enclosing(2, column=4)) == "a = 1"
+    assert str(index.enclosing(2, Fortran2003.Assignment_Stmt,
+                               column=12)) == "b = 'x;y'"
+    # The action of a one-line IF statement does not have a column.
+    node = index.node_at(3, 13)
+    assert isinstance(node, Fortran2003.If_Stmt)
+    assert index.enclosing(3, Fortran2003.If_Stmt, column=13) is node
+    # Without its reader the first statement is found.
+    index.node_at(2).item.reader = None
+    assert str(index.node_at(2, 9)) == "a = 1"
+
+
+def test_node_slots(f2003_create):
+    ''' Test that nodes have no __dict__, that names are interned and
+    that nodes can be pickled, without their parents. Nodes of classes
+    defined outside fparser.two keep their __dict__. '''
+    import pickle
+    from six.moves import intern
+    from fparser.two import Fortran2003
+    from fparser.two.utils import Base, SpanIndex, walk
+    reader = get_reader("subroutine s(a)\n"
+                        "  a = a + 1\n"
+                        "end subroutine s\n")
+    tree = Fortran2003.Program(reader)
+    SpanIndex(tree)
+    for node in walk([tree], Base):
+        assert not hasattr(node, "__dict__")
+    with pytest.raises(AttributeError):
+        tree.extra = 1
+    names = list(walk([tree], Fortran2003.Name))
+    assert [name.string for name in names] == ["s", "a", "a", "a", "s"]
+    assert names[1].string is intern("a")
+
+    new_tree = pickle.loads(pickle.dumps(tree))
+    assert str(new_tree) == str(tree)
+    assignment = list(walk([new_tree], Fortran2003.Assignment_Stmt))[0]
+    assert assignment.span == (2, 2)
+    assert not hasattr(assignment, "parent")
+    end_stmt = new_tree.content[0].content[-1]
+    assert (end_stmt.type, str(end_stmt.name)) == ("SUBROUTINE", "s")
+
+    class My_Name(Fortran2003.Name):
+        ''' A subclass defined outside fparser.two. '''
+        match = staticmethod(Fortran2003.Name.match)
+    node = My_Name("b")
+    node.extra = 1
+    assert node.__dict__ == {"extra": 1}
+
+
+def test_node_hash(f2003_create, monkeypatch):
+    ''' Test that equal nodes have the same hash, that hashes are kept
+    until a node is changed and that nodes with different hashes are
+    not compared any further. '''
+    import pickle
+    from fparser.two import Fortran2003
+    from fparser.two.utils import ComparableMixin, SpanIndex
+    first = Fortran2003.Assignment_Stmt("x = b(i) + 1")
+    second = Fortran2003.Assignment_Stmt("x = b(i) + 1")
+    other = Fortran2003.Assignment_Stmt("x = b(j) + 1")
+    assert first == second
+    assert hash(first) == hash(second)
+    assert len(set([first, second, other])) == 2
+    assert first != other
+
+    # Once their hashes are known unequal nodes are not compared.
+    def no_compare(self, other, method):
+        raise AssertionError("nodes were compared")
+    monkeypatch.setattr(ComparableMixin, "_compare", no_compare)
+    assert not first == other
+    assert first != other
+    assert first == first
+    monkeypatch.undo()
+
+    # Changing a node below a hashed one changes its hash once the
+    # hashes are invalidated.
+    name = first.items[2].items[0].items[1]
+    assert str(name) == "i"
+    name.string = "j"
+    assert hash(first) != hash(other)
+    first.invalidate_hash()
+    assert getattr(name, "_hash", None) is None
+    assert first == other
+    assert hash(first) == hash(other)
+    assert not pickle.loads(pickle.dumps(first)).__getstate__().get("_hash")
+
+    # A block is hashed by its content.
+    reader = get_reader("subroutine s(a)\n"
+                        "  a = a + 1\n"
+                        "end subroutine s\n")
+    tree = Fortran2003.Program(reader)
+    reader = get_reader("subroutine s(a)\n"
+                        "  a = a + 1\n"
+                        "end subroutine s\n")
+    new_tree = Fortran2003.Program(reader)
+    assert hash(tree) == hash(new_tree)
+    assert tree == new_tree
+    assert getattr(tree, "_hash", None) is None
+
+    # Nor is that of a node with a list further down.
+    first = Fortran2003.Nonlabel_Do_Stmt("do i = 1, 10")
+    second = Fortran2003.Nonlabel_Do_Stmt("do i = 1, 5")
+    assert hash(first) != hash(second)
+    assert getattr(second, "_hash", None) is None
+    second.items[1].items[1][1][1] = Fortran2003.Int_Literal_Constant("10")
+    assert first == second
+    assert second in set([first])
+
+    # With parent attributes, the nodes above a changed one are found.
+    first = Fortran2003.Assignment_Stmt("x = b(i) + 1")
+    SpanIndex(first)
+    assert hash(first) != hash(other)
+    name = first.items[2].items[0].items[1]
+    name.string = "j"
+    name.invalidate_hash()
+    assert getattr(first, "_hash", None) is None
+    assert first == other
+    assert hash(first) == hash(other)
@@ -0,0 +1,138 @@
+# Copyright (c) 2026 Science and Technology Facilities Council
+
+# All rights reserved.
+
+# Modifications made as part of the fparser project are distributed
+# under the following license:
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+''' File containing unit tests for the DispatchIndex class in utils.py '''
+
+import pytest
+from fparser.api import get_reader
+from fparser.two.utils import DispatchIndex, PARSE_STATE
+
+
+@pytest.mark.parametrize("line, key", [
+    ("call x(a)", "CA"),
+    ("  d o 10 i = 1, n", "DO"),
+    ("outer: do i = 1, n", "DO"),
+    ("outer : if (a) then", "IF"),
+    ("real :: x", "RE"),
+    ("a(1:2) = b", "A("),
+    ("x=1", "X="),
+    ("x", None),
+    ("", None)])
+def test_line_key(line, key):
+    '''Test that the key of a statement is the first two non-blank
+    characters after any construct name, in upper case.
+
+    '''
+    assert DispatchIndex.line_key(line) == key
+
+
+def test_excludes():
+    '''Test that a class is only excluded if it is in the index and the
+    key is not one of its keys.
+
+    '''
+    from fparser.two.Fortran2003 import Call_Stmt, Assignment_Stmt
+    index = DispatchIndex({Call_Stmt: frozenset(["CA"])})
+    assert Call_Stmt in index
+    assert Assignment_Stmt not in index
+    assert index.keys_of(Call_Stmt) == frozenset(["CA"])
+    assert index.keys_of(Assignment_Stmt) is None
+    assert not index.excludes(Call_Stmt, "CA")
+    assert index.excludes(Call_Stmt, "IF")
+    assert not index.excludes(Call_Stmt, None)
+    assert not index.excludes(Assignment_Stmt, "IF")
+
+
+def test_next_key():
+    '''Test that the key of the next statement is found without changing
+    the reader and that comments do not have a key.
+
+    '''
+    reader = get_reader("! comment\n  call x()\n", ignore_comments=False)
+    index = DispatchIndex({})
+    assert index.next_key(reader) is None
+    assert reader.get_item().comment == "! comment"
+    assert index.next_key(reader) == "CA"
+    assert reader.get_item().line == "call x()"
+    assert index.next_key(reader) is None
+
+
+def test_create_dispatch_index(f2003_create):
+    '''Test the dispatch index created for a parser by ParserFactory,
+    including the keys derived for end statements and for classes that
+    offer a choice of other classes.
+
+    '''
+    from fparser.two.parser import ParserFactory
+    from fparser.two import Fortran2003
+    parser = ParserFactory().create(std="f2003")
+    index = parser.dispatch_index
+    assert index.keys_of(Fortran2003.Call_Stmt) == frozenset(["CA"])
+    assert index.keys_of(Fortran2003.End_Do_Stmt) == frozenset(["EN"])
+    assert index.keys_of(Fortran2003.Access_Stmt) == frozenset(["PU", "PR"])
+    assert index.keys_of(Fortran2003.Comment) == frozenset()
+    assert index.keys_of(Fortran2003.Specification_Stmt) == frozenset(
+        ["PU", "PR", "AL", "AS", "BI", "CO", "DA", "DI", "EQ", "EX", "IN",
+         "NA", "OP", "PO", "SA", "TA", "VO", "VA"])
+    # Assignments may start with any name
+    assert Fortran2003.Assignment_Stmt not in index
+    assert Fortran2003.Action_Stmt not in index
+
+
+def test_dispatch_index_in_base(f2003_create, monkeypatch):
+    '''Test that Base.__new__ does not try classes that the dispatch index
+    excludes.
+
+    '''
+    from fparser.two import Fortran2003
+    tried = []
+    original_match = Fortran2003.Allocate_Stmt.match
+
+    def match(string):
+        ''' Record attempts to match an allocate statement. '''
+        tried.append(string)
+        return original_match(string)
+    monkeypatch.setattr(Fortran2003.Allocate_Stmt, "match",
+                        staticmethod(match))
+    index = DispatchIndex(
+        {Fortran2003.Allocate_Stmt: frozenset(["AL"])})
+    monkeypatch.setattr(PARSE_STATE, "dispatch_index", index)
+    reader = get_reader("call x(a)\nallocate(b(10))\n")
+    obj = Fortran2003.Action_Stmt(reader)
+    assert isinstance(obj, Fortran2003.Call_Stmt)
+    assert not tried
+    obj = Fortran2003.Action_Stmt(reader)
+    assert isinstance(obj, Fortran2003.Allocate_Stmt)
+    assert tried == ["allocate(b(10))"]
@@ -0,0 +1,121 @@
+# Copyright (c) 2026 Science and Technology Facilities Council
+
+# All rights reserved.
+
+# Modifications made as part of the fparser project are distributed
+# under the following license:
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+''' File containing unit tests for the MatchCache class in utils.py '''
+
+import pytest
+from fparser.two.utils import MatchCache, NoMatchError, PARSE_STATE
+
+
+def test_match_cache_size():
+    '''Test that a MatchCache must have a positive size.'''
+    with pytest.raises(ValueError) as excinfo:
+        _ = MatchCache(0)
+    assert ("The size of a MatchCache must be a positive integer but got "
+            "'0'." in str(excinfo.value))
+
+
+def test_match_cache_hits(f2003_create):
+    '''Test that repeated matches of the same string with the same class
+    are returned from the cache and that the hit and miss counts are
+    updated.
+
+    '''
+    from fparser.two.Fortran2003 import Expr, Level_2_Expr
+    cache = MatchCache(100)
+    result = cache.match(Expr, "a + b")
+    assert isinstance(result, Level_2_Expr)
+    assert str(result) == "a + b"
+    misses = cache.misses
+    assert misses >= 1
+    assert cache.match(Expr, "a + b") is result
+    assert cache.hits == 1
+    assert cache.misses == misses
+    # A different class is a different entry
+    _ = cache.match(Level_2_Expr, "a + b")
+    assert cache.misses == misses + 1
+    cache.clear()
+    assert not cache
+    assert cache.hits == 1
+
+
+def test_match_cache_no_match(f2003_create):
+    '''Test that failures to match are cached too.'''
+    from fparser.two.Fortran2003 import Name
+    cache = MatchCache(10)
+    for _ in range(2):
+        with pytest.raises(NoMatchError) as excinfo:
+            cache.match(Name, "a b")
+        assert "Name: 'a b'" in str(excinfo.value)
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+
+def test_match_cache_eviction(f2003_create):
+    '''Test that the least recently used entry is discarded when the cache
+    is full.
+
+    '''
+    from fparser.two.Fortran2003 import Name
+    cache = MatchCache(2)
+    name_a = cache.match(Name, "a")
+    _ = cache.match(Name, "b")
+    # Use 'a' so that 'b' becomes the least recently used entry
+    assert cache.match(Name, "a") is name_a
+    _ = cache.match(Name, "c")
+    assert len(cache) == 2
+    assert cache.match(Name, "a") is name_a
+    hits = cache.hits
+    _ = cache.match(Name, "b")
+    assert cache.hits == hits
+
+
+def test_match_cache_in_base(f2003_create):
+    '''Test that Base.__new__ uses the active cache for fresh string
+    matches.
+
+    '''
+    from fparser.two.Fortran2003 import Assignment_Stmt
+    cache = MatchCache(1000)
+    PARSE_STATE.match_cache = cache
+    try:
+        stmt1 = Assignment_Stmt("x = a * b + a * b")
+        stmt2 = Assignment_Stmt("y = a * b + a * b")
+    finally:
+        PARSE_STATE.match_cache = None
+    assert str(stmt1) == "x = a * b + a * b"
+    assert str(stmt2) == "y = a * b + a * b"
+    assert cache.hits > 0
+    # The common right hand side is shared
+    assert stmt1.items[2] is stmt2.items[2]
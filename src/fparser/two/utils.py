@@ -69,8 +69,15 @@
 # Original author: Pearu Peterson <pearu@cens.ioc.ee>
 # First version created: Oct 2006
 
+import bisect
+import copy
+import os
 import re
 import logging
+import threading
+from collections import OrderedDict
+import six
+from six.moves import intern
 from fparser.common.splitline import string_replace_map
 from fparser.two import pattern_tools as pattern
 from fparser.common.readfortran import FortranReaderBase
@@ -111,6 +118,28 @@ EXTENSIONS += ["hollerith"]
 EXTENSIONS += ["dollar-descriptor"]
 
 
+def get_cache_dir():
+    '''Find the directory in which fparser may keep files that it can
+    re-create if they are lost (e.g. the parse trees kept by a
+    TreeCache). This is the directory given by the FPARSER_CACHE_DIR
+    environment variable if it is set. Otherwise it is the 'fparser'
+    directory within the user's cache directory. Setting
+    FPARSER_CACHE_DIR to an empty string stops fparser from keeping
+    any such files.
+
+    :returns: the path of the directory (which may not exist yet) or \
+              None if fparser should not keep files.
+    :rtype: str or NoneType
+
+    '''
+    cache_dir = os.environ.get("FPARSER_CACHE_DIR")
+    if cache_dir is None:
+        cache_home = os.environ.get("XDG_CACHE_HOME") or \
+            os.path.join(os.path.expanduser("~"), ".cache")
+        cache_dir = os.path.join(cache_home, "fparser")
+    return cache_dir or None
+
+
 class FparserException(Exception):
     '''Base class exception for fparser. This allows an external tool to
     capture all exceptions if required.
@@ -121,6 +150,28 @@ class FparserException(Exception):
     def __init__(self, info):
         Exception.__init__(self, info)
 
+    def __reduce__(self):
+        # The arguments of the constructors of the subclasses are not
+        # the message stored in args so an exception is pickled as its
+        # class and message rather than by calling its constructor.
+        return (_restore_exception, (type(self), self.args), self.__dict__)
+
+
+def _restore_exception(cls, args):
+    '''Re-creates an exception that has been pickled (see
+    :py:meth:`FparserException.__reduce__`).
+
+    :param type cls: the class of the exception.
+    :param tuple args: the arguments stored by the exception.
+
+    :returns: the exception.
+    :rtype: :py:class:`FparserException`
+
+    '''
+    error = cls.__new__(cls)
+    error.args = args
+    return error
+
 
 class NoMatchError(FparserException):
     '''An exception indicating that a particular rule implemented by a
@@ -128,7 +179,75 @@ class NoMatchError(FparserException):
     mean there is an error as another rule may match. This exception
     is used internally so should never be visible externally.
 
+    Most of these errors are caught and discarded while other rules are
+    tried so those raised by Base.__new__ are given a _NoMatchMessage
+    and the text of their message (their `args`) is only put together
+    when it is asked for.
+
+    :param info: a string giving contextual error information.
+    :type info: str or :py:class:`_NoMatchMessage`
+
     '''
+    # The information the message is put together from, if it has not
+    # been yet.
+    _info = None
+
+    def __init__(self, info):
+        if isinstance(info, _NoMatchMessage):
+            FparserException.__init__(self, None)
+            self._info = info
+        else:
+            FparserException.__init__(self, info)
+
+    @property
+    def args(self):
+        ''':returns: the arguments of the exception, i.e. its message.
+        :rtype: tuple of str'''
+        if self._info is not None:
+            BaseException.args.__set__(self, (str(self._info),))
+            self._info = None
+        return BaseException.args.__get__(self)
+
+    @args.setter
+    def args(self, args):
+        BaseException.args.__set__(self, args)
+        self._info = None
+
+    def __str__(self):
+        # The args must be put together before they are shown.
+        _ = self.args
+        return FparserException.__str__(self)
+
+    def __repr__(self):
+        _ = self.args
+        return FparserException.__repr__(self)
+
+
+class _NoMatchMessage(object):
+    '''The information from which the message of a NoMatchError raised
+    by Base.__new__ is put together, when it is asked for.
+
+    :param str cls_name: the name of the class that did not match.
+    :param string: the string or reader that did not match.
+    :type string: str or :py:class:`FortranReaderBase`
+
+    '''
+    __slots__ = ('cls_name', 'string', 'linecount')
+
+    def __init__(self, cls_name, string):
+        self.cls_name = cls_name
+        self.string = string
+        # The line to show if string is a reader.
+        self.linecount = getattr(string, 'linecount', None)
+
+    def __str__(self):
+        if self.linecount is None:
+            return "{0}: '{1}'".format(self.cls_name, self.string)
+        return "at line {0}\n>>>{1}\n".format(
+            self.linecount, self.string.source_lines[self.linecount-1])
+
+    def __repr__(self):
+        return repr(str(self))
 
 
 class FortranSyntaxError(FparserException):
@@ -167,6 +286,290 @@ class InternalError(FparserException):
         FparserException.__init__(self, new_info)
 
 
+class MatchCache(object):
+    '''A bounded packrat cache of match results. Results are keyed on the
+    class being matched and the exact string it is being matched
+    against so that, when the matching of a rule backtracks, any
+    sub-string that has already been matched (or failed to match) with
+    a given class is not parsed again. Once the cache holds `maxsize`
+    results the least recently used one is discarded.
+
+    Note that a node returned from the cache is the same object that
+    was returned the first time the (class, string) pair was matched,
+    i.e. identical sub-expressions within a parse tree may share nodes.
+
+    :param int maxsize: the maximum number of results to keep.
+
+    :raises ValueError: if maxsize is not a positive integer.
+
+    '''
+    def __init__(self, maxsize):
+        if maxsize < 1:
+            raise ValueError(
+                "The size of a MatchCache must be a positive integer but "
+                "got '{0}'.".format(maxsize))
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+
+    def __len__(self):
+        return len(self._results)
+
+    def clear(self):
+        '''Discard all cached results. The hit and miss counts are kept.'''
+        self._results.clear()
+
+    def match(self, cls, string):
+        '''Return the result of matching `string` with class `cls`, using a
+        cached result if one is available.
+
+        :param type cls: the class to match with.
+        :param str string: the string to match.
+
+        :returns: the matched object.
+        :rtype: :py:class:`fparser.two.utils.Base`
+
+        :raises NoMatchError: if `string` does not match `cls`.
+
+        '''
+        key = (cls, string)
+        try:
+            # Removing and re-inserting the entry marks it as the most
+            # recently used one.
+            result = self._results.pop(key)
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            try:
+                # Passing parent_cls stops Base.__new__ from consulting
+                # this cache again.
+                result = Base.__new__(cls, string, parent_cls=[cls])
+            except NoMatchError as error:
+                result = error
+            if len(self._results) >= self.maxsize:
+                self._results.popitem(last=False)
+        self._results[key] = result
+        if isinstance(result, NoMatchError):
+            if result._info is not None:
+                # Its message has not been put together yet.
+                raise NoMatchError(result._info)
+            raise NoMatchError(*result.args)
+        return result
+
+
+class DispatchIndex(object):
+    '''An index from the start of a statement to the classes that might
+    match it. Most statements begin with a keyword (CALL, IF, ALLOCATE,
+    ...) so, when a rule offers a choice between many classes, those
+    that can only match a statement starting with a different keyword
+    need not be tried.
+
+    A statement is identified by its "key": the first two non-blank
+    characters of the line, in upper case, after any construct name.
+    Classes that do not appear in the index may match a statement
+    starting with anything (e.g. an assignment) and are always tried.
+
+    :param dict keys: a mapping from a class to the set of keys of the \
+                      statements it is able to match.
+
+    '''
+    # Matches a construct name at the start of a line (but not the '::'
+    # of a declaration).
+    _construct_name = re.compile(r'\w+\s*:(?!:)').match
+
+    def __init__(self, keys):
+        self._keys = dict(keys)
+
+    def __contains__(self, cls):
+        return cls in self._keys
+
+    def items(self):
+        '''
+        :returns: the classes in this index with their keys.
+        :rtype: list of (type, frozenset of str)
+        '''
+        return list(self._keys.items())
+
+    def keys_of(self, cls):
+        '''
+        :param type cls: a class that matches part of the grammar.
+
+        :returns: the keys of the statements that `cls` is able to match \
+                  or None if `cls` is not restricted to particular keys.
+        :rtype: frozenset of str or NoneType
+
+        '''
+        return self._keys.get(cls)
+
+    @staticmethod
+    def line_key(line):
+        '''
+        :param str line: the content of a line of Fortran.
+
+        :returns: the key identifying the statement held in `line` or \
+                  None if one can not be determined.
+        :rtype: str or NoneType
+
+        '''
+        match = DispatchIndex._construct_name(line)
+        if match:
+            line = line[match.end():]
+        # The first two characters of a keyword may be separated by
+        # white space in fixed-format code.
+        key = "".join(line[:8].split())[:2].upper()
+        if len(key) < 2:
+            return None
+        return key
+
+    def next_key(self, reader):
+        '''Find the key of the next statement provided by a reader. The
+        reader is left unchanged.
+
+        :param reader: the source of the Fortran code.
+        :type reader: :py:class:`fparser.common.readfortran.FortranReaderBase`
+
+        :returns: the key of the next statement or None if the next \
+                  item is not a statement (e.g. it is a comment).
+        :rtype: str or NoneType
+
+        '''
+        from fparser.common.readfortran import Line
+        item = reader.get_item()
+        if item is None:
+            return None
+        reader.put_item(item)
+        if type(item) is not Line:
+            return None
+        return self.line_key(item.line)
+
+    def excludes(self, cls, key):
+        '''
+        :param type cls: a class that matches part of the grammar.
+        :param key: the key of a statement as returned by \
+                    :py:meth:`DispatchIndex.line_key`.
+        :type key: str or NoneType
+
+        :returns: True if `cls` can not match a statement with this key.
+        :rtype: bool
+
+        '''
+        if key is None:
+            return False
+        keys = self._keys.get(cls)
+        return keys is not None and key not in keys
+
+
+class LeafTable(object):
+    '''A table of the leaves of a parse tree, i.e. of the nodes that
+    have no children, such as names and literal constants. When a
+    parser shares leaves (see
+    :py:meth:`fparser.two.parser.ParserFactory.create`) each new leaf
+    is replaced by an identical one (of the same class, with the same
+    string and items) from the table, if there is one, so that there
+    is only one copy of e.g. each name in the tree.
+
+    Statements, blocks and nodes with any other attributes are never
+    shared. A shared leaf appears at several places in the tree so it
+    must not be changed. Code that needs a different leaf must replace
+    it (in the items of its parent) with a new node, or with the copy
+    returned by :py:meth:`LeafTable.unshare`.
+
+    '''
+    # Whether the nodes of each class may be shared.
+    _shareable = {}
+
+    def __init__(self):
+        self._leaves = {}
+
+    def __len__(self):
+        return len(self._leaves)
+
+    def _key(self, node):
+        '''
+        :param node: a node of a parse tree.
+        :type node: :py:class:`fparser.two.utils.Base`
+
+        :returns: the key identifying the node amongst those that may \
+                  be shared, or None if it may not be shared.
+        :rtype: tuple or NoneType
+
+        '''
+        cls = type(node)
+        shareable = self._shareable.get(cls)
+        if shareable is None:
+            shareable = not issubclass(cls, (StmtBase, BlockBase)) and \
+                set(_slot_names(cls)) <= set(Base._NODE_ATTRIBUTES)
+            self._shareable[cls] = shareable
+        if not shareable or node.item is not None or \
+           type(node.string) is not str:
+            return None
+        for name in getattr(node, "__dict__", ()):
+            if name not in Base._NODE_ATTRIBUTES:
+                # The node has other attributes.
+                return None
+        items = getattr(node, "items", None)
+        if items is None:
+            return (cls, node.string)
+        if type(items) is not tuple:
+            return None
+        for item in items:
+            if item is not None and type(item) is not str:
+                return None
+        return (cls, node.string, items)
+
+    def share(self, node):
+        '''
+        :param node: a newly created node.
+        :type node: :py:class:`fparser.two.utils.Base`
+
+        :returns: the shared node identical to `node` or `node` itself \
+                  if it is the first of its kind or may not be shared.
+        :rtype: :py:class:`fparser.two.utils.Base`
+
+        '''
+        key = self._key(node)
+        if key is None:
+            return node
+        return self._leaves.setdefault(key, node)
+
+    def unshare(self, node):
+        '''
+        :param node: a node that is about to be changed.
+        :type node: :py:class:`fparser.two.utils.Base`
+
+        :returns: a copy of `node` if it is shared, otherwise `node` itself.
+        :rtype: :py:class:`fparser.two.utils.Base`
+
+        '''
+        key = self._key(node)
+        if key is not None and self._leaves.get(key) is node:
+            return copy.copy(node)
+        return node
+
+
+class _ParseState(threading.local):
+    '''Per-thread record of the state belonging to the parser that is
+    currently running in that thread (see
+    :py:class:`fparser.two.parser.Parser`). Outside of a parser call
+    all of the attributes take their default (class) values.
+
+    '''
+    # The choices for each class (see Base.subclasses) or None to use
+    # the default ones.
+    subclasses = None
+    # The packrat cache used by Base.__new__, if any.
+    match_cache = None
+    # The index used to skip classes that can not match the next
+    # statement, if any.
+    dispatch_index = None
+    # The table of shared leaves (see LeafTable), if any.
+    leaves = None
+
+
+PARSE_STATE = _ParseState()
+
+
 def show_result(func):
     return func
 
@@ -193,6 +596,7 @@ class ComparableMixin(object):
     See also http://python3porting.com/preparing.html#richcomparisons
     """
     # pylint: disable=too-few-public-methods
+    __slots__ = ()
 
     def _compare(self, other, method):
         """ Call the method, if other is able to be used within it.
@@ -225,6 +629,10 @@ class ComparableMixin(object):
         return self._compare(other, lambda s, o: s <= o)
 
     def __eq__(self, other):
+        if other is self:
+            # Shared nodes (see LeafTable) are often compared with
+            # themselves.
+            return True
         return self._compare(other, lambda s, o: s == o)
 
     def __ge__(self, other):
@@ -234,9 +642,86 @@ class ComparableMixin(object):
         return self._compare(other, lambda s, o: s > o)
 
     def __ne__(self, other):
+        if other is self:
+            return False
         return self._compare(other, lambda s, o: s != o)
 
 
+class _NodeType(type):
+    '''The type of the classes of fparser2 nodes. There are many nodes in
+    a parse tree so they do not each have a __dict__: a class defined in
+    one of the modules of fparser.two that does not list the attributes
+    of its nodes in __slots__ is given an empty __slots__. Nodes then
+    only have the attributes listed in the __slots__ of their classes.
+    Classes defined elsewhere are left as they are, so their nodes have
+    a __dict__ and may be given other attributes.
+
+    '''
+    def __new__(mcs, name, bases, namespace):
+        if "__slots__" not in namespace and \
+           namespace.get("__module__", "").rpartition(".")[0] == \
+           "fparser.two":
+            namespace["__slots__"] = ()
+        return type.__new__(mcs, name, bases, namespace)
+
+
+def _hashable(key):
+    '''
+    :param key: the key with which a node is compared (see \
+                :py:meth:`Base._cmpkey`).
+
+    :returns: the key with any lists (e.g. the content of a block) \
+              replaced by tuples.
+    '''
+    if isinstance(key, (list, tuple)):
+        return tuple(_hashable(item) for item in key)
+    return key
+
+
+def _hashes_kept(key):
+    '''
+    :param key: the key with which a node is compared (see \
+                :py:meth:`Base._cmpkey`), which has been hashed.
+
+    :returns: whether all of the nodes in the key have kept their \
+              hashes, i.e. whether none of them has a list that may \
+              be changed in place below it.
+    :rtype: bool
+    '''
+    if isinstance(key, tuple):
+        return all(_hashes_kept(item) for item in key)
+    if isinstance(key, Base):
+        return getattr(key, "_hash", None) is not None
+    return True
+
+
+# The names of the attributes listed in the __slots__ of each class of
+# node and of its bases (see _slot_names).
+_SLOT_NAMES = {}
+
+
+def _slot_names(cls):
+    '''
+    :param type cls: a class of node.
+
+    :returns: the names of the attributes listed in the __slots__ of \
+              the class and of its bases.
+    :rtype: tuple of str
+    '''
+    names = _SLOT_NAMES.get(cls)
+    if names is None:
+        names = []
+        for base in reversed(cls.__mro__):
+            slots = base.__dict__.get("__slots__", ())
+            if isinstance(slots, str):
+                slots = (slots,)
+            names.extend(name for name in slots
+                         if name not in ("__dict__", "__weakref__"))
+        names = _SLOT_NAMES[cls] = tuple(names)
+    return names
+
+
+@six.add_metaclass(_NodeType)
 class Base(ComparableMixin):
     ''' Base class for Fortran 2003 syntax rules.
 
@@ -246,9 +731,19 @@ class Base(ComparableMixin):
       self.item   - Line instance (holds label) or None.
 
     '''
-    # This dict of subclasses is populated dynamically by code at the end
-    # of this module. That code uses the entries in the
-    # 'subclass_names' list belonging to each class defined in this module.
+    # The attributes that a node may have. Nodes that are not blocks
+    # have items, parent and span are set by SpanIndex and _hash by
+    # __hash__.
+    # Subclasses list any others that their nodes have.
+    __slots__ = _NODE_ATTRIBUTES = (
+        "string", "item", "items", "parent", "span", "_hash")
+
+    # This dict maps the name of each class to a tuple of the classes
+    # it may be matched by. It is created from the 'subclass_names' list
+    # belonging to each class by ParserFactory.create (see
+    # fparser/two/parser.py), which replaces it each time it is called.
+    # A Parser uses its own copy of this dict (see PARSE_STATE) so this
+    # one is only used when classes are used outside of a Parser.
     subclasses = {}
 
     @show_result
@@ -264,6 +759,12 @@ class Base(ComparableMixin):
         """
         from fparser.common import readfortran
         if parent_cls is None:
+            if isinstance(string, str) and \
+               PARSE_STATE.match_cache is not None:
+                # This is a fresh attempt at matching a string (rather
+                # than one of the alternatives of a rule currently being
+                # tried) so its result can be shared via the packrat cache.
+                return PARSE_STATE.match_cache.match(cls, string)
             parent_cls = [cls]
         elif cls not in parent_cls:
             parent_cls.append(cls)
@@ -290,6 +791,9 @@ class Base(ComparableMixin):
                 # No match so give the item back to the reader
                 reader.put_item(item)
                 return
+            if PARSE_STATE.leaves is not None:
+                # The line belongs to this node alone.
+                obj = PARSE_STATE.leaves.unshare(obj)
             obj.item = item
             return obj
 
@@ -300,7 +804,12 @@ class Base(ComparableMixin):
             try:
                 result = cls.match(string)
             except NoMatchError as msg:
-                if str(msg) == '%s: %r' % (cls.__name__, string):
+                # The message of an error that Base.__new__ raised for
+                # another class can not be the one looked for.
+                info = msg._info
+                if not (info is not None and
+                        info.cls_name != cls.__name__) and \
+                   str(msg) == '%s: %r' % (cls.__name__, string):
                     # avoid recursion 1.
                     raise
 
@@ -310,15 +819,29 @@ class Base(ComparableMixin):
             obj.item = None
             if hasattr(cls, 'init'):
                 obj.init(*result)
+            if PARSE_STATE.leaves is not None:
+                return PARSE_STATE.leaves.share(obj)
             return obj
         elif isinstance(result, Base):
             return result
         elif result is None:
             # Loop over the possible sub-classes of this class and
             # check for matches
-            for subcls in Base.subclasses.get(cls.__name__, []):
+            dispatch_index = PARSE_STATE.dispatch_index
+            key = None
+            if dispatch_index is not None and \
+               isinstance(string, FortranReaderBase):
+                key = dispatch_index.next_key(string)
+            subclasses = PARSE_STATE.subclasses
+            if subclasses is None:
+                subclasses = Base.subclasses
+            for subcls in subclasses.get(cls.__name__, ()):
                 if subcls in parent_cls:  # avoid recursion 2.
                     continue
+                if key is not None and dispatch_index.excludes(subcls, key):
+                    # subcls can not match a statement starting like
+                    # the next one.
+                    continue
                 try:
                     obj = subcls(string, parent_cls=parent_cls)
                 except NoMatchError as msg:
@@ -329,29 +852,19 @@ class Base(ComparableMixin):
             raise AssertionError(repr(result))
         # If we get to here then we've failed to match the current line
         if isinstance(string, FortranReaderBase):
-            content = False
-            for index in range(string.linecount):
-                # Check all lines up to this one for content. We
-                # should be able to only check the current line but
-                # but as the line number returned is not always
-                # correct (due to coding errors) we can not assume the
-                # line pointed to is the line where the error actually
-                # happened.
-                if string.source_lines[index].strip():
-                    content = True
-                    break
-            if not content:
+            # Check all lines up to this one for content. We should be
+            # able to only check the current line but as the line
+            # number returned is not always correct (due to coding
+            # errors) we can not assume the line pointed to is the
+            # line where the error actually happened.
+            first_line = string.first_content_line
+            if first_line is None or first_line > string.linecount:
                 # There are no lines in the input or all lines up to
                 # this one are empty or contain only white space. This
                 # is typically accepted by fortran compilers so we
                 # follow their lead and do not raise an exception.
                 return
-            line = string.source_lines[string.linecount-1]
-            errmsg = "at line {0}\n>>>{1}\n".format(
-                string.linecount, line)
-        else:
-            errmsg = "{0}: '{1}'".format(cls.__name__, string)
-        raise NoMatchError(errmsg)
+        raise NoMatchError(_NoMatchMessage(cls.__name__, string))
 
     def init(self, *items):
         self.items = items
@@ -372,6 +885,73 @@ class Base(ComparableMixin):
         """
         return self.items
 
+    def __hash__(self):
+        '''The hash of a node is that of the key with which it is compared
+        (see :py:meth:`Base._cmpkey`) so nodes that are equal have the
+        same hash. It is computed when first needed and then kept until
+        :py:meth:`Base.invalidate_hash` is called. A list may be changed
+        in place without the node that holds it knowing, so the hash of
+        a node with a list in its key, such as a block, or in the key of
+        any node below it, is not kept.
+
+        :returns: the hash of this node.
+        :rtype: int
+
+        '''
+        value = getattr(self, "_hash", None)
+        if value is not None:
+            return value
+        key = self._cmpkey()
+        try:
+            value = hash(key)
+        except TypeError:
+            return hash(_hashable(key))
+        if _hashes_kept(key):
+            self._hash = value
+        return value
+
+    def invalidate_hash(self):
+        '''Forgets the hashes kept by this node, by the nodes below it and
+        by the nodes above it, which depend on them (see
+        :py:meth:`Base.__hash__`). This must be called after changing a
+        node that may have been hashed, or a node below it. The nodes
+        above are found through their parent attributes (see
+        :py:class:`SpanIndex`). If the tree does not have these then
+        call it on the root of the tree (or of the part of it that has
+        been hashed) instead.
+
+        '''
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Base):
+                if getattr(node, "_hash", None) is not None:
+                    node._hash = None
+                stack.extend(getattr(node, "content", None) or ())
+                stack.extend(getattr(node, "items", None) or ())
+            elif isinstance(node, (list, tuple)):
+                stack.extend(node)
+        node = getattr(self, "parent", None)
+        while node is not None:
+            node._hash = None
+            node = getattr(node, "parent", None)
+
+    def __eq__(self, other):
+        if other is not self and isinstance(other, Base):
+            mine = getattr(self, "_hash", None)
+            theirs = getattr(other, "_hash", None)
+            if mine is not None and theirs is not None and \
+               mine != theirs:
+                # Nodes with different hashes can not be equal.
+                return False
+        return ComparableMixin.__eq__(self, other)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
     def tofortran(self, tab='', isfix=None):
         this_str = str(self)
         if this_str.strip():
@@ -384,6 +964,82 @@ class Base(ComparableMixin):
     def restore_reader(self, reader):
         reader.put_item(self.item)
 
+    def __getstate__(self):
+        '''A node created from a reader refers to it rather than to a
+        string. The state of the node does not include the reader so
+        that the node (and the parse tree below it) is detached from
+        the source it was parsed from. Any `item` it has keeps its
+        span, label and construct name (see
+        :py:meth:`fparser.common.readfortran.Line.__getstate__`).
+
+        The parent of the node (see :py:class:`SpanIndex`) is not
+        included either as it would be pickled before the node itself,
+        nor is its hash, which may differ between processes.
+
+        :returns: the attributes of this node without any reader.
+        :rtype: dict
+
+        '''
+        state = dict((name, getattr(self, name))
+                     for name in _slot_names(type(self))
+                     if hasattr(self, name))
+        state.update(getattr(self, "__dict__", ()))
+        state.pop("parent", None)
+        state.pop("_hash", None)
+        if isinstance(state.get("string"), FortranReaderBase):
+            state["string"] = None
+        return state
+
+    def __setstate__(self, state):
+        '''Sets the attributes of an unpickled node.
+
+        :param dict state: the attributes.
+
+        '''
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def __reduce__(self):
+        '''Nodes are created by matching a string so they can not be
+        unpickled by calling their class. Instead they are pickled as
+        their class, the attributes every node has and then any others.
+        Passing the common attributes as arguments keeps the pickled
+        form of a large parse tree compact.
+
+        :returns: how to pickle this node.
+        :rtype: tuple
+
+        '''
+        state = self.__getstate__()
+        args = (type(self), state.pop("string", None), state.pop("item", None))
+        if "items" in state:
+            args += (state.pop("items"),)
+        return (_restore_node, args, state or None)
+
+
+def _restore_node(cls, string, item, items=None):
+    '''Creates a node when unpickling a parse tree (see
+    :py:meth:`Base.__reduce__`).
+
+    :param type cls: the class of the node.
+    :param string: the string the node was matched with, or None.
+    :type string: str or NoneType
+    :param item: the line the node was matched with, or None.
+    :type item: :py:class:`fparser.common.readfortran.Line` or NoneType
+    :param items: the items of the node, or None if it has none.
+    :type items: tuple or NoneType
+
+    :returns: the node, to which any other attributes are then added.
+    :rtype: :py:class:`Base`
+
+    '''
+    obj = object.__new__(cls)
+    obj.string = string
+    obj.item = item
+    if items is not None:
+        obj.items = items
+    return obj
+
 
 class BlockBase(Base):
     """
@@ -396,6 +1052,8 @@ class BlockBase(Base):
 
 content : tuple
     """
+    __slots__ = ("content",)
+
     @staticmethod
     def match(startcls, subclasses, endcls, reader,
               match_labels=False,
@@ -434,149 +1092,171 @@ content : tuple
             add_comments_includes
         assert isinstance(reader, FortranReaderBase), repr(reader)
         content = []
-
-        if startcls is not None:
-            # Deal with any preceding comments and/or includes
-            add_comments_includes(content, reader)
-            # Now attempt to match the start of the block
-            try:
-                obj = startcls(reader)
-            except NoMatchError:
-                obj = None
-            if obj is None:
-                # Ultimately we failed to find a match for the
-                # start of the block so put back any comments that
-                # we processed along the way
-                for obj in reversed(content):
-                    obj.restore_reader(reader)
-                return
-            # Store the index of the start of this block proper (i.e.
-            # excluding any comments)
-            start_idx = len(content)
-            content.append(obj)
-            if enable_do_label_construct_hook:
-                start_label = obj.get_start_label()
-            if match_names:
-                start_name = obj.get_start_name()
-
-        # Comments and Include statements are always valid sub-classes
-        classes = subclasses + [Comment, Include_Stmt]
-        if endcls is not None:
-            classes += [endcls]
-            endcls_all = tuple([endcls]+endcls.subclasses[endcls.__name__])
-
-        # Start trying to match the various subclasses, starting from
-        # the beginning of the list (where else?)
-        i = 0
-        had_match = False
-        found_end = False
-        while i < len(classes):
-            if enable_do_label_construct_hook:
+        # Note where the block starts so that the reader can be
+        # rewound in one go if it does not match. The mark must be
+        # dropped whatever happens.
+        mark = reader.mark()
+        try:
+            if startcls is not None:
+                # Deal with any preceding comments and/or includes
+                add_comments_includes(content, reader)
+                # Now attempt to match the start of the block
                 try:
                     obj = startcls(reader)
                 except NoMatchError:
                     obj = None
-                if obj is not None:
-                    if start_label == obj.get_start_label():
-                        content.append(obj)
-                        continue
-                    else:
-                        obj.restore_reader(reader)
-            # Attempt to match the i'th subclass
-            cls = classes[i]
-            try:
-                obj = cls(reader)
-            except NoMatchError:
-                obj = None
-            if obj is None:
-                # No match for this class, continue checking the list
-                # starting from the i+1'th...
-                i += 1
-                continue
-
-            # We got a match for this class
-            had_match = True
-            content.append(obj)
-
-            if match_names and isinstance(obj, match_name_classes):
-                end_name = obj.get_end_name()
-                if end_name and not start_name:
-                    raise FortranSyntaxError(
-                        reader, "Name '{0}' has no corresponding starting "
-                        "name".format(end_name))
-                if end_name and start_name and \
-                   end_name.lower() != start_name.lower():
-                    raise FortranSyntaxError(
-                        reader, "Expecting name '{0}'".format(start_name))
-
-            if endcls is not None and isinstance(obj, endcls_all):
-                if match_labels:
-                    start_label, end_label = content[start_idx].\
-                                             get_start_label(),\
-                                             content[-1].get_end_label()
-                    if start_label != end_label:
-                        continue
+                if obj is None:
+                    # Ultimately we failed to find a match for the
+                    # start of the block so put back any comments that
+                    # we processed along the way
+                    reader.reset(mark)
+                    return
+                # Store the index of the start of this block proper (i.e.
+                # excluding any comments)
+                start_idx = len(content)
+                content.append(obj)
+                if enable_do_label_construct_hook:
+                    start_label = obj.get_start_label()
                 if match_names:
-                    start_name, end_name = content[start_idx].\
-                                           get_start_name(), \
-                                           content[-1].get_end_name()
-                    if set_unspecified_end_name and end_name is None and \
-                       start_name is not None:
-                        content[-1].set_name(start_name)
-                    elif end_name and not start_name:
+                    start_name = obj.get_start_name()
+
+            # Comments and Include statements are always valid sub-classes
+            classes = subclasses + [Comment, Include_Stmt]
+            if endcls is not None:
+                classes += [endcls]
+                subclasses_table = PARSE_STATE.subclasses
+                if subclasses_table is None:
+                    subclasses_table = Base.subclasses
+                endcls_all = (endcls,) + tuple(
+                    subclasses_table.get(endcls.__name__, ()))
+
+            dispatch_index = PARSE_STATE.dispatch_index
+
+            # Start trying to match the various subclasses, starting from
+            # the beginning of the list (where else?)
+            i = 0
+            had_match = False
+            found_end = False
+            while i < len(classes):
+                if enable_do_label_construct_hook:
+                    try:
+                        obj = startcls(reader)
+                    except NoMatchError:
+                        obj = None
+                    if obj is not None:
+                        if start_label == obj.get_start_label():
+                            content.append(obj)
+                            continue
+                        else:
+                            obj.restore_reader(reader)
+                # Attempt to match the i'th subclass
+                cls = classes[i]
+                if dispatch_index is not None and \
+                   cls in dispatch_index and \
+                   dispatch_index.excludes(cls,
+                                           dispatch_index.next_key(reader)):
+                    # cls can not match a statement starting like the
+                    # next one.
+                    obj = None
+                else:
+                    try:
+                        obj = cls(reader)
+                    except NoMatchError:
+                        obj = None
+                if obj is None:
+                    # No match for this class, continue checking the list
+                    # starting from the i+1'th...
+                    i += 1
+                    continue
+
+                # We got a match for this class
+                had_match = True
+                content.append(obj)
+
+                if match_names and isinstance(obj, match_name_classes):
+                    end_name = obj.get_end_name()
+                    if end_name and not start_name:
                         raise FortranSyntaxError(
                             reader, "Name '{0}' has no corresponding starting "
                             "name".format(end_name))
-                    elif start_name and end_name and (start_name.lower() !=
-                                                      end_name.lower()):
+                    if end_name and start_name and \
+                       end_name.lower() != start_name.lower():
                         raise FortranSyntaxError(
                             reader, "Expecting name '{0}'".format(start_name))
-                # We've found the enclosing end statement so break out
-                found_end = True
-                break
-            # Return to start of classes list now that we've matched
-            i = 0
-            if enable_if_construct_hook:
-                from fparser.two.Fortran2003 import Else_If_Stmt, Else_Stmt, \
-                    End_If_Stmt
-                if isinstance(obj, Else_If_Stmt):
-                    # Got an else-if so go back to start of possible
-                    # classes to match
-                    i = 0
-                if isinstance(obj, (Else_Stmt, End_If_Stmt)):
-                    # Found end-if
-                    enable_if_construct_hook = False
-            if enable_where_construct_hook:
-                from fparser.two.Fortran2003 import Masked_Elsewhere_Stmt, \
-                    Elsewhere_Stmt, End_Where_Stmt
-                if isinstance(obj, Masked_Elsewhere_Stmt):
-                    i = 0
-                if isinstance(obj, (Elsewhere_Stmt, End_Where_Stmt)):
-                    enable_where_construct_hook = False
-            if enable_select_type_construct_hook:
-                from fparser.two.Fortran2003 import Type_Guard_Stmt, \
-                    End_Select_Type_Stmt
-                if isinstance(obj, Type_Guard_Stmt):
-                    i = 1
-                if isinstance(obj, End_Select_Type_Stmt):
-                    enable_select_type_construct_hook = False
-            if enable_case_construct_hook:
-                from fparser.two.Fortran2003 import Case_Stmt, \
-                    End_Select_Stmt
-                if isinstance(obj, Case_Stmt):
-                    i = 1
-                if isinstance(obj, End_Select_Stmt):
-                    enable_case_construct_hook = False
-            continue
 
-        if not had_match or endcls and not found_end:
-            # We did not get a match from any of the subclasses or
-            # failed to find the endcls
-            if endcls is not None:
-                for obj in reversed(content):
-                    obj.restore_reader(reader)
-                return
+                if endcls is not None and isinstance(obj, endcls_all):
+                    if match_labels:
+                        start_label = content[start_idx].get_start_label()
+                        end_label = content[-1].get_end_label()
+                        if start_label != end_label:
+                            continue
+                    if match_names:
+                        start_name, end_name = content[start_idx].\
+                                               get_start_name(), \
+                                               content[-1].get_end_name()
+                        if set_unspecified_end_name and end_name is None and \
+                           start_name is not None:
+                            content[-1].set_name(start_name)
+                        elif end_name and not start_name:
+                            raise FortranSyntaxError(
+                                reader, "Name '{0}' has no corresponding "
+                                "starting name".format(end_name))
+                        elif start_name and end_name and \
+                                start_name.lower() != end_name.lower():
+                            raise FortranSyntaxError(
+                                reader,
+                                "Expecting name '{0}'".format(start_name))
+                    # We've found the enclosing end statement so break out
+                    found_end = True
+                    break
+                # Return to start of classes list now that we've matched
+                i = 0
+                if enable_if_construct_hook:
+                    from fparser.two.Fortran2003 import Else_If_Stmt, \
+                        Else_Stmt, End_If_Stmt
+                    if isinstance(obj, Else_If_Stmt):
+                        # Got an else-if so go back to start of possible
+                        # classes to match
+                        i = 0
+                    if isinstance(obj, (Else_Stmt, End_If_Stmt)):
+                        # Found end-if
+                        enable_if_construct_hook = False
+                if enable_where_construct_hook:
+                    from fparser.two.Fortran2003 import \
+                        Masked_Elsewhere_Stmt, Elsewhere_Stmt, End_Where_Stmt
+                    if isinstance(obj, Masked_Elsewhere_Stmt):
+                        i = 0
+                    if isinstance(obj, (Elsewhere_Stmt, End_Where_Stmt)):
+                        enable_where_construct_hook = False
+                if enable_select_type_construct_hook:
+                    from fparser.two.Fortran2003 import Type_Guard_Stmt, \
+                        End_Select_Type_Stmt
+                    if isinstance(obj, Type_Guard_Stmt):
+                        i = 1
+                    if isinstance(obj, End_Select_Type_Stmt):
+                        enable_select_type_construct_hook = False
+                if enable_case_construct_hook:
+                    from fparser.two.Fortran2003 import Case_Stmt, \
+                        End_Select_Stmt
+                    if isinstance(obj, Case_Stmt):
+                        i = 1
+                    if isinstance(obj, End_Select_Stmt):
+                        enable_case_construct_hook = False
+                continue
 
+            if not had_match or endcls and not found_end:
+                # We did not get a match from any of the subclasses or
+                # failed to find the endcls
+                if endcls is not None:
+                    reader.reset(mark)
+                    return
+        except Exception:
+            # Keep the items that have been read (as they are when the
+            # error is raised without a mark) but drop the mark.
+            reader.commit(mark)
+            raise
+
+        reader.commit(mark)
         if not content:
             return
         if startcls is not None and endcls is not None:
@@ -646,6 +1326,8 @@ class SequenceBase(Base):
 ::
     <sequence-base> = <obj>, <obj> [ , <obj> ]...
     """
+    __slots__ = ("separator",)
+
     def match(separator, subcls, string):
         line, repmap = string_replace_map(string)
         if isinstance(separator, str):
@@ -752,7 +1434,27 @@ class BinaryOpBase(Base):
     match = staticmethod(match)
 
     def tostr(self):
-        return '%s %s %s' % tuple(self.items)
+        # Long operator chains (e.g. sums) nest on the left, so walk
+        # down them here rather than recursing once per operator.
+        node = self
+        rhs = []
+        while isinstance(node, BinaryOpBase):
+            rhs.append('%s %s' % node.items[1:])
+            node = node.items[0]
+        rhs.append(str(node))
+        return ' '.join(reversed(rhs))
+
+    def torepr(self):
+        nodes = []
+        node = self
+        while isinstance(node, BinaryOpBase):
+            nodes.append(node)
+            node = node.items[0]
+        result = repr(node)
+        for node in reversed(nodes):
+            result = '%s(%s, %r, %r)' % (
+                node.__class__.__name__, result, node.items[1], node.items[2])
+        return result
 
 
 class SeparatorBase(Base):
@@ -1055,6 +1757,10 @@ string
     match = staticmethod(match)
 
     def init(self, string):
+        # Names and keywords are repeated throughout the code so only
+        # one copy of each is kept.
+        if type(string) is str:
+            string = intern(string)
         self.string = string
         return
 
@@ -1177,6 +1883,8 @@ class EndStmtBase(StmtBase):
 ::
     <end-stmt-base> = END [ <stmt> [ <stmt-name>] ]
     """
+    __slots__ = ("type", "name")
+
     @staticmethod
     def match(stmt_type, stmt_name, string, require_stmt_type=False):
         start = string[:3].upper()
@@ -1402,6 +2110,108 @@ class Type_Declaration_StmtBase(StmtBase):
             return '%s, %s :: %s' % self.items
 
 
+def _list_match(namespace, name):
+    '''
+    :param dict namespace: the namespace of a module defining classes.
+    :param str name: the name of a class in `namespace`.
+
+    :returns: a match method for a `<name>_List` class, which matches a \
+              comma-separated list of `name`. `name` is looked up when \
+              the method is called as the class may not exist yet.
+    :rtype: staticmethod
+
+    '''
+    def match(string):
+        ''' Match a comma-separated list. '''
+        return SequenceBase.match(r',', namespace[name], string)
+    return staticmethod(match)
+
+
+def generate_classes(namespace):
+    '''Generate the classes of the form '*_List', '*_Name' and
+    'Scalar_*' that are named in the `subclass_names` or `use_names` of
+    the classes in a module but that are not defined in that module.
+    These classes are written in a generic, boiler-plate way (see
+    rules R101-R103) so they are generated rather than written by hand.
+    The new classes are added to the module's namespace.
+
+    :param dict namespace: the namespace of the module (as returned by \
+                           `globals()` in that module).
+
+    '''
+    module_name = namespace['__name__']
+    names = sorted(namespace)
+    known_names = set(names)
+    # Any class generated here is also examined (as it is added to
+    # names) as it may name further classes to generate.
+    for clsname in names:
+        cls = namespace[clsname]
+        if not (isinstance(cls, type) and issubclass(cls, Base) and
+                not cls.__name__.endswith('Base')):
+            continue
+        for name in getattr(cls, 'subclass_names', []) + \
+                getattr(cls, 'use_names', []):
+            if name in known_names:
+                continue
+            if name.endswith('_List'):
+                new_cls = type(name, (SequenceBase,), {
+                    '__module__': module_name,
+                    'subclass_names': [name[:-5]],
+                    'use_names': [],
+                    'match': _list_match(namespace, name[:-5])})
+            elif name.endswith('_Name'):
+                new_cls = type(name, (Base,), {
+                    '__module__': module_name,
+                    'subclass_names': ['Name']})
+            elif name.startswith('Scalar_'):
+                new_cls = type(name, (Base,), {
+                    '__module__': module_name,
+                    'subclass_names': [name[7:]]})
+            else:
+                continue
+            namespace[name] = new_cls
+            names.append(name)
+            known_names.add(name)
+
+
+def walk(node_list, types=None, prune=None):
+    '''
+    Walk down the trees produced by fparser2, generating the nodes of
+    the specified type(s) as they are reached. Nodes are generated in
+    the same (depth-first) order as walk_ast returns them. A stack of
+    iterators is used rather than recursion so that the depth of a
+    tree is not limited by the recursion limit.
+
+    :param node_list: the nodes from which to walk.
+    :type node_list: list of :py:class:`fparser.two.utils.Base`
+    :param types: the type(s) of node to generate, including their \
+                  subclasses. (Default is to generate all nodes.)
+    :type types: type or tuple of type
+    :param prune: a function that is given each node and returns \
+                  whether the nodes below it are not to be walked.
+    :type prune: function or NoneType
+
+    :returns: a generator of nodes.
+    :rtype: generator of :py:class:`fparser.two.utils.Base`
+    '''
+    stack = [iter(node_list)]
+    while stack:
+        for child in stack[-1]:
+            if types is None or isinstance(child, types):
+                yield child
+            if prune and prune(child):
+                continue
+            # See walk_ast.
+            children = getattr(child, "content", None)
+            if children is None:
+                children = getattr(child, "items", None)
+            if children:
+                stack.append(iter(children))
+                break
+        else:
+            stack.pop()
+
+
 def walk_ast(children, my_types=None, indent=0, debug=False):
     '''
     Walk down the tree produced by fparser2 where children
@@ -1419,26 +2229,269 @@ def walk_ast(children, my_types=None, indent=0, debug=False):
     :returns: a list of nodes
     :rtype: `list` of :py:class:`fparser.two.utils.Base`
     '''
+    if my_types is not None:
+        my_types = frozenset(my_types)
     local_list = []
-    for child in children:
-        if debug:
-            if isinstance(child, str):
-                print(indent*"  " + "child type = ", type(child), repr(child))
+    # The iterators over the children of the nodes being walked, used
+    # rather than recursion so that the depth of the tree is not
+    # limited by the recursion limit.
+    stack = [iter(children)]
+    while stack:
+        for child in stack[-1]:
+            if debug:
+                prefix = (indent + len(stack) - 1)*"  " + "child type = "
+                if isinstance(child, str):
+                    print(prefix, type(child), repr(child))
+                else:
+                    print(prefix, type(child))
+            if my_types is None or type(child) in my_types:
+                local_list.append(child)
+
+            # Depending on their level in the tree produced by fparser2003,
+            # some nodes have children listed in .content and some have them
+            # listed under .items. If a node has neither then it has no
+            # children.
+            grandchildren = getattr(child, "content", None)
+            if grandchildren is None:
+                grandchildren = getattr(child, "items", None)
+            if grandchildren:
+                stack.append(iter(grandchildren))
+                break
+        else:
+            stack.pop()
+    return local_list
+
+
+class TypeIndex(object):
+    '''
+    An index of the nodes of the trees produced by fparser2 by their
+    type, built in a single walk of the trees. Finding the nodes of a
+    type then takes time in proportion to the number found rather than
+    to the size of the trees. The index is not updated if the trees
+    are changed.
+
+    :param node_list: the nodes from which to walk.
+    :type node_list: list of :py:class:`fparser.two.utils.Base`
+    '''
+    def __init__(self, node_list):
+        # The nodes of each type and their positions in the walk.
+        self._nodes = {}
+        for position, node in enumerate(walk(node_list)):
+            try:
+                positions, nodes = self._nodes[type(node)]
+            except KeyError:
+                positions, nodes = self._nodes[type(node)] = ([], [])
+            positions.append(position)
+            nodes.append(node)
+
+    def __len__(self):
+        return sum(len(nodes) for _, nodes in self._nodes.values())
+
+    def find(self, types):
+        '''
+        :param types: the type(s) of node to find, including their \
+                      subclasses.
+        :type types: type or tuple of type
+
+        :returns: the nodes found, in the order that walk generates them.
+        :rtype: list of :py:class:`fparser.two.utils.Base`
+        '''
+        found = [self._nodes[cls] for cls in self._nodes
+                 if issubclass(cls, types)]
+        if len(found) == 1:
+            return list(found[0][1])
+        return [node for _, node in
+                sorted((position, node) for positions, nodes in found
+                       for position, node in zip(positions, nodes))]
+
+
+def _statement_columns(line):
+    '''
+    :param str line: a line of Fortran source.
+
+    :returns: the column (index in the line) at which each statement on \
+              the line (separated by semicolons) starts and the column \
+              of the comment at the end of the line, or None if there \
+              is none.
+    :rtype: (list of int, int or NoneType)
+    '''
+    columns = []
+    start = 0
+    quote = None
+    comment = None
+    for column, char in enumerate(line):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char in ";!":
+            if line[start:column].strip():
+                columns.append(len(line) - len(line[start:].lstrip()))
+            start = column + 1
+            if char == "!":
+                comment = column
+                break
+    else:
+        if line[start:].strip():
+            columns.append(len(line) - len(line[start:].lstrip()))
+    return columns, comment
+
+
+class SpanIndex(object):
+    '''
+    An index of the nodes of a tree produced by fparser2 by the lines
+    of source that they were created from. Building the index walks the
+    tree once and gives every node in it (that is an instance of Base)
+
+    * a `parent` attribute: the node that it is a child of, or None for
+      the root of the tree, and
+    * a `span` attribute: the numbers of the first and last lines of
+      source that it was created from, or None if they are not known.
+
+    Statements and comments take their span from the lines that they
+    were read from, constructs and other nodes made up of statements
+    take it from the first and last of their statements, and the parts
+    of a statement take the span of the statement. Lines are those of
+    the file that a statement was read from, which for an included
+    file is not the file being parsed. Note that, when the match cache
+    is used or leaves are shared (see LeafTable), identical parts of a
+    statement may be shared by more than one statement and so have the
+    parent and span of just one of them.
+
+    The lines that a node was created from are then found by bisecting
+    the sorted spans of the statements and comments, and the nodes
+    that contain them by following the parents of those. When several
+    statements were read from a line (separated by semicolons) a
+    column tells them apart. Columns are found from the source line
+    when it is looked up, so only for statements that are on a single
+    line. The parts of a statement, such as the action of a one-line
+    IF statement, do not have columns. The index is not updated if
+    the tree changes.
+
+    :param tree: the root of the tree.
+    :type tree: :py:class:`fparser.two.utils.Base`
+    '''
+    def __init__(self, tree):
+        self.tree = tree
+        # The nodes in the order walk() generates them.
+        nodes = []
+        stack = [(tree, None)]
+        while stack:
+            node, parent = stack.pop()
+            if not isinstance(node, Base):
+                continue
+            node.parent = parent
+            item = getattr(node, "item", None)
+            node.span = item.span if item is not None else None
+            nodes.append(node)
+            children = getattr(node, "content", None)
+            if children is None:
+                children = getattr(node, "items", ())
+            stack.extend((child, node) for child in reversed(children))
+        # The children of a node come after it in the walk, so going
+        # backwards gives the span of each node before it is needed by
+        # its parent.
+        for node in reversed(nodes):
+            parent = node.parent
+            if node.span is None or parent is None or \
+               getattr(parent, "item", None) is not None:
+                continue
+            if parent.span is None:
+                parent.span = node.span
             else:
-                print(indent*"  " + "child type = ", type(child))
-        if my_types is None or type(child) in my_types:
-            local_list.append(child)
-
-        # Depending on their level in the tree produced by fparser2003,
-        # some nodes have children listed in .content and some have them
-        # listed under .items. If a node has neither then it has no
-        # children.
-        if hasattr(child, "content"):
-            local_list += walk_ast(child.content, my_types, indent+1, debug)
-        elif hasattr(child, "items"):
-            local_list += walk_ast(child.items, my_types, indent+1, debug)
+                parent.span = (min(parent.span[0], node.span[0]),
+                               max(parent.span[1], node.span[1]))
+        for node in nodes:
+            if node.span is None and node.parent is not None:
+                node.span = node.parent.span
+        lines = sorted((node.span[0], position, node)
+                       for position, node in enumerate(nodes)
+                       if getattr(node, "item", None) is not None)
+        self._starts = [start for start, _, _ in lines]
+        self._nodes = [node for _, _, node in lines]
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def _column_index(self, line, column, first, last):
+        '''
+        :param int line: the number of a line of source.
+        :param int column: a column (index) in the line.
+        :param int first: the index of the first of the statements and \
+                          comments that start on the line.
+        :param int last: the index of the last of them.
+
+        :returns: the index of the one of them that is at the column, \
+                  or `first` if this can not be told from the line.
+        :rtype: int
+        '''
+        nodes = self._nodes[first:last + 1]
+        if any(node.span != (line, line) for node in nodes):
+            return first
+        try:
+            text = nodes[0].item.reader.source_lines[line - 1]
+        except (AttributeError, IndexError):
+            # The tree no longer has its reader (e.g. it was pickled).
+            return first
+        columns, comment = _statement_columns(text)
+        if comment is not None and len(nodes) == len(columns) + 1:
+            columns.append(comment)
+        if len(nodes) != len(columns):
+            return first
+        return first + max(0, bisect.bisect_right(columns, column) - 1)
+
+    def node_at(self, line, column=None):
+        '''
+        :param int line: the number of a line of source.
+        :param int column: the column (index, with tabs expanded) in \
+            the line of the statement to return when there are several \
+            on the line. (Default is the first.)
+
+        :returns: the statement or comment that was created from the \
+                  line (and column), or None if there is none, e.g. for \
+                  a blank line.
+        :rtype: :py:class:`fparser.two.utils.Base` or NoneType
+        '''
+        index = bisect.bisect_right(self._starts, line) - 1
+        if index < 0:
+            return None
+        # Statements separated by semicolons start on the same line.
+        first = bisect.bisect_left(self._starts, self._starts[index])
+        if self._nodes[first].span[1] < line:
+            return None
+        if column is not None and index > first:
+            first = self._column_index(line, column, first, index)
+        return self._nodes[first]
 
-    return local_list
+    def enclosing(self, line, types=None, column=None):
+        '''
+        :param int line: the number of a line of source.
+        :param types: the type(s) of node to look for, including their \
+                      subclasses. (Default is any type of node.)
+        :type types: type or tuple of type
+        :param int column: the column (index) in the line, which tells \
+            apart statements on the same line (see \
+            :py:meth:`SpanIndex.node_at`). (Default is the last of \
+            them.)
+
+        :returns: the innermost node of the type(s) whose span includes \
+                  the line (and column), or None if there is none.
+        :rtype: :py:class:`fparser.two.utils.Base` or NoneType
+        '''
+        index = bisect.bisect_right(self._starts, line) - 1
+        if column is not None and index > 0:
+            first = bisect.bisect_left(self._starts, self._starts[index])
+            if index > first:
+                index = self._column_index(line, column, first, index)
+        node = self._nodes[index] if index >= 0 else self.tree
+        while node is not None:
+            if node.span is not None and \
+               node.span[0] <= line <= node.span[1] and \
+               (types is None or isinstance(node, types)):
+                return node
+            node = node.parent
+        return None
 
 
 def get_child(root_node, node_type):